@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+"""Measures the import time of the qiita_client modules
+
+Each module is imported in a fresh interpreter started with
+`python -X importtime`, and the cumulative time reported for the module is
+collected. The median over all the repetitions is reported, and if
+`--max-ms` is provided the script exits with a non-zero status when any of
+the medians is above it, so it can be used as a regression check.
+"""
+
+from subprocess import Popen, PIPE
+import argparse
+import sys
+
+MODULES = ['qiita_client', 'qiita_client.util']
+
+
+def import_time(module):
+    """Returns the cumulative import time of `module`, in microseconds"""
+    proc = Popen([sys.executable, '-X', 'importtime', '-c',
+                  'import %s' % module], stdout=PIPE, stderr=PIPE,
+                 universal_newlines=True)
+    _, stderr = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError("Couldn't import %s:\n%s" % (module, stderr))
+    for line in stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])
+    raise RuntimeError("Import time of %s not reported" % module)
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--repeat', type=int, default=10,
+                        help='Number of times each module is imported')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Fail if any median import time is above this')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module in args.modules:
+        obs = median([import_time(module) for _ in range(args.repeat)])
+        obs_ms = obs / 1000.0
+        print('%-25s %8.1f ms' % (module, obs_ms))
+        if args.max_ms is not None and obs_ms > args.max_ms:
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+"""Simulates many concurrent plugin jobs against a Qiita server
+
+Each simulated job follows the sequence of requests of a plugin job: it
+authenticates, retrieves the job information, sends the first heartbeat,
+updates the job step in bursts (sending a heartbeat after each burst) and
+completes the job. The jobs are executed by a pool of threads or processes,
+against the Qiita server given with `--server` or, by default, against an
+in-process `qiita_client.fake_qiita.FakeQiitaServer`.
+
+The request rate, the latency percentiles and the error rate of each
+endpoint are reported, together with the CPU time and the peak memory of the
+client.
+"""
+
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from json import dumps
+from time import time
+from os import environ
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+import argparse
+import resource
+import re
+import sys
+
+from qiita_client import QiitaClient
+from qiita_client.fake_qiita import FakeQiitaServer
+
+PERCENTILES = [50, 90, 99]
+
+
+class TimedQiitaClient(QiitaClient):
+    """QiitaClient recording the latency of every request"""
+    def __init__(self, *args, **kwargs):
+        self.timings = []
+        super(TimedQiitaClient, self).__init__(*args, **kwargs)
+
+    def _timed(self, endpoint, func, *args, **kwargs):
+        start = time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.timings.append((endpoint, time() - start, False))
+            raise
+        self.timings.append((endpoint, time() - start, True))
+        return result
+
+    def _fetch_token(self):
+        return self._timed('POST /qiita_db/authenticate/',
+                           super(TimedQiitaClient, self)._fetch_token)
+
+    def _request_retry(self, req, url, **kwargs):
+        endpoint = '%s %s' % (req.__name__.upper(),
+                              re.sub(r'/jobs/[^/]+', '/jobs/<id>', url))
+        return self._timed(endpoint,
+                           super(TimedQiitaClient, self)._request_retry,
+                           req, url, **kwargs)
+
+
+def simulate_job(task):
+    """Executes the requests of a plugin job
+
+    Parameters
+    ----------
+    task : (str, str, str, str, str, int, int)
+        The server url, the server certificate, the client id, the client
+        secret, the job id, the number of step bursts and the number of steps
+        per burst
+
+    Returns
+    -------
+    list of (str, float, bool)
+        The endpoint, the latency in seconds and whether it succeeded of each
+        request
+    """
+    url, cert, client_id, client_secret, job_id, bursts, steps = task
+    try:
+        qclient = TimedQiitaClient(url, client_id, client_secret,
+                                   server_cert=cert)
+    except Exception:
+        return [('POST /qiita_db/authenticate/', 0, False)]
+    try:
+        qclient.get_job_info(job_id)
+        heartbeat_url = '/qiita_db/jobs/%s/heartbeat/' % job_id
+        qclient.post(heartbeat_url, data='')
+        for burst in range(bursts):
+            for step in range(steps):
+                qclient.update_job_step(job_id, 'Step %d.%d' % (burst, step))
+            qclient.post(heartbeat_url, data='')
+        qclient.complete_job(job_id, True)
+    except Exception:
+        # The failed request is already recorded, the job is abandoned
+        pass
+    return qclient.timings
+
+
+def percentile(values, p):
+    """Returns the p-th percentile of `values` (nearest rank)"""
+    values = sorted(values)
+    rank = max(int(round(p / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(timings, elapsed):
+    """Summarizes the request timings
+
+    Parameters
+    ----------
+    timings : list of (str, float, bool)
+        The endpoint, the latency in seconds and the outcome of each request
+    elapsed : float
+        The wall-clock duration of the test in seconds
+
+    Returns
+    -------
+    dict
+        The summary of all the requests and of each endpoint
+    """
+    def stats(records):
+        latencies = [t for _, t, _ in records]
+        errors = sum(1 for _, _, ok in records if not ok)
+        summary = {'requests': len(records),
+                   'rate': len(records) / elapsed if elapsed else 0,
+                   'errors': errors,
+                   'error_rate': errors / float(len(records))}
+        for p in PERCENTILES:
+            summary['p%d_ms' % p] = percentile(latencies, p) * 1000
+        summary['max_ms'] = max(latencies) * 1000
+        return summary
+
+    by_endpoint = {}
+    for record in timings:
+        by_endpoint.setdefault(record[0], []).append(record)
+
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF,
+                                                 resource.RUSAGE_CHILDREN)]
+    return {'elapsed': elapsed,
+            'total': stats(timings),
+            'endpoints': {e: stats(r) for e, r in by_endpoint.items()},
+            # Note that the CPU time includes the in-process server, if used
+            'cpu_s': sum(u.ru_utime + u.ru_stime for u in usage),
+            # ru_maxrss is in KB on Linux
+            'max_rss_mb': max(u.ru_maxrss for u in usage) / 1024.0}
+
+
+def print_summary(summary, jobs):
+    header = '%-40s %8s %9s %8s %8s %8s %8s %7s' % (
+        'endpoint', 'requests', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms',
+        'max ms', 'errors')
+    print(header)
+    print('-' * len(header))
+    rows = sorted(summary['endpoints'].items())
+    rows.append(('total', summary['total']))
+    for endpoint, s in rows:
+        print('%-40s %8d %9.1f %8.1f %8.1f %8.1f %8.1f %6.2f%%' % (
+            endpoint, s['requests'], s['rate'], s['p50_ms'], s['p90_ms'],
+            s['p99_ms'], s['max_ms'], 100 * s['error_rate']))
+    print('')
+    print('%d jobs in %.2f s (%.1f jobs/s)' % (
+        jobs, summary['elapsed'], jobs / summary['elapsed']))
+    print('Client CPU time: %.2f s, peak memory: %.1f MB' % (
+        summary['cpu_s'], summary['max_rss_mb']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--jobs', type=int, default=1000,
+                        help='Number of simulated jobs')
+    parser.add_argument('-c', '--concurrency', type=int, default=50,
+                        help='Number of jobs executed concurrently')
+    parser.add_argument('--mode', choices=['threads', 'processes'],
+                        default='threads',
+                        help='Whether the jobs run in threads or processes')
+    parser.add_argument('--bursts', type=int, default=3,
+                        help='Number of step update bursts per job')
+    parser.add_argument('--steps', type=int, default=5,
+                        help='Number of step updates per burst')
+    parser.add_argument('--server', default=None,
+                        help='Url of the Qiita server. Default: start a '
+                             'fake server in this process')
+    parser.add_argument('--server-cert', default=None)
+    parser.add_argument('--client-id', default='load_test')
+    parser.add_argument('--client-secret', default='load_test')
+    parser.add_argument('--command', default=None,
+                        help='JSON [plugin, version, command] of the jobs '
+                             'created in a real server')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Latency of the fake server, in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='Failure rate of the fake server')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='Limit the requests per second of all the jobs '
+                             'with a shared qiita_client.ratelimit bucket')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the summary as JSON')
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.server is None:
+        server = FakeQiitaServer(latency=args.latency,
+                                 failure_rate=args.failure_rate).start()
+        url = server.url
+        job_ids = [server.add_job('LoadTest', {})
+                   for _ in range(args.jobs)]
+    else:
+        if args.command is None:
+            parser.error('--command is required with --server')
+        url = args.server
+        qclient = QiitaClient(url, args.client_id, args.client_secret,
+                              server_cert=args.server_cert)
+        job_ids = [qclient.post('/apitest/processing_job/',
+                                data={'command': args.command,
+                                      'parameters': dumps({}),
+                                      'status': 'queued'})['job']
+                   for _ in range(args.jobs)]
+
+    rate_dir = None
+    if args.rate_limit:
+        # Read by the QiitaClients of the jobs, in threads or processes
+        rate_dir = mkdtemp()
+        environ['QIITA_CLIENT_RATE_LIMIT'] = str(args.rate_limit)
+        environ['QIITA_CLIENT_RATE_LIMIT_FILE'] = join(rate_dir, 'bucket')
+
+    tasks = [(url, args.server_cert, args.client_id, args.client_secret,
+              job_id, args.bursts, args.steps) for job_id in job_ids]
+    pool = (ThreadPool if args.mode == 'threads' else Pool)(args.concurrency)
+    start = time()
+    try:
+        results = pool.map(simulate_job, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time() - start
+
+    if server is not None:
+        server.stop()
+    if rate_dir is not None:
+        rmtree(rate_dir)
+
+    summary = summarize([t for r in results for t in r], elapsed)
+    if args.json:
+        print(dumps(summary, indent=4, sort_keys=True))
+    else:
+        print_summary(summary, args.jobs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
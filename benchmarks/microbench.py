@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+"""Microbenchmarks of the qiita_client hot paths
+
+`run` executes the benchmarks and reports the median time per call of each
+of them, optionally storing the results in a JSON file (the baselines of the
+releases are stored in benchmarks/baselines/). `compare` compares the
+results with a baseline and exits with a non-zero status if any benchmark is
+slower than the baseline by more than the given threshold.
+
+All the benchmarks run offline: the client ones use an in-process
+`qiita_client.fake_qiita.FakeQiitaServer`.
+"""
+
+from json import dumps, loads
+from os.path import join, dirname, abspath
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import Timer
+import argparse
+import platform
+import fnmatch
+import sys
+
+# The benchmarks directory is not a package: make import_time importable
+# whether this file is run as a script or imported from elsewhere
+sys.path.insert(0, dirname(abspath(__file__)))
+from import_time import import_time, median  # noqa: E402
+
+# The registered benchmarks, as (name, setup) in execution order. `setup`
+# receives a temporary directory and returns the callable to time
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Registers a benchmark setup function"""
+    def decorator(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return decorator
+
+
+class ImportTime(object):
+    """Callable whose duration is measured in a fresh interpreter"""
+    def __init__(self, module):
+        self.module = module
+
+    def __call__(self):
+        return import_time(self.module) / 1e6
+
+
+def _artifacts(n_artifacts, n_files):
+    from qiita_client import ArtifactInfo
+
+    return [ArtifactInfo('out%d' % i, 'per_sample_FASTQ',
+                         [('/qiita/job/out%d/sample_%d.fastq.gz' % (i, j),
+                           'raw_forward_seqs') for j in range(n_files)])
+            for i in range(n_artifacts)]
+
+
+def _mapping_file(tmp_dir, n_samples):
+    fp = join(tmp_dir, 'mapping_%d.txt' % n_samples)
+    with open(fp, 'w') as f:
+        f.write('#SampleID\tplatform\tbarcode\trun_prefix\tDescription\n')
+        for i in range(n_samples):
+            f.write('1.SKB%d\tIllumina\tACGT\tprefix_%d\tsample %d\n'
+                    % (i, i, i))
+    return fp
+
+
+@benchmark('import_qiita_client')
+def setup_import(tmp_dir):
+    return ImportTime('qiita_client')
+
+
+@benchmark('client_get_job_info')
+def setup_client(tmp_dir):
+    from qiita_client import QiitaClient
+    from qiita_client.fake_qiita import FakeQiitaServer
+
+    server = FakeQiitaServer().start()
+    job_id = server.add_job('NewCmd', {'p1': 1})
+    qclient = QiitaClient(server.url, 'client_id', 'client_secret')
+
+    def run():
+        qclient.get_job_info(job_id)
+    run.cleanup = server.stop
+    return run
+
+
+@benchmark('format_payload_10k_files')
+def setup_format_payload(tmp_dir):
+    from qiita_client.qiita_client import _format_payload
+
+    artifacts = _artifacts(100, 100)
+    return lambda: dumps(_format_payload(True, artifacts_info=artifacts))
+
+
+@benchmark('artifact_info_eq_1k_files')
+def setup_artifact_info_eq(tmp_dir):
+    a, b = _artifacts(1, 1000)[0], _artifacts(1, 1000)[0]
+    return lambda: a == b
+
+
+@benchmark('sample_names_by_run_prefix_1k')
+def setup_sample_names_1k(tmp_dir):
+    from qiita_client.util import get_sample_names_by_run_prefix
+
+    fp = _mapping_file(tmp_dir, 1000)
+    return lambda: get_sample_names_by_run_prefix(fp)
+
+
+@benchmark('sample_names_by_run_prefix_100k')
+def setup_sample_names_100k(tmp_dir):
+    from qiita_client.util import get_sample_names_by_run_prefix
+
+    fp = _mapping_file(tmp_dir, 100000)
+    return lambda: get_sample_names_by_run_prefix(fp)
+
+
+@benchmark('system_call_true')
+def setup_system_call(tmp_dir):
+    from qiita_client.util import system_call
+
+    return lambda: system_call('true')
+
+
+def time_call(func, repeat):
+    """Returns the median time, in seconds, of a call to `func`"""
+    if isinstance(func, ImportTime):
+        return median([func() for _ in range(repeat)])
+    timer = Timer(func)
+    number, _ = timer.autorange()
+    return median([t / number for t in timer.repeat(repeat, number)])
+
+
+def run(patterns=None, repeat=5):
+    """Runs the benchmarks
+
+    Parameters
+    ----------
+    patterns : list of str, optional
+        Glob patterns of the benchmarks to run. Default: all of them
+    repeat : int, optional
+        The number of measurements of each benchmark
+
+    Returns
+    -------
+    dict of {str: float}
+        The median time per call in seconds, keyed by benchmark name
+    """
+    results = {}
+    tmp_dir = mkdtemp()
+    try:
+        for name, setup in BENCHMARKS:
+            if patterns and not any(fnmatch.fnmatch(name, p)
+                                    for p in patterns):
+                continue
+            func = setup(tmp_dir)
+            try:
+                results[name] = time_call(func, repeat)
+            finally:
+                if hasattr(func, 'cleanup'):
+                    func.cleanup()
+            print('%-35s %12.3f us' % (name, results[name] * 1e6))
+    finally:
+        rmtree(tmp_dir)
+    return results
+
+
+def compare(baseline, results, threshold):
+    """Compares the results with a baseline
+
+    Parameters
+    ----------
+    baseline : dict of {str: float}
+        The baseline times
+    results : dict of {str: float}
+        The current times
+    threshold : float
+        The maximum allowed slowdown, as a fraction of the baseline time
+
+    Returns
+    -------
+    list of str
+        The benchmarks slower than the baseline by more than `threshold`
+    """
+    regressions = []
+    print('%-35s %12s %12s %8s' % ('benchmark', 'baseline us', 'current us',
+                                   'ratio'))
+    for name in sorted(set(baseline) & set(results)):
+        ratio = results[name] / baseline[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-35s %12.3f %12.3f %8.2f%s' % (
+            name, baseline[name] * 1e6, results[name] * 1e6, ratio, flag))
+    return regressions
+
+
+def _load(fp):
+    with open(fp) as f:
+        return loads(f.read())['results']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='action')
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--save', default=None,
+                            help='Store the results in this JSON file')
+    cmp_parser = subparsers.add_parser(
+        'compare', help='Compare the results with a baseline')
+    cmp_parser.add_argument('baseline', help='The baseline JSON file')
+    cmp_parser.add_argument('results', nargs='?', default=None,
+                            help='The results JSON file. Default: run the '
+                                 'benchmarks')
+    cmp_parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Maximum allowed slowdown (default: 0.2, '
+                                 'i.e. 20%%)')
+    for p in (run_parser, cmp_parser):
+        p.add_argument('-k', dest='patterns', action='append',
+                       help='Only run the benchmarks matching this glob')
+        p.add_argument('-r', '--repeat', type=int, default=5,
+                       help='Number of measurements of each benchmark')
+    args = parser.parse_args(argv)
+    if args.action is None:
+        parser.error('an action is required')
+
+    if args.action == 'compare' and args.results is not None:
+        results = _load(args.results)
+    else:
+        results = run(args.patterns, args.repeat)
+
+    if args.action == 'run':
+        if args.save:
+            with open(args.save, 'w') as f:
+                f.write(dumps({'python': platform.python_version(),
+                               'machine': platform.machine(),
+                               'results': results},
+                              indent=4, sort_keys=True))
+                f.write('\n')
+        return 0
+
+    print('')
+    regressions = compare(_load(args.baseline), results, args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,11 +7,13 @@
 # -----------------------------------------------------------------------------
 
 from .exceptions import (QiitaClientError, NotFoundError, BadRequestError,
-                         ForbiddenError)
-from .qiita_client import QiitaClient, ArtifactInfo
+                         ForbiddenError, JobCancelledError)
+from .qiita_client import QiitaClient, ArtifactInfo, CompactArtifactInfo
 from .plugin import (QiitaCommand, QiitaPlugin, QiitaTypePlugin,
                      QiitaArtifactType)
 
 __all__ = ["QiitaClient", "QiitaClientError", "NotFoundError",
-           "BadRequestError", "ForbiddenError", "ArtifactInfo", "QiitaCommand",
-           "QiitaPlugin", "QiitaTypePlugin", "QiitaArtifactType"]
+           "BadRequestError", "ForbiddenError", "JobCancelledError",
+           "ArtifactInfo",
+           "CompactArtifactInfo", "QiitaCommand", "QiitaPlugin",
+           "QiitaTypePlugin", "QiitaArtifactType"]
@@ -0,0 +1,284 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from os import makedirs, listdir, rename, utime, stat, walk, remove
+from os.path import (exists, join, relpath, abspath, isdir, getsize,
+                     basename, dirname)
+from json import dumps, loads
+from hashlib import sha256
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from .qiita_client import ArtifactInfo, _file_checksum
+from .util import link_or_copy
+
+# Name of the file that describes a cache entry
+ENTRY_METADATA = 'artifacts.json'
+
+
+def _path_size(fp):
+    """Returns the size in bytes of a file or a directory"""
+    if not isdir(fp):
+        return getsize(fp)
+    return sum(getsize(join(dp, f)) for dp, _, fs in walk(fp) for f in fs)
+
+
+def _is_artifact_parameter(param_type):
+    """Whether a command parameter type is an input artifact"""
+    return param_type == 'artifact' or param_type.startswith('artifact:')
+
+
+class ResultCache(object):
+    """Cache of command results, keyed by command, parameters and input data
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory where the cached results are stored. It should be in
+        the same filesystem as the job output directories, so the results
+        can be hard linked or cloned instead of copied
+    max_size : int
+        The maximum total size, in bytes, of the cached results. The least
+        recently used results are evicted when it is exceeded
+
+    Notes
+    -----
+    Each result is stored in its own directory, named after its key, which
+    contains the output files and a metadata file with the artifacts
+    information. Entries are created in a temporary directory and renamed
+    into place, so several processes can share the same cache directory.
+
+    The files are stored and materialized with
+    `qiita_client.util.link_or_copy`. If the filesystem doesn't support
+    reflinks they are hard linked, so the cached files and the job outputs
+    share their contents: modifying an output file in place (instead of
+    replacing it) after the job completes also corrupts the cached result.
+    """
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not exists(cache_dir):
+            makedirs(cache_dir)
+
+    def _artifact_fingerprint(self, qclient, artifact_id, include_names):
+        """Returns the fingerprint of the contents of an artifact
+
+        The fingerprint covers the filepath type, the checksum and optionally
+        the file name of every file of the artifact, but not the artifact id,
+        so identical artifacts have the same fingerprint
+        """
+        info = qclient.get('/qiita_db/artifacts/%s/' % artifact_id)
+        files = []
+        for fp_type, fps in info['files'].items():
+            for fp in fps:
+                checksum = _file_checksum(fp, 'md5')['checksum']
+                files.append((fp_type, basename(fp), checksum)
+                             if include_names else (fp_type, checksum))
+        return [info['type'], sorted(files)]
+
+    def key(self, qclient, plugin, command, parameters, include_names=True):
+        """Computes the cache key of a job
+
+        Parameters
+        ----------
+        qclient : QiitaClient
+            The Qiita server client, used to retrieve the input artifacts
+        plugin : BaseQiitaPlugin
+            The plugin executing the job
+        command : QiitaCommand
+            The command executed by the job
+        parameters : dict
+            The job parameters
+        include_names : bool, optional
+            Whether the names of the input files are part of the key. It
+            should be True if the outputs depend on the file names (e.g. they
+            contain sample names taken from them). Default: True
+
+        Returns
+        -------
+        str
+            The cache key
+        """
+        normalized = {}
+        for name, value in parameters.items():
+            param_type = command.required_parameters.get(name, ('', None))[0]
+            if _is_artifact_parameter(param_type) and value is not None:
+                ids = value if isinstance(value, list) else [value]
+                value = [self._artifact_fingerprint(qclient, a,
+                                                    include_names)
+                         for a in ids]
+            normalized[name] = value
+        definition = [plugin.name, plugin.version, command.name, normalized]
+        return sha256(
+            dumps(definition, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key, output_dir, return_extra=False):
+        """Materializes a cached result in `output_dir`
+
+        Parameters
+        ----------
+        key : str
+            The cache key
+        output_dir : str
+            The job output directory
+        return_extra : bool, optional
+            Whether to also return the extra information stored with the
+            result. Default: False
+
+        Returns
+        -------
+        list of ArtifactInfo or None
+            The artifacts information, with the filepaths in `output_dir`, or
+            None if the result is not cached
+        object
+            If `return_extra` is True, the extra information stored with the
+            result, or None
+
+        Notes
+        -----
+        The files are materialized in a temporary directory and then renamed
+        into place, replacing any existing file (e.g. left by a previous
+        execution of the job). If the materialization fails, `output_dir` is
+        left as it was, except for the existing files that were replaced.
+        """
+        entry_dir = join(self.cache_dir, key)
+        metadata_fp = join(entry_dir, ENTRY_METADATA)
+        try:
+            with open(metadata_fp) as f:
+                metadata = loads(f.read())
+        except (IOError, OSError, ValueError):
+            return (None, None) if return_extra else None
+
+        rel_fps = sorted({rel_fp for a in metadata['artifacts']
+                          for rel_fp, _ in a['files']})
+        if not exists(output_dir):
+            makedirs(output_dir)
+        tmp_dir = mkdtemp(dir=output_dir, prefix='.tmp')
+        moved = []
+        try:
+            for rel_fp in rel_fps:
+                tmp_fp = join(tmp_dir, rel_fp)
+                if not exists(dirname(tmp_fp)):
+                    makedirs(dirname(tmp_fp))
+                link_or_copy(join(entry_dir, 'files', rel_fp), tmp_fp)
+            for rel_fp in rel_fps:
+                fp = join(output_dir, rel_fp)
+                if isdir(fp):
+                    rmtree(fp)
+                elif exists(fp):
+                    remove(fp)
+                elif not exists(dirname(fp)):
+                    makedirs(dirname(fp))
+                rename(join(tmp_dir, rel_fp), fp)
+                moved.append(fp)
+        except Exception:
+            # Don't leave a partial result that the task would run over
+            for fp in moved:
+                if isdir(fp):
+                    rmtree(fp, ignore_errors=True)
+                elif exists(fp):
+                    remove(fp)
+            raise
+        finally:
+            rmtree(tmp_dir, ignore_errors=True)
+
+        artifacts_info = [
+            ArtifactInfo(a['output_name'], a['artifact_type'],
+                         [(join(output_dir, rel_fp), fp_type)
+                          for rel_fp, fp_type in a['files']])
+            for a in metadata['artifacts']]
+
+        # Mark the entry as recently used
+        utime(metadata_fp, None)
+        if return_extra:
+            return artifacts_info, metadata.get('extra')
+        return artifacts_info
+
+    def put(self, key, output_dir, artifacts_info, extra=None):
+        """Stores the result of a job
+
+        Results with files outside `output_dir` are not cached.
+
+        Parameters
+        ----------
+        key : str
+            The cache key
+        output_dir : str
+            The job output directory
+        artifacts_info : list of ArtifactInfo
+            The artifacts generated by the job
+        extra : JSON-serializable object, optional
+            Extra information stored with the result (e.g. how to send it to
+            Qiita), returned by `get`
+
+        Returns
+        -------
+        bool
+            Whether the result has been cached
+        """
+        entry_dir = join(self.cache_dir, key)
+        if exists(entry_dir):
+            return True
+
+        output_dir = abspath(output_dir)
+        artifacts = []
+        for a_info in artifacts_info:
+            files = []
+            for fp, fp_type in a_info.files:
+                rel_fp = relpath(abspath(fp), output_dir)
+                if rel_fp.startswith('..') or not exists(fp):
+                    return False
+                files.append((rel_fp, fp_type))
+            artifacts.append({'output_name': a_info.output_name,
+                              'artifact_type': a_info.artifact_type,
+                              'files': files})
+
+        tmp_dir = mkdtemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            size = 0
+            for a in artifacts:
+                for rel_fp, _ in a['files']:
+                    src = join(output_dir, rel_fp)
+                    dst = join(tmp_dir, 'files', rel_fp)
+                    if not exists(dirname(dst)):
+                        makedirs(dirname(dst))
+                    link_or_copy(src, dst)
+                    size += _path_size(src)
+            with open(join(tmp_dir, ENTRY_METADATA), 'w') as f:
+                f.write(dumps({'artifacts': artifacts, 'size': size,
+                               'extra': extra}))
+            rename(tmp_dir, entry_dir)
+        except OSError:
+            rmtree(tmp_dir, ignore_errors=True)
+            # Another process may have stored the same result concurrently
+            return exists(entry_dir)
+
+        self.evict()
+        return True
+
+    def evict(self):
+        """Removes the least recently used results until the total size of
+        the cache is below `max_size`"""
+        entries = []
+        total = 0
+        for key in listdir(self.cache_dir):
+            metadata_fp = join(self.cache_dir, key, ENTRY_METADATA)
+            try:
+                with open(metadata_fp) as f:
+                    size = loads(f.read())['size']
+                last_used = stat(metadata_fp).st_mtime
+            except (IOError, OSError, ValueError, KeyError):
+                continue
+            entries.append((last_used, size, key))
+            total += size
+
+        for _, size, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            rmtree(join(self.cache_dir, key), ignore_errors=True)
+            total -= size
@@ -0,0 +1,212 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from os import makedirs, rename, remove
+from os.path import join, exists, dirname
+from json import dumps, loads
+
+from .qiita_client import ArtifactInfo
+
+# Directory, inside the job output directory, where the checkpoints are stored
+CHECKPOINT_DIR = '.qiita_checkpoints'
+
+# Stage used by the plugin runner to store the final result of the job
+RESULT_STAGE = '__result__'
+
+
+class Checkpoint(object):
+    """Records the completed stages of a job, so it can be resumed
+
+    Long running commands can split their work in named stages. Each stage
+    is marked as done once completed, together with the intermediate
+    artifacts it generated and any other JSON-serializable data needed by
+    the following stages. If the job is executed again (e.g. after its node
+    was preempted), the stages already done can be skipped.
+
+    Parameters
+    ----------
+    job_id : str
+        The job id
+    output_dir : str
+        The job output directory, where the checkpoint is stored
+
+    Examples
+    --------
+    >>> def my_command(qclient, job_id, parameters, out_dir):  # doctest: +SKIP
+    ...     ckpt = Checkpoint(job_id, out_dir)
+    ...     if not ckpt.is_done('demux'):
+    ...         demux_fp = demultiplex(parameters, out_dir)
+    ...         ckpt.mark_done('demux', data={'demux': demux_fp})
+    ...     demux_fp = ckpt.data('demux')['demux']
+    ...     otus = ckpt.run('pick otus', pick_otus, demux_fp, out_dir)
+    ...     return True, otus, ""
+
+    Notes
+    -----
+    The checkpoint is rewritten atomically each time a stage is marked as
+    done, so a job killed at any point leaves a consistent checkpoint. A
+    stage whose stored artifacts have missing files is not considered done.
+    """
+    def __init__(self, job_id, output_dir):
+        self.job_id = job_id
+        self.checkpoint_fp = join(output_dir, CHECKPOINT_DIR,
+                                  '%s.json' % job_id)
+        self._stages = self._load()
+
+    def _load(self):
+        try:
+            with open(self.checkpoint_fp) as f:
+                checkpoint = loads(f.read())
+        except (IOError, OSError, ValueError):
+            return {}
+        if checkpoint.get('job_id') != self.job_id:
+            return {}
+        return checkpoint['stages']
+
+    def _save(self):
+        checkpoint_dir = dirname(self.checkpoint_fp)
+        if not exists(checkpoint_dir):
+            makedirs(checkpoint_dir)
+        tmp_fp = self.checkpoint_fp + '.tmp'
+        with open(tmp_fp, 'w') as f:
+            f.write(dumps({'job_id': self.job_id, 'stages': self._stages}))
+        rename(tmp_fp, self.checkpoint_fp)
+
+    def is_done(self, stage):
+        """Whether a stage has been completed
+
+        Parameters
+        ----------
+        stage : str
+            The stage name
+
+        Returns
+        -------
+        bool
+            Whether the stage is done and all the files of its artifacts
+            still exist
+        """
+        if stage not in self._stages:
+            return False
+        return all(exists(fp) for a in self._stages[stage]['artifacts']
+                   for fp, _ in a['files'])
+
+    def mark_done(self, stage, artifacts_info=None, data=None):
+        """Marks a stage as completed
+
+        Parameters
+        ----------
+        stage : str
+            The stage name
+        artifacts_info : list of ArtifactInfo, optional
+            The intermediate artifacts generated in the stage
+        data : object, optional
+            Any JSON-serializable data to keep for the following stages
+
+        Returns
+        -------
+        bool
+            Whether the checkpoint was saved
+
+        Notes
+        -----
+        Checkpointing is best effort: if the checkpoint can't be written
+        (e.g. the disk is full), a warning is logged and the stage is only
+        marked as done in this object, so the job continues but can't be
+        resumed from this stage.
+        """
+        self._stages[stage] = {
+            'artifacts': [{'output_name': a.output_name,
+                           'artifact_type': a.artifact_type,
+                           'files': [list(f) for f in a.files]}
+                          for a in artifacts_info or []],
+            'data': data}
+        try:
+            self._save()
+        except (IOError, OSError) as e:
+            import logging
+            logging.getLogger(__name__).warning(
+                "Couldn't save the checkpoint of job %s (stage '%s'): %s",
+                self.job_id, stage, e)
+            return False
+        return True
+
+    def artifacts(self, stage):
+        """Returns the artifacts stored when a stage was completed
+
+        Parameters
+        ----------
+        stage : str
+            The stage name
+
+        Returns
+        -------
+        list of ArtifactInfo
+            The stage artifacts
+
+        Raises
+        ------
+        ValueError
+            If the stage is not done
+        """
+        if not self.is_done(stage):
+            raise ValueError("Stage '%s' is not done" % stage)
+        return [ArtifactInfo(a['output_name'], a['artifact_type'],
+                             [tuple(f) for f in a['files']])
+                for a in self._stages[stage]['artifacts']]
+
+    def data(self, stage):
+        """Returns the data stored when a stage was completed
+
+        Parameters
+        ----------
+        stage : str
+            The stage name
+
+        Returns
+        -------
+        object
+            The stage data
+
+        Raises
+        ------
+        ValueError
+            If the stage is not done
+        """
+        if not self.is_done(stage):
+            raise ValueError("Stage '%s' is not done" % stage)
+        return self._stages[stage]['data']
+
+    def run(self, stage, func, *args, **kwargs):
+        """Executes a stage, unless it is already done
+
+        Parameters
+        ----------
+        stage : str
+            The stage name
+        func : callable
+            The function executing the stage. It should return a list of
+            ArtifactInfo objects
+        args, kwargs
+            The arguments of `func`
+
+        Returns
+        -------
+        list of ArtifactInfo
+            The artifacts generated by the stage, either returned by `func`
+            or stored in a previous execution
+        """
+        if not self.is_done(stage):
+            self.mark_done(stage, artifacts_info=func(*args, **kwargs))
+        return self.artifacts(stage)
+
+    def clear(self):
+        """Removes the checkpoint"""
+        self._stages = {}
+        if exists(self.checkpoint_fp):
+            remove(self.checkpoint_fp)
@@ -21,3 +21,7 @@ class BadRequestError(QiitaClientError):
 
 class ForbiddenError(QiitaClientError):
     pass
+
+
+class JobCancelledError(QiitaClientError):
+    pass
@@ -0,0 +1,449 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import re
+import threading
+import zlib
+from json import dumps, loads
+from random import Random
+from time import sleep
+from uuid import uuid4
+
+try:
+    from socketserver import ThreadingMixIn
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import parse_qs, unquote
+except ImportError:
+    from SocketServer import ThreadingMixIn
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from urlparse import parse_qs
+    from urllib import unquote
+
+from .qiita_client import ACTIVE_JOB_STATUSES
+from .transport import _read_request_body
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # Load tests open many connections at once
+    request_queue_size = 128
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Dispatches the requests to the FakeQiitaServer"""
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, avoid waiting for the
+    # delayed ACK of the client between them
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        body = _read_request_body(self.rfile, self.headers)
+        encoding = self.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        elif encoding == 'zstd':
+            import zstandard
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(
+                body)
+        return body.decode('utf-8')
+
+    def _parse_data(self, body):
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            return {k: v[0] for k, v in parse_qs(body).items()}
+        if not body:
+            return None
+        try:
+            return loads(body)
+        except ValueError:
+            return body
+
+    def _send(self, status, content):
+        body = dumps(content).encode('utf-8') if content is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self):
+        body = self._read_body()
+        status, content = self.server.qiita.handle(
+            self.command, self.path, self.headers.get('Authorization'),
+            self._parse_data(body))
+        self._send(status, content)
+
+    do_GET = do_POST = do_PATCH = _dispatch
+
+
+class FakeQiitaServer(object):
+    """In-process stand-in of the Qiita REST API used by the plugins
+
+    It implements the endpoints used by QiitaClient and the plugins
+    (authentication, jobs, heartbeats, steps, completion, plugin and command
+    registration, artifact types and artifacts) plus the `/apitest/`
+    endpoints used by `qiita_client.testing.PluginTestCase`, keeping all the
+    state in memory.
+
+    Parameters
+    ----------
+    host : str, optional
+        The address to listen on. Default: 127.0.0.1
+    port : int, optional
+        The port to listen on. Default: a free port
+    latency : float, optional
+        Seconds to wait before answering each request. Default: 0
+    failure_rate : float, optional
+        Probability of answering a request with a 500 error. Default: 0
+    seed : int, optional
+        The seed of the failure injection
+    client_id : str, optional
+        The only client id accepted. Default: any client id
+    client_secret : str, optional
+        The only client secret accepted. Default: any client secret
+    heartbeat_interval : float, optional
+        If provided, the heartbeat responses request this interval between
+        heartbeats. Default: no interval is requested
+
+    Examples
+    --------
+    >>> with FakeQiitaServer() as server:  # doctest: +SKIP
+    ...     job_id = server.add_job('NewCmd', {'p1': 1})
+    ...     qclient = QiitaClient(server.url, 'client_id', 'client_secret')
+    ...     qclient.get_job_info(job_id)['status']
+    'queued'
+
+    Notes
+    -----
+    Unknown plugins are created the first time their information is
+    requested, as if Qiita had loaded their configuration file.
+
+    Like Qiita, the heartbeat, step and completion endpoints answer with
+    HTTP 200 and a {'success': bool, 'error': str} body, also when they
+    reject the request because the job is not running.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0, failure_rate=0,
+                 seed=None, client_id=None, client_secret=None,
+                 heartbeat_interval=None):
+        self.latency = latency
+        self.heartbeat_interval = heartbeat_interval
+        self.failure_rate = failure_rate
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._random = Random(seed)
+        self._lock = threading.Lock()
+        self._pending_failures = []
+        self._httpd = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._httpd.qiita = self
+        self._thread = None
+        self._routes = [
+            ('POST', r'/qiita_db/authenticate/$', self._authenticate),
+            ('GET', r'/qiita_db/jobs/([^/]+)/?$', self._get_job),
+            ('POST', r'/qiita_db/jobs/([^/]+)/heartbeat/$', self._heartbeat),
+            ('POST', r'/qiita_db/jobs/([^/]+)/step/$', self._step),
+            ('POST', r'/qiita_db/jobs/([^/]+)/complete/$', self._complete),
+            ('GET', r'/qiita_db/plugins/([^/]+)/([^/]+)/$', self._get_plugin),
+            ('POST', r'/qiita_db/plugins/([^/]+)/([^/]+)/commands/$',
+             self._create_command),
+            ('POST',
+             r'/qiita_db/plugins/([^/]+)/([^/]+)/commands/([^/]+)/activate/$',
+             self._activate_command),
+            ('POST', r'/qiita_db/artifacts/types/$',
+             self._create_artifact_type),
+            ('GET', r'/qiita_db/artifacts/([^/]+)/$', self._get_artifact),
+            ('PATCH', r'/qiita_db/artifacts/([^/]+)/$',
+             self._patch_artifact),
+            ('POST', r'/apitest/processing_job/$', self._create_job),
+            ('POST', r'/apitest/reload_plugins/$', self._reload_plugins),
+            ('POST', r'/apitest/reset/$', self._reset)]
+        self.reset()
+
+    @property
+    def url(self):
+        """The base url of the server"""
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        """Starts serving requests in a background thread
+
+        Returns
+        -------
+        FakeQiitaServer
+            The server itself
+        """
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def reset(self):
+        """Removes all the jobs, artifacts, plugins and recorded requests"""
+        with self._lock:
+            self.jobs = {}
+            self.artifacts = {}
+            self.artifact_types = {}
+            self.plugins = {}
+            self.requests = []
+            self._tokens = set()
+            self._pending_failures = []
+
+    def add_job(self, command, parameters, status='queued', job_id=None):
+        """Creates a job
+
+        Parameters
+        ----------
+        command : str
+            The name of the command executed by the job
+        parameters : dict
+            The job parameters
+        status : str, optional
+            The job status. Default: queued
+        job_id : str, optional
+            The job id. Default: a new UUID
+
+        Returns
+        -------
+        str
+            The job id
+        """
+        with self._lock:
+            return self._new_job(command, parameters, status, job_id)
+
+    def _new_job(self, command, parameters, status, job_id=None):
+        job_id = job_id or str(uuid4())
+        self.jobs[job_id] = {'command': command, 'parameters': parameters,
+                             'status': status, 'step': None, 'heartbeats': 0,
+                             'result': None}
+        return job_id
+
+    def add_artifact(self, artifact_type, files, artifact_id=None):
+        """Creates an artifact
+
+        Parameters
+        ----------
+        artifact_type : str
+            The artifact type
+        files : dict of {str: list of str}
+            The artifact filepaths, keyed by filepath type
+        artifact_id : str, optional
+            The artifact id. Default: the next integer id
+
+        Returns
+        -------
+        str
+            The artifact id
+        """
+        with self._lock:
+            artifact_id = str(artifact_id or len(self.artifacts) + 1)
+            self.artifacts[artifact_id] = {'type': artifact_type,
+                                           'files': files,
+                                           'patches': []}
+        return artifact_id
+
+    def fail_next(self, n=1, status=500):
+        """Makes the next requests fail
+
+        Parameters
+        ----------
+        n : int, optional
+            The number of requests that fail. Default: 1
+        status : int, optional
+            The HTTP status of the failures. Default: 500
+        """
+        with self._lock:
+            self._pending_failures.extend([status] * n)
+
+    def expire_tokens(self):
+        """Expires all the access tokens issued"""
+        with self._lock:
+            self._tokens = set()
+
+    def handle(self, method, path, authorization, data):
+        """Answers a request
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method
+        path : str
+            The request path
+        authorization : str or None
+            The Authorization header
+        data : dict, str or None
+            The request data
+
+        Returns
+        -------
+        int, object
+            The HTTP status and the JSON-serializable response
+        """
+        if self.latency:
+            sleep(self.latency)
+
+        path = path.split('?')[0]
+        with self._lock:
+            self.requests.append((method, path))
+            if self._pending_failures:
+                return self._pending_failures.pop(0), None
+            if self.failure_rate and \
+                    self._random.random() < self.failure_rate:
+                return 500, None
+
+        for route_method, pattern, func in self._routes:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                break
+        else:
+            return 404, {'error': 'Unknown endpoint %s %s' % (method, path)}
+
+        with self._lock:
+            if func != self._authenticate:
+                token = (authorization or '').replace('Bearer ', '', 1)
+                if token not in self._tokens:
+                    return 400, {'error': 'invalid_grant',
+                                 'error_description':
+                                     'Oauth2 error: token has timed out'}
+            return func(data, *[unquote(g) for g in match.groups()])
+
+    def _authenticate(self, data):
+        data = data or {}
+        if (self.client_id is not None and
+                data.get('client_id') != self.client_id) or \
+                (self.client_secret is not None and
+                 data.get('client_secret') != self.client_secret):
+            return 400, {'error': 'invalid_client',
+                         'error_description': 'Oauth2 error: invalid client'}
+        token = uuid4().hex
+        self._tokens.add(token)
+        return 200, {'access_token': token, 'token_type': 'Bearer',
+                     'expires_in': 3600}
+
+    def _job(self, job_id):
+        if job_id not in self.jobs:
+            return None, (404, {'error': 'Job %s does not exist' % job_id})
+        return self.jobs[job_id], None
+
+    def _get_job(self, data, job_id):
+        job, error = self._job(job_id)
+        if error:
+            return error
+        return 200, {'command': job['command'],
+                     'parameters': job['parameters'],
+                     'status': job['status'], 'step': job['step']}
+
+    def _heartbeat(self, data, job_id):
+        job, error = self._job(job_id)
+        if error:
+            return error
+        if job['status'] not in ACTIVE_JOB_STATUSES:
+            return 200, {'success': False,
+                         'error': 'Job already finished. Status: %s'
+                                  % job['status']}
+        job['status'] = 'running'
+        job['heartbeats'] += 1
+        response = {'success': True, 'error': ''}
+        if self.heartbeat_interval:
+            response['heartbeat_interval'] = self.heartbeat_interval
+        return 200, response
+
+    def _step(self, data, job_id):
+        job, error = self._job(job_id)
+        if error:
+            return error
+        if job['status'] != 'running':
+            return 200, {'success': False,
+                         'error': 'Job in a non-running state.'}
+        job['step'] = data['step']
+        return 200, {'success': True, 'error': ''}
+
+    def _complete(self, data, job_id):
+        job, error = self._job(job_id)
+        if error:
+            return error
+        if job['status'] != 'running':
+            return 200, {'success': False,
+                         'error': "Can't complete job: not in a running "
+                                  "state"}
+        job['status'] = 'success' if data['success'] else 'error'
+        job['result'] = data
+        return 200, {'success': True, 'error': ''}
+
+    def _plugin(self, name, version):
+        key = (name, version)
+        if key not in self.plugins:
+            self.plugins[key] = {'name': name, 'version': version,
+                                 'commands': {}, 'active': False}
+        return self.plugins[key]
+
+    def _get_plugin(self, data, name, version):
+        plugin = self._plugin(name, version)
+        return 200, {'name': name, 'version': version,
+                     'description': '', 'publications': [],
+                     'commands': sorted(plugin['commands']),
+                     'active': plugin['active']}
+
+    def _create_command(self, data, name, version):
+        plugin = self._plugin(name, version)
+        plugin['commands'][data['name']] = data
+        plugin['active'] = True
+        return 200, None
+
+    def _activate_command(self, data, name, version, command):
+        plugin = self._plugin(name, version)
+        if command not in plugin['commands']:
+            return 404, {'error': 'Command %s does not exist' % command}
+        plugin['active'] = True
+        return 200, None
+
+    def _create_artifact_type(self, data):
+        self.artifact_types[data['type_name']] = data
+        return 200, None
+
+    def _get_artifact(self, data, artifact_id):
+        if artifact_id not in self.artifacts:
+            return 404, {'error': 'Artifact %s does not exist' % artifact_id}
+        artifact = self.artifacts[artifact_id]
+        return 200, {'type': artifact['type'], 'files': artifact['files']}
+
+    def _patch_artifact(self, data, artifact_id):
+        if artifact_id not in self.artifacts:
+            return 404, {'error': 'Artifact %s does not exist' % artifact_id}
+        self.artifacts[artifact_id]['patches'].append(data)
+        return 200, None
+
+    def _create_job(self, data):
+        # The command is identified by [plugin name, version, command name]
+        job_id = self._new_job(loads(data['command'])[-1],
+                               loads(data['parameters']),
+                               data.get('status', 'queued'))
+        return 200, {'job': job_id}
+
+    def _reload_plugins(self, data):
+        return 200, None
+
+    def _reset(self, data):
+        self.jobs.clear()
+        self.artifacts.clear()
+        self.plugins.clear()
+        return 200, None
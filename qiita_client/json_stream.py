@@ -0,0 +1,171 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import codecs
+from json import JSONDecoder
+
+# Number of consumed characters kept in the buffer before discarding them
+_COMPACT_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+# The characters that can follow a value
+_DELIMITERS = _WHITESPACE + ',:]}'
+
+
+class _Reader(object):
+    """Reads JSON tokens and values from an iterable of byte chunks"""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Reads the next chunk, returning False if there are no more"""
+        if self._eof:
+            return False
+        if self._pos > _COMPACT_SIZE:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self._buf += self._utf8.decode(chunk)
+                return True
+        self._buf += self._utf8.decode(b'', final=True)
+        self._eof = True
+        return False
+
+    def peek(self):
+        """Returns the next non-whitespace character, or '' at the end"""
+        while True:
+            while self._pos < len(self._buf) and \
+                    self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """Consumes the next character, which should be one of `chars`"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expecting one of %r at character %d, found %r"
+                             % (chars, self._pos, char))
+        self._pos += 1
+        return char
+
+    def value(self):
+        """Decodes the next JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                # The value is not complete yet. Wait until the pending text
+                # doubles before trying again, so large values are not
+                # decoded once per chunk
+                pending = len(self._buf) - self._pos
+                if not self._fill():
+                    raise
+                while len(self._buf) - self._pos < 2 * pending and \
+                        self._fill():
+                    pass
+                continue
+            # A number split between chunks may have been decoded partially,
+            # so the value must be followed by a delimiter
+            if (end == len(self._buf) or
+                    self._buf[end] not in _DELIMITERS) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def _items(reader, container):
+    """Yields the items of the array or object that starts next
+
+    The items of an array are yielded as values, and the items of an object
+    as (key, value) pairs
+    """
+    closing = ']' if container == '[' else '}'
+    reader.expect(container)
+    if reader.peek() == closing:
+        reader.expect(closing)
+        return
+    while True:
+        if container == '[':
+            yield reader.value()
+        else:
+            key = reader.value()
+            reader.expect(':')
+            yield key, reader.value()
+        if reader.expect(',' + closing) == closing:
+            return
+
+
+def iter_json_items(chunks, path=()):
+    """Parses incrementally the items of an array or object in a JSON text
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        The JSON text, in UTF-8
+    path : sequence of str or int, optional
+        The keys (for objects) and indexes (for arrays) leading from the
+        top-level value to the array or object whose items are yielded.
+        Default: the top-level value
+
+    Yields
+    ------
+    object
+        The items of the array, or the (key, value) pairs of the object
+
+    Raises
+    ------
+    ValueError
+        If the text is not valid JSON, or `path` doesn't lead to an array or
+        an object
+
+    Notes
+    -----
+    Only one item is decoded at a time, so the memory used is bounded by the
+    size of the largest item rather than the size of the whole text. The
+    values found along `path` that are not part of it are decoded and
+    discarded.
+    """
+    reader = _Reader(chunks)
+    for step in path:
+        container = reader.peek()
+        if container not in ('[', '{'):
+            raise ValueError("Path %r not found in the JSON text"
+                             % (list(path),))
+        reader.expect(container)
+        index = 0
+        while True:
+            if reader.peek() in (']', '}'):
+                raise ValueError("Path %r not found in the JSON text"
+                                 % (list(path),))
+            if container == '{':
+                key = reader.value()
+                reader.expect(':')
+            else:
+                key = index
+                index += 1
+            if key == step:
+                break
+            reader.value()
+            reader.expect(',')
+
+    if reader.peek() not in ('[', '{'):
+        raise ValueError("The value at %r is not an array or an object"
+                         % (list(path),))
+    for item in _items(reader, reader.peek()):
+        yield item
@@ -6,20 +6,225 @@
 # The full license is in the file LICENSE, distributed with this software.
 # -----------------------------------------------------------------------------
 
-import traceback
-import sys
 from string import ascii_letters, digits
 from random import SystemRandom
-from os.path import exists, join, expanduser
-from os import makedirs, environ
-from future import standard_library
-from json import dumps
-import urllib
+from os.path import exists, join, expanduser, abspath, relpath
+from os import makedirs, environ, rename
+from shutil import rmtree
+from json import dumps, loads
+from hashlib import sha256
 
-from qiita_client import QiitaClient
+from qiita_client import QiitaClient, ArtifactInfo, QiitaClientError
+from .validation import validate_files, missing_filepath_types
+from .supervisor import run_supervised, _task_error
+from .checkpoint import Checkpoint, RESULT_STAGE
+from .staging import stage_outputs
+from .reference import load_reference
 
-with standard_library.hooks():
-    from configparser import ConfigParser
+# Maximum number of requests issued concurrently when registering a plugin
+REGISTRATION_JOBS = 8
+
+
+def _config_parser():
+    """Returns a new ConfigParser, importing it on first use
+
+    The py2/py3 compatibility hooks from `future` are only installed if the
+    standard library doesn't already provide `configparser`, so plugins
+    running under Python 3 don't pay their import time on every job
+    """
+    try:
+        from configparser import ConfigParser
+    except ImportError:
+        from future import standard_library
+        with standard_library.hooks():
+            from configparser import ConfigParser
+    return ConfigParser()
+
+
+def _quote(value):
+    """URL-quotes `value`, importing the quote function on first use"""
+    try:
+        from urllib.parse import quote
+    except ImportError:
+        from urllib import quote
+    return quote(value)
+
+
+class _HTMLSummaryRecorder(object):
+    """Proxy of a QiitaClient that records the HTML summary updates
+
+    Parameters
+    ----------
+    qclient : QiitaClient
+        The Qiita server client the calls are forwarded to
+
+    Attributes
+    ----------
+    html_summary : (str, str, str) or None
+        The (op, path, value) of the last html_summary PATCH request
+    """
+    def __init__(self, qclient):
+        self._qclient = qclient
+        self.html_summary = None
+
+    def __getattr__(self, name):
+        return getattr(self._qclient, name)
+
+    def patch(self, url, op, path, value=None, from_p=None, **kwargs):
+        if path.strip('/') == 'html_summary' and op in ('add', 'replace'):
+            self.html_summary = (op, path, value)
+        return self._qclient.patch(url, op, path, value=value, from_p=from_p,
+                                   **kwargs)
+
+
+def _cached_html_generator(plugin, cache, html_generator_func):
+    """Wraps an HTML summary generator to reuse the previous summaries
+
+    Parameters
+    ----------
+    plugin : QiitaTypePlugin
+        The plugin
+    cache : qiita_client.cache.ResultCache
+        The cache storing the summaries
+    html_generator_func : callable
+        The function generating the HTML summaries
+
+    Returns
+    -------
+    callable
+        The HTML summary generator. The summaries are keyed on the plugin
+        version and the checksums of the artifact files, so the summary of an
+        artifact identical to a previous one is served from the cache and
+        sent to Qiita without calling `html_generator_func`
+    """
+    def html_generator(qclient, job_id, parameters, output_dir):
+        cmd = plugin.task_dict['Generate HTML summary']
+        url = '/qiita_db/artifacts/%s/' % parameters['input_data']
+        try:
+            key = cache.key(qclient, plugin, cmd, parameters,
+                            include_names=False)
+            cached, patch = cache.get(key, output_dir, return_extra=True)
+        except Exception:
+            key = cached = patch = None
+
+        if cached is not None and patch is not None:
+            # The filepaths of the PATCH value are stored relative to the
+            # output directory
+            value = patch['value']
+            if isinstance(value, dict):
+                value = dumps({name: join(output_dir, fp) if fp else fp
+                               for name, fp in value.items()})
+            else:
+                value = join(output_dir, value)
+            qclient.patch(url, patch['op'], patch['path'], value=value)
+            return True, None, ""
+
+        recorder = _HTMLSummaryRecorder(qclient)
+        success, artifacts_info, error_msg = html_generator_func(
+            recorder, job_id, parameters, output_dir)
+
+        if (success and key is not None and recorder.html_summary and
+                recorder.html_summary[2]):
+            op, path, value = recorder.html_summary
+            out_dir = abspath(output_dir)
+            try:
+                # The value is either the filepath of the summary or a JSON
+                # object with the filepaths of its files
+                try:
+                    files = loads(value)
+                except ValueError:
+                    files = None
+                if isinstance(files, dict):
+                    fps = [fp for fp in files.values() if fp]
+                    value = {name: relpath(abspath(fp), out_dir) if fp else fp
+                             for name, fp in files.items()}
+                else:
+                    fps = [value]
+                    value = relpath(abspath(value), out_dir)
+                cache.put(key, output_dir, [ArtifactInfo(
+                    'html_summary', 'html_summary',
+                    [(fp, 'html_summary') for fp in fps])],
+                    extra={'op': op, 'path': path, 'value': value})
+            except Exception:
+                pass
+
+        return success, artifacts_info, error_msg
+
+    return html_generator
+
+
+def _accept_files(qclient, job_id, parameters, out_dir):
+    """Validate function that accepts the files as they are"""
+    files = loads(parameters['files'])
+    return True, [ArtifactInfo(None, parameters['artifact_type'],
+                               [(fp, fp_type) for fp_type, fps in files.items()
+                                for fp in fps])], ""
+
+
+def _file_validating(plugin, validate_func):
+    """Wraps a validate function to run the per-file validators first
+
+    Parameters
+    ----------
+    plugin : QiitaTypePlugin
+        The plugin holding the file validators
+    validate_func : callable
+        The function validating the artifact once all its files are valid
+
+    Returns
+    -------
+    callable
+        The validate function
+    """
+    def validate(qclient, job_id, parameters, out_dir):
+        files = loads(parameters['files'])
+        a_type = parameters['artifact_type']
+
+        errors = []
+        for at in plugin.artifact_types:
+            if at.name == a_type:
+                errors.extend(
+                    "Missing required filepath type: %s" % fp_type
+                    for fp_type in missing_filepath_types(at, files))
+        errors.extend(validate_files(plugin.validators, files,
+                                     artifact_type=a_type,
+                                     n_jobs=plugin.validation_jobs))
+        if errors:
+            return False, None, "\n".join(errors)
+
+        return validate_func(qclient, job_id, parameters, out_dir)
+
+    return validate
+
+
+def _definition_hash(definition):
+    """Returns a stable hash of a JSON-serializable definition"""
+    return sha256(
+        dumps(definition, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _post_concurrently(qclient, posts):
+    """Issues several POST requests concurrently
+
+    Parameters
+    ----------
+    qclient : QiitaClient
+        The Qiita server client
+    posts : list of (str, dict or None)
+        The (url, data) of the POST requests
+    """
+    if not posts:
+        return
+
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(min(REGISTRATION_JOBS, len(posts)))
+    try:
+        pool.map(lambda r: qclient.post(r[0], data=r[1]), posts,
+                 chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
 
 
 class QiitaCommand(object):
@@ -42,6 +247,12 @@ class QiitaCommand(object):
         The function should return a boolean indicating if the command was
         executed successfully or not, a string containing a message in case
         of error, and a list of ArtifactInfo objects in case of success.
+        If the command has a `setup` hook, the function receives its state as
+        a fifth parameter.
+        Long running functions can use `qclient.cancel_token` to stop early
+        if the job is cancelled in Qiita, and a
+        `qiita_client.checkpoint.Checkpoint` to skip the stages already
+        completed if the job is executed again.
     required_parameters : dict of {str: (str, list of str)}
         The required parameters of the command, keyed by parameter name. The
         values should be a 2-tuple in which the first element is the parameter
@@ -60,17 +271,50 @@ class QiitaCommand(object):
     analysis_only : bool, optional
         If true, the command will only be available on the analysis pipeline.
         Default: False
+    cacheable : bool, optional
+        If true, the results of the command can be reused for jobs with the
+        same parameters and input data when the plugin has a result cache.
+        Commands whose results depend on anything else (e.g. the current time
+        or external resources) should set it to False. Default: True
+    time_limit : float, optional
+        The maximum wall-clock time in seconds that a job of this command can
+        run. Default: no limit
+    memory_limit : int, optional
+        The maximum memory in bytes that a job of this command (including
+        the commands it executes) can use. Default: no limit
+    references : list of str, optional
+        The names of the reference files (registered with
+        `QiitaPlugin.register_reference`) used by the command. They are
+        loaded before executing the function, which can access them with
+        `qiita_client.reference.get_reference`. Default: no references
+    setup : callable, optional
+        Function without parameters that performs any expensive
+        initialization of the command (e.g. loading a model) and returns its
+        state. It is executed before the first job of the command and the
+        state is passed to all the following jobs run by the same process.
+        Default: no setup
+    teardown : callable, optional
+        Function that releases the state returned by `setup`. It receives the
+        state as its only parameter. Default: no teardown
 
     Raises
     ------
     TypeError
         If `function` is not callable
     ValueError
-        If `function` does not accept 4 parameters
+        If `function` does not accept 4 parameters (5 if `setup` is provided)
+
+    Notes
+    -----
+    Jobs of commands with a `time_limit` or a `memory_limit` are executed in
+    a supervised child process, and fail with an error describing the limit
+    if they exceed it. See `qiita_client.supervisor.run_supervised`.
     """
     def __init__(self, name, description, function, required_parameters,
                  optional_parameters, outputs, default_parameter_sets=None,
-                 analysis_only=False):
+                 analysis_only=False, cacheable=True, time_limit=None,
+                 memory_limit=None, references=None, setup=None,
+                 teardown=None):
         self.name = name
         self.description = description
 
@@ -81,13 +325,14 @@ class QiitaCommand(object):
                 "callable (type: %s)" % (name, type(function)))
 
         # `function` will be called with the following Parameters
-        # qclient, job_id, job_parameters, output_dir
-        # Make sure that `function` can receive 4 parameters
-        if function.__code__.co_argcount != 4:
+        # qclient, job_id, job_parameters, output_dir (and the setup state)
+        # Make sure that `function` can receive them
+        n_params = 4 if setup is None else 5
+        if function.__code__.co_argcount != n_params:
             raise ValueError(
                 "Couldn't register command '%s': the provided function does "
-                "not accept 4 parameters (number of parameters: %d)"
-                % (name, function.__code__.co_argcount))
+                "not accept %d parameters (number of parameters: %d)"
+                % (name, n_params, function.__code__.co_argcount))
 
         self.function = function
         self.required_parameters = required_parameters
@@ -95,9 +340,40 @@ class QiitaCommand(object):
         self.default_parameter_sets = default_parameter_sets
         self.outputs = outputs
         self.analysis_only = analysis_only
+        self.cacheable = cacheable
+        self.time_limit = time_limit
+        self.memory_limit = memory_limit
+        self.references = references or []
+        self.setup = setup
+        self.teardown = teardown
+
+        # The state returned by `setup`
+        self._prepared = False
+        self._state = None
+
+    def prepare(self):
+        """Runs the setup hook, unless its state is already available"""
+        if self.setup is None or self._prepared:
+            return
+        self._state = self.setup()
+        self._prepared = True
+
+    def release(self):
+        """Releases the state created by the setup hook, if any"""
+        if not self._prepared:
+            return
+        state = self._state
+        self._prepared = False
+        self._state = None
+        if self.teardown is not None:
+            self.teardown(state)
 
     def __call__(self, qclient, server_url, job_id, output_dir):
-        return self.function(qclient, server_url, job_id, output_dir)
+        if self.setup is None:
+            return self.function(qclient, server_url, job_id, output_dir)
+        self.prepare()
+        return self.function(qclient, server_url, job_id, output_dir,
+                             self._state)
 
 
 class QiitaArtifactType(object):
@@ -126,11 +402,23 @@ class QiitaArtifactType(object):
 
 
 class BaseQiitaPlugin(object):
-    def __init__(self, name, version, description, publications=None):
+    def __init__(self, name, version, description, publications=None,
+                 result_cache=None, scratch_dir=None):
         self.name = name
         self.version = version
         self.description = description
         self.publications = dumps(publications) if publications else ""
+        # Optional qiita_client.cache.ResultCache to reuse the results of
+        # previous jobs
+        self.result_cache = result_cache
+        # The reference files available to the commands, keyed by name
+        self.references = {}
+        # Optional node-local directory where the jobs are executed, before
+        # transferring their output artifacts to the job output directory.
+        # Commands reporting filepaths to Qiita by other means than their
+        # output artifacts can't be executed in a scratch directory
+        self.scratch_dir = scratch_dir or environ.get(
+            'QIITA_PLUGINS_SCRATCH_DIR')
 
         # Will hold the different commands
         self.task_dict = {}
@@ -139,6 +427,9 @@ class BaseQiitaPlugin(object):
         conf_dir = environ.get(
             'QIITA_PLUGINS_DIR', join(expanduser('~'), '.qiita_plugins'))
         self.conf_fp = join(conf_dir, "%s_%s.conf" % (self.name, self.version))
+        # The manifest of the last registered plugin definition
+        self.manifest_fp = join(conf_dir, "%s_%s.manifest"
+                                % (self.name, self.version))
 
     def generate_config(self, env_script, start_script, server_cert=None):
         """Generates the plugin configuration file
@@ -178,33 +469,307 @@ class BaseQiitaPlugin(object):
         """
         self.task_dict[command.name] = command
 
+    def release(self):
+        """Releases the state created by the setup hooks of the commands
+
+        Long-lived processes executing several jobs should call it before
+        exiting, so the commands can release their resources
+        """
+        for command in self.task_dict.values():
+            command.release()
+
+    def _command_data(self, cmd):
+        """Returns the data used to create the command in Qiita
+
+        Parameters
+        ----------
+        cmd : QiitaCommand
+            The command
+
+        Returns
+        -------
+        dict
+            The POST data to create the command
+        """
+        req_params = {
+            k: v if v[0] != 'artifact' else ['artifact:%s'
+                                             % dumps(v[1]), None]
+            for k, v in cmd.required_parameters.items()}
+
+        return {'name': cmd.name,
+                'description': cmd.description,
+                'required_parameters': dumps(req_params),
+                'optional_parameters': dumps(cmd.optional_parameters),
+                'default_parameter_sets': dumps(
+                    cmd.default_parameter_sets),
+                'outputs': dumps(cmd.outputs),
+                'analysis_only': cmd.analysis_only}
+
+    def _manifest_sections(self):
+        """Returns the definitions that form the plugin manifest
+
+        Returns
+        -------
+        dict of {str: dict of {str: dict}}
+            The definitions keyed by section and item name
+        """
+        return {'commands': {cmd.name: self._command_data(cmd)
+                             for cmd in self.task_dict.values()}}
+
+    def _manifest(self):
+        """Returns the manifest of the plugin definition
+
+        Returns
+        -------
+        dict
+            The hash of each item in the plugin definition, keyed by section
+            and item name, and the hash of the whole definition under 'hash'
+        """
+        manifest = {section: {name: _definition_hash(definition)
+                              for name, definition in items.items()}
+                    for section, items in self._manifest_sections().items()}
+        manifest['hash'] = _definition_hash(manifest)
+        return manifest
+
+    def _read_manifest(self):
+        """Returns the manifest stored in the last registration, if any"""
+        try:
+            with open(self.manifest_fp) as f:
+                return loads(f.read())
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, manifest):
+        """Stores the manifest of the registered plugin definition"""
+        tmp_fp = self.manifest_fp + '.tmp'
+        with open(tmp_fp, 'w') as f:
+            f.write(dumps(manifest, sort_keys=True))
+        rename(tmp_fp, self.manifest_fp)
+
+    def _register_artifact_types(self, qclient, names):
+        """Registers the given artifact types in Qiita
+
+        Parameters
+        ----------
+        qclient : QiitaClient
+            The Qiita server client
+        names : list of str
+            The names of the artifact types to register
+        """
+        pass
+
     def _register(self, qclient):
-        """Registers the plugin information in Qiita"""
+        """Registers the plugin information in Qiita
+
+        Notes
+        -----
+        A manifest with the hash of each command and artifact type definition
+        is stored next to the configuration file. If the plugin definition
+        didn't change since the last registration and Qiita reports the
+        plugin as active, nothing is sent to the server. Otherwise, only the
+        artifact types that changed are registered, and the commands are
+        activated (if they exist in Qiita) or created. The requests of each
+        step are issued concurrently.
+        """
         # Get the command information from qiita
         info = qclient.get('/qiita_db/plugins/%s/%s/'
                            % (self.name, self.version))
 
+        manifest = self._manifest()
+        previous = self._read_manifest()
+        known = all(name in info['commands'] for name in self.task_dict)
+
+        if known and info.get('active') and \
+                previous.get('hash') == manifest['hash']:
+            return
+
+        # If Qiita doesn't know about the commands this plugin version has
+        # not been registered (or the database has been reset), so the
+        # artifact types are also registered
+        prev_types = previous.get('artifact_types', {}) if known else {}
+        self._register_artifact_types(
+            qclient, [name for name, h in manifest.get('artifact_types',
+                                                       {}).items()
+                      if prev_types.get(name) != h])
+
+        posts = []
         for cmd in self.task_dict.values():
             if cmd.name in info['commands']:
-                qclient.post('/qiita_db/plugins/%s/%s/commands/%s/activate/'
-                             % (self.name, self.version,
-                                urllib.parse.quote(cmd.name)))
+                posts.append(
+                    ('/qiita_db/plugins/%s/%s/commands/%s/activate/'
+                     % (self.name, self.version, _quote(cmd.name)), None))
             else:
-                req_params = {
-                    k: v if v[0] != 'artifact' else ['artifact:%s'
-                                                     % dumps(v[1]), None]
-                    for k, v in cmd.required_parameters.items()}
-
-                data = {'name': cmd.name,
-                        'description': cmd.description,
-                        'required_parameters': dumps(req_params),
-                        'optional_parameters': dumps(cmd.optional_parameters),
-                        'default_parameter_sets': dumps(
-                            cmd.default_parameter_sets),
-                        'outputs': dumps(cmd.outputs),
-                        'analysis_only': cmd.analysis_only}
-                qclient.post('/qiita_db/plugins/%s/%s/commands/'
-                             % (self.name, self.version), data=data)
+                posts.append(('/qiita_db/plugins/%s/%s/commands/'
+                              % (self.name, self.version),
+                              self._command_data(cmd)))
+        _post_concurrently(qclient, posts)
+
+        self._write_manifest(manifest)
+
+    def _execute(self, qclient, job_id, task, parameters, output_dir):
+        """Executes a task, capturing any error it raises
+
+        Parameters
+        ----------
+        qclient : QiitaClient
+            The Qiita server client
+        job_id : str
+            The job id
+        task : QiitaCommand
+            The command to execute
+        parameters : dict
+            The job parameters
+        output_dir : str
+            The output directory
+
+        Returns
+        -------
+        bool, list of ArtifactInfo, str
+            Whether the task succeeded, the output artifacts and the error
+            message
+        """
+        for name in task.references:
+            try:
+                load_reference(name, self.references[name])
+            except Exception:
+                return (False, None,
+                        _task_error("%s (loading reference '%s')"
+                                    % (task.name, name)))
+
+        # Prepare the command in this process, so its state is kept for the
+        # following jobs even if this one is executed in a child process
+        try:
+            task.prepare()
+        except Exception:
+            return False, None, _task_error("%s (setup)" % task.name)
+
+        args = (qclient, job_id, parameters, output_dir)
+        if task.time_limit or task.memory_limit:
+            return run_supervised(task.name, task, args,
+                                  time_limit=task.time_limit,
+                                  memory_limit=task.memory_limit,
+                                  cancel_token=qclient.cancel_token)
+        try:
+            return task(*args)
+        except Exception:
+            return False, None, _task_error(task.name)
+
+    def _execute_in_scratch(self, qclient, job_id, task, parameters,
+                            output_dir):
+        """Executes a task in the scratch directory and transfers its outputs
+
+        Parameters
+        ----------
+        qclient : QiitaClient
+            The Qiita server client
+        job_id : str
+            The job id
+        task : QiitaCommand
+            The command to execute
+        parameters : dict
+            The job parameters
+        output_dir : str
+            The output directory
+
+        Returns
+        -------
+        bool, list of ArtifactInfo, str
+            Whether the task succeeded, the output artifacts (with the
+            filepaths in `output_dir`) and the error message
+
+        Notes
+        -----
+        The task is executed in the directory of the job inside the scratch
+        directory, which is only removed once the outputs are transferred.
+        If the job fails, it is kept, so the checkpoints of the task (see
+        `qiita_client.checkpoint.Checkpoint`) are available if the job is
+        executed again in the same node.
+        """
+        job_dir = join(self.scratch_dir, job_id)
+        if not exists(job_dir):
+            makedirs(job_dir)
+        success, artifacts_info, error_msg = self._execute(
+            qclient, job_id, task, parameters, job_dir)
+        if not success:
+            return success, artifacts_info, error_msg
+        if artifacts_info:
+            try:
+                artifacts_info = stage_outputs(job_dir, output_dir,
+                                               artifacts_info)
+            except Exception:
+                return (False, None,
+                        _task_error("%s (transferring outputs)" % task.name))
+        rmtree(job_dir, ignore_errors=True)
+        return success, artifacts_info, error_msg
+
+    def _run_task(self, qclient, job_id, task, parameters, output_dir):
+        """Runs a task, reusing a cached result if available
+
+        Parameters
+        ----------
+        qclient : QiitaClient
+            The Qiita server client
+        job_id : str
+            The job id
+        task : QiitaCommand
+            The command to execute
+        parameters : dict
+            The job parameters
+        output_dir : str
+            The output directory
+
+        Returns
+        -------
+        bool, list of ArtifactInfo, str
+            Whether the task succeeded, the output artifacts and the error
+            message
+
+        Notes
+        -----
+        The result of a successful task is stored in the job checkpoint (see
+        `qiita_client.checkpoint.Checkpoint`), so if the same job is executed
+        again (e.g. because the process died before reporting the result to
+        Qiita) the stored result is reported without executing the task.
+
+        If the plugin has a scratch directory, the task is executed in the
+        job directory inside it, and the output artifacts are transferred to
+        `output_dir` afterwards (see `qiita_client.staging.stage_outputs`).
+
+        The result cache is best effort: any problem accessing it is ignored
+        and the task is executed normally
+        """
+        checkpoint = Checkpoint(job_id, output_dir)
+        if checkpoint.is_done(RESULT_STAGE):
+            return True, checkpoint.artifacts(RESULT_STAGE), ""
+
+        cache = self.result_cache
+        key = None
+        if cache is not None and task.cacheable:
+            try:
+                key = cache.key(qclient, self, task, parameters)
+                artifacts_info = cache.get(key, output_dir)
+            except Exception:
+                key = artifacts_info = None
+            if artifacts_info is not None:
+                checkpoint.mark_done(RESULT_STAGE,
+                                     artifacts_info=artifacts_info)
+                return True, artifacts_info, ""
+
+        execute = (self._execute_in_scratch if self.scratch_dir else
+                   self._execute)
+        success, artifacts_info, error_msg = execute(
+            qclient, job_id, task, parameters, output_dir)
+
+        if success:
+            checkpoint.mark_done(RESULT_STAGE, artifacts_info=artifacts_info)
+
+        if key is not None and success and artifacts_info:
+            try:
+                cache.put(key, output_dir, artifacts_info)
+            except Exception:
+                pass
+
+        return success, artifacts_info, error_msg
 
     def __call__(self, server_url, job_id, output_dir):
         """Runs the plugin and executed the assigned task
@@ -212,7 +777,8 @@ class BaseQiitaPlugin(object):
         Parameters
         ----------
         server_url : str
-            The url of the server
+            The url of the server, or a comma-separated list of the urls of
+            its replicas
         job_id : str
             The job id
         output_dir : str
@@ -224,7 +790,7 @@ class BaseQiitaPlugin(object):
             If there is a problem gathering the job information
         """
         # Set up the Qiita Client
-        config = ConfigParser()
+        config = _config_parser()
         with open(self.conf_fp, 'U') as conf_file:
             config.readfp(conf_file)
 
@@ -241,19 +807,25 @@ class BaseQiitaPlugin(object):
             # Starting the heartbeat
             qclient.start_heartbeat(job_id)
             # Execute the given task
-            task_name = job_info['command']
-            task = self.task_dict[task_name]
+            task = self.task_dict[job_info['command']]
 
             if not exists(output_dir):
                 makedirs(output_dir)
-            try:
-                success, artifacts_info, error_msg = task(
-                    qclient, job_id, job_info['parameters'], output_dir)
-            except Exception:
-                exc_str = repr(traceback.format_exception(*sys.exc_info()))
-                error_msg = ("Error executing %s:\n%s" % (task_name, exc_str))
-                success = False
-                artifacts_info = None
+            success, artifacts_info, error_msg = self._run_task(
+                qclient, job_id, task, job_info['parameters'], output_dir)
+
+            if qclient.cancel_token.cancelled:
+                # The job was cancelled while running, the results (if any)
+                # are discarded. The server will most likely reject the
+                # completion since it already considers the job finished
+                try:
+                    qclient.complete_job(
+                        job_id, False, error_msg="Job cancelled: %s"
+                        % qclient.cancel_token.reason)
+                except QiitaClientError:
+                    pass
+                return
+
             # The job completed
             qclient.complete_job(job_id, success, error_msg=error_msg,
                                  artifacts_info=artifacts_info)
@@ -270,12 +842,21 @@ class QiitaTypePlugin(BaseQiitaPlugin):
         The plugin version
     description : str
         The plugin description
-    validate_func : callable
-        The function used to validate artifacts
+    validate_func : callable or None
+        The function used to validate artifacts. If None, the files are
+        accepted once they pass the file validators (see
+        `register_validator`)
     html_generator_func : callable
         The function used to generate the HTML generator
     artifact_types : list of QiitaArtifactType
         The artifact types defined in this plugin
+    html_cache : qiita_client.cache.ResultCache, optional
+        If provided, the HTML summaries are stored in this cache and reused
+        for artifacts with the same file contents, instead of calling
+        `html_generator_func` again
+    validation_jobs : int, optional
+        The number of processes used to run the file validators.
+        Default: the number of CPUs
 
     Notes
     -----
@@ -293,40 +874,107 @@ class QiitaTypePlugin(BaseQiitaPlugin):
     _plugin_type = "artifact definition"
 
     def __init__(self, name, version, description, validate_func,
-                 html_generator_func, artifact_types, publications=None):
+                 html_generator_func, artifact_types, publications=None,
+                 html_cache=None, validation_jobs=None):
         super(QiitaTypePlugin, self).__init__(name, version, description,
                                               publications=publications)
+        # The HTML summary generator reports its filepaths to Qiita while
+        # running, so the jobs can't be executed in a scratch directory
+        self.scratch_dir = None
 
         self.artifact_types = artifact_types
+        # The per-file validators, keyed by (artifact type, filepath type)
+        self.validators = {}
+        self.validation_jobs = validation_jobs
+        # Whether the Validate command runs the file validators
+        self._file_validation = validate_func is None
+
+        if validate_func is None:
+            validate_func = _file_validating(self, _accept_files)
 
         val_cmd = QiitaCommand(
             'Validate', 'Validates a new artifact', validate_func,
             {'template': ('prep_template', None),
              'analysis': ('analysis', None),
              'files': ('string', None),
-             'artifact_type': ('string', None)}, {}, None)
+             'artifact_type': ('string', None)}, {}, None, cacheable=False)
 
         self._register_command(val_cmd)
 
+        if html_cache is not None:
+            html_generator_func = _cached_html_generator(
+                self, html_cache, html_generator_func)
         html_cmd = QiitaCommand(
             'Generate HTML summary', 'Generates the HTML summary',
             html_generator_func,
             {'input_data': ('artifact',
-                            [a.name for a in self.artifact_types])}, {}, None)
+                            [a.name for a in self.artifact_types])}, {}, None,
+            cacheable=False)
 
         self._register_command(html_cmd)
 
-    def _register(self, qclient):
-        """Registers the plugin information in Qiita"""
-        for at in self.artifact_types:
-            data = {'type_name': at.name,
-                    'description': at.description,
-                    'can_be_submitted_to_ebi': at.ebi,
-                    'can_be_submitted_to_vamps': at.vamps,
-                    'filepath_types': dumps(at.fp_types)}
-            qclient.post('/qiita_db/artifacts/types/', data=data)
+    def register_validator(self, filepath_type, func, artifact_type=None):
+        """Registers a validator for the files of a given filepath type
+
+        When validating an artifact, all its files with a validator are
+        checked in parallel, in a pool of `validation_jobs` processes, before
+        calling `validate_func`. The job fails with all the errors found if
+        any file is not valid or a required filepath type is missing.
+
+        Parameters
+        ----------
+        filepath_type : str
+            The filepath type
+        func : callable
+            The validator. It should be a module-level function (so it can be
+            sent to the worker processes) conforming to the signature
+            `str or None = func(filepath, filepath_type)`, returning an error
+            message if the file is not valid
+        artifact_type : str, optional
+            If provided, the validator is only used for this artifact type.
+            Default: all artifact types
+        """
+        if not self._file_validation:
+            validate_cmd = self.task_dict['Validate']
+            validate_cmd.function = _file_validating(self,
+                                                     validate_cmd.function)
+            self._file_validation = True
+        self.validators[(artifact_type, filepath_type)] = func
+
+    def _artifact_type_data(self, at):
+        """Returns the data used to create the artifact type in Qiita
+
+        Parameters
+        ----------
+        at : QiitaArtifactType
+            The artifact type
 
-        super(QiitaTypePlugin, self)._register(qclient)
+        Returns
+        -------
+        dict
+            The POST data to create the artifact type
+        """
+        return {'type_name': at.name,
+                'description': at.description,
+                'can_be_submitted_to_ebi': at.ebi,
+                'can_be_submitted_to_vamps': at.vamps,
+                'filepath_types': dumps(at.fp_types)}
+
+    def _manifest_sections(self):
+        """Returns the definitions that form the plugin manifest"""
+        sections = super(QiitaTypePlugin, self)._manifest_sections()
+        sections['artifact_types'] = {
+            at.name: self._artifact_type_data(at)
+            for at in self.artifact_types}
+        return sections
+
+    def _register_artifact_types(self, qclient, names):
+        """Registers the given artifact types in Qiita"""
+        names = set(names)
+        _post_concurrently(
+            qclient, [('/qiita_db/artifacts/types/',
+                       self._artifact_type_data(at))
+                      for at in self.artifact_types if at.name in names])
 
 
 class QiitaPlugin(BaseQiitaPlugin):
@@ -344,6 +992,24 @@ class QiitaPlugin(BaseQiitaPlugin):
         """
         self._register_command(command)
 
+    def register_reference(self, name, filepath):
+        """Registers a reference file used by the plugin commands
+
+        Parameters
+        ----------
+        name : str
+            The reference name, used by the commands to declare and access it
+        filepath : str
+            The reference filepath
+
+        Notes
+        -----
+        The references are memory mapped read-only when a command using them
+        is executed, so the jobs running concurrently in the same node share a
+        single copy of the data. See `qiita_client.reference.load_reference`.
+        """
+        self.references[name] = filepath
+
 
 CONF_TEMPLATE = """[main]
 NAME = %s
@@ -7,15 +7,94 @@
 # -----------------------------------------------------------------------------
 
 import time
-import requests
+import errno
+import random
 import threading
-from json import dumps
+import hashlib
+import signal
+import sys
+import weakref
+import zlib
+from json import dumps, JSONEncoder
+from collections import OrderedDict
+from fnmatch import fnmatch
+from itertools import islice
+from os import listdir, killpg, environ
+from os.path import exists, isdir, isfile, getsize, join
+from functools import partial
 
+from .transport import (RecordingTransport, ReplayTransport,
+                        UnixSocketTransport)
+from .json_stream import iter_json_items
+from .servers import ServerPool, parse_server_urls, UNAVAILABLE_STATUSES
+from .ratelimit import RateLimiter, request_priority
 from .exceptions import (QiitaClientError, NotFoundError, BadRequestError,
-                         ForbiddenError)
+                         ForbiddenError, JobCancelledError)
 
 JOB_COMPLETED = False
 
+# The cancellation token of the job running in this process. It is used by
+# `qiita_client.util.system_call` to terminate its child processes if the job
+# is cancelled
+JOB_CANCEL_TOKEN = None
+
+# Seconds given to the child processes of a cancelled job to exit after
+# SIGTERM, before killing them
+CANCEL_GRACE_PERIOD = 10
+
+# Seconds given to the child processes of the job to exit after SIGTERM when
+# this process exits or is stopped, before killing them
+EXIT_GRACE_PERIOD = 2
+
+# The clients created in this process, re-initialized by `_after_fork` in the
+# forked processes
+_CLIENTS = weakref.WeakSet()
+
+# Whether the handlers that terminate the child processes of the job when
+# this process exits have been installed
+_EXIT_HANDLERS_INSTALLED = False
+
+# The job statuses in which a job is still expected to be executing
+ACTIVE_JOB_STATUSES = ('queued', 'running')
+
+# The statuses of the jobs that are done executing
+FINISHED_JOB_STATUSES = ('success', 'error')
+
+# Seconds between the heartbeats of a job, unless the server requests another
+# interval with the 'heartbeat_interval' field of the heartbeat responses
+HEARTBEAT_INTERVAL = 30
+
+# Maximum seconds between heartbeats while backing off from a loaded server
+MAX_HEARTBEAT_INTERVAL = 120
+
+# Heartbeats slower than this, in seconds, are a sign of an overloaded server
+HEARTBEAT_SLOW_LATENCY = 2
+
+# Fraction of the interval randomly added to or subtracted from each wait, so
+# the jobs started together don't send their heartbeats in sync
+HEARTBEAT_JITTER = 0.1
+
+# Size of the buffer used to read the files when computing their checksums.
+# Large reads keep the number of system calls low, and hashlib releases the
+# GIL while hashing each chunk so several files can be hashed in parallel
+CHECKSUM_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Number of filepaths encoded at once when streaming a completion payload
+PAYLOAD_CHUNK_SIZE = 1000
+
+# Size of the chunks read from the streamed responses
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+
+def _requests():
+    """Returns the `requests` module, importing it on first use
+
+    Importing requests is a large part of the start up time of a plugin
+    process, so it is only imported once a request is sent
+    """
+    import requests
+    return requests
+
 
 class ArtifactInfo(object):
     """Output artifact information
@@ -28,14 +107,21 @@ class ArtifactInfo(object):
         Qiita's artifact type
     files : list of (str, str)
         The list of (filepath, Qiita's filepath type) that form the artifact
+
+    Attributes
+    ----------
+    checksums : dict of {str: dict} or None
+        The checksum and size of the files, keyed by filepath. Only available
+        after calling `compute_checksums`
     """
     def __init__(self, output_name, artifact_type, files):
         self.output_name = output_name
         self.artifact_type = artifact_type
         self.files = files
+        self.checksums = None
 
     def __eq__(self, other):
-        if type(self) != type(other):
+        if not isinstance(other, (ArtifactInfo, CompactArtifactInfo)):
             return False
         if self.output_name != other.output_name or \
                 self.artifact_type != other.artifact_type or \
@@ -46,8 +132,524 @@ class ArtifactInfo(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def compute_checksums(self, algorithm='md5', n_jobs=None):
+        """Computes the checksum and size of the artifact files
+
+        Parameters
+        ----------
+        algorithm : str, optional
+            The checksum algorithm. Any algorithm supported by hashlib, or
+            'xxh64'/'xxh128'/... if the xxhash package is installed.
+            Default: 'md5'
+        n_jobs : int, optional
+            The number of files to process in parallel. Default: the number
+            of CPUs
+        """
+        _compute_checksums([self], algorithm=algorithm, n_jobs=n_jobs)
+
+
+def _iter_directory(directory, filepath_type, pattern, recursive):
+    """Yields (filepath, filepath_type) for the files in `directory`"""
+    dirs = [directory]
+    while dirs:
+        current = dirs.pop()
+        for name in listdir(current):
+            fp = join(current, name)
+            if isdir(fp):
+                if recursive:
+                    dirs.append(fp)
+            elif pattern is None or fnmatch(name, pattern):
+                yield fp, filepath_type
+
+
+class CompactArtifactInfo(object):
+    """Memory efficient output artifact information for large file lists
+
+    It can be used anywhere an ArtifactInfo is accepted, and it is equal to
+    an ArtifactInfo with the same contents. The files are stored in a tuple,
+    the filepath type strings are shared between all the files, and the
+    instance is immutable (the checksums can only be set with
+    `compute_checksums`) so the set of files and the hash used in comparisons
+    are computed only once.
+
+    Parameters
+    ----------
+    output_name : str
+        The command's output name
+    artifact_type : str
+        Qiita's artifact type
+    files : iterable of (str, str)
+        The (filepath, Qiita's filepath type) that form the artifact. It is
+        not consumed until the files are accessed for the first time
+
+    Attributes
+    ----------
+    checksums : dict of {str: dict} or None
+        The checksum and size of the files, keyed by filepath. Only available
+        after calling `compute_checksums`
+    """
+    __slots__ = ('_output_name', '_artifact_type', '_checksums', '_source',
+                 '_files', '_fileset', '_hash')
+
+    def __init__(self, output_name, artifact_type, files):
+        self._output_name = output_name
+        self._artifact_type = artifact_type
+        self._checksums = None
+        self._source = files
+        self._files = None
+        self._fileset = None
+        self._hash = None
+
+    def __getstate__(self):
+        # The files are materialized, since their source can be a generator
+        return (self._output_name, self._artifact_type, self.files,
+                self._checksums)
+
+    def __setstate__(self, state):
+        (self._output_name, self._artifact_type, self._files,
+         self._checksums) = state
+        self._source = self._fileset = self._hash = None
+
+    @classmethod
+    def from_directory(cls, output_name, artifact_type, directory,
+                       filepath_type, pattern=None, recursive=False):
+        """Creates the artifact information from the files in a directory
+
+        The directory is not listed until the files are accessed for the
+        first time.
+
+        Parameters
+        ----------
+        output_name : str
+            The command's output name
+        artifact_type : str
+            Qiita's artifact type
+        directory : str
+            The directory containing the files
+        filepath_type : str
+            Qiita's filepath type of all the files
+        pattern : str, optional
+            Shell-style wildcard that the file names should match, e.g.
+            '*.fastq.gz'. Default: all files
+        recursive : bool, optional
+            Whether to include the files in the subdirectories.
+            Default: False
+
+        Returns
+        -------
+        CompactArtifactInfo
+        """
+        return cls(output_name, artifact_type,
+                   _iter_directory(directory, filepath_type, pattern,
+                                   recursive))
+
+    @property
+    def output_name(self):
+        """The command's output name"""
+        return self._output_name
+
+    @property
+    def artifact_type(self):
+        """Qiita's artifact type"""
+        return self._artifact_type
+
+    @property
+    def checksums(self):
+        """The checksum and size of the files, keyed by filepath"""
+        return self._checksums
+
+    @property
+    def files(self):
+        """The tuple of (filepath, Qiita's filepath type) of the artifact"""
+        if self._files is None:
+            fp_types = {}
+            self._files = tuple(
+                (fp, fp_types.setdefault(fp_type, fp_type))
+                for fp, fp_type in self._source)
+            self._source = None
+        return self._files
+
+    def _get_fileset(self):
+        if self._fileset is None:
+            self._fileset = frozenset(self.files)
+        return self._fileset
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self.output_name, self.artifact_type,
+                               self._get_fileset()))
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, ArtifactInfo):
+            return other == self
+        if not isinstance(other, CompactArtifactInfo):
+            return False
+        if self is other:
+            return True
+        if self.output_name != other.output_name or \
+                self.artifact_type != other.artifact_type or \
+                hash(self) != hash(other):
+            return False
+        return self._get_fileset() == other._get_fileset()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def compute_checksums(self, algorithm='md5', n_jobs=None):
+        """Computes the checksum and size of the artifact files
+
+        See `ArtifactInfo.compute_checksums`
+        """
+        _compute_checksums([self], algorithm=algorithm, n_jobs=n_jobs)
+
+
+def _new_hasher(algorithm):
+    """Returns a new hash object for the given algorithm
+
+    Raises
+    ------
+    ValueError
+        If the algorithm is not available
+    """
+    if algorithm.startswith('xxh'):
+        try:
+            import xxhash
+        except ImportError:
+            raise ValueError("The checksum algorithm '%s' requires the xxhash "
+                             "package" % algorithm)
+        if not hasattr(xxhash, algorithm):
+            raise ValueError("Unknown checksum algorithm '%s'" % algorithm)
+        return getattr(xxhash, algorithm)()
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise ValueError("Unknown checksum algorithm '%s'" % algorithm)
+
+
+def _file_checksum(fp, algorithm):
+    """Computes the checksum and size of a file
+
+    Parameters
+    ----------
+    fp : str
+        The filepath
+    algorithm : str
+        The checksum algorithm
+
+    Returns
+    -------
+    dict of {str: str or int}
+        Format: {'algorithm': str, 'checksum': str, 'size': int}
+    """
+    hasher = _new_hasher(algorithm)
+    buf = bytearray(CHECKSUM_BUFFER_SIZE)
+    view = memoryview(buf)
+    size = 0
+    with open(fp, 'rb', buffering=0) as f:
+        n = f.readinto(buf)
+        while n:
+            hasher.update(view[:n])
+            size += n
+            n = f.readinto(buf)
+    return {'algorithm': algorithm, 'checksum': hasher.hexdigest(),
+            'size': size}
+
+
+def _compute_checksums(artifacts_info, algorithm='md5', n_jobs=None):
+    """Computes the checksums of the files of several artifacts in parallel
+
+    The `checksums` attribute of each artifact is set with the results.
+    Filepaths that are not regular files (e.g. directories) are skipped.
+
+    Parameters
+    ----------
+    artifacts_info : list of ArtifactInfo
+        The artifacts
+    algorithm : str, optional
+        The checksum algorithm. Default: 'md5'
+    n_jobs : int, optional
+        The number of files to process in parallel. Default: the number of
+        CPUs
+
+    Raises
+    ------
+    ValueError
+        If the algorithm is not available
+    IOError
+        If any of the files does not exist
+    """
+    from multiprocessing.pool import ThreadPool
+
+    # Fail early if the algorithm is not available
+    _new_hasher(algorithm)
+
+    fps = {fp for a_info in artifacts_info for fp, _ in a_info.files}
+    missing = sorted(fp for fp in fps if not exists(fp))
+    if missing:
+        raise IOError("The following output files do not exist: %s"
+                      % ', '.join(missing))
+    fps = sorted((fp for fp in fps if isfile(fp)), key=getsize, reverse=True)
+    # Start with the largest files so the pool doesn't end up waiting on a
+    # single big file at the end
+    pool = ThreadPool(n_jobs)
+    try:
+        results = dict(zip(fps, pool.map(
+            lambda fp: _file_checksum(fp, algorithm), fps, chunksize=1)))
+    finally:
+        pool.close()
+        pool.join()
+
+    for a_info in artifacts_info:
+        checksums = {fp: results[fp] for fp, _ in a_info.files
+                     if fp in results}
+        if isinstance(a_info, CompactArtifactInfo):
+            a_info._checksums = checksums
+        else:
+            a_info.checksums = checksums
+
+
+def _group_exists(proc):
+    """Whether the process group of a child process still has processes
+
+    The process is reaped first, so a finished group leader doesn't keep the
+    group around as a zombie
+    """
+    proc.poll()
+    try:
+        killpg(proc.pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class CancellationToken(object):
+    """Signals that a job has been cancelled
+
+    Long running commands can check `cancelled` (or call `check`) between
+    steps to stop early. The child processes started with
+    `qiita_client.util.system_call` while the token is active are registered
+    in it, and they are terminated as soon as the job is cancelled.
+
+    Attributes
+    ----------
+    reason : str or None
+        Why the job was cancelled
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._procs = set()
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        """Whether the job has been cancelled"""
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """Waits until the job is cancelled or `timeout` seconds pass
+
+        Returns
+        -------
+        bool
+            Whether the job has been cancelled
+        """
+        return self._event.wait(timeout)
+
+    def _after_fork(self):
+        """Re-creates the lock and the event in a forked process, where
+        they may have been held by a thread of the parent"""
+        cancelled = self.cancelled
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        if cancelled:
+            self._event.set()
+
+    def check(self):
+        """Raises JobCancelledError if the job has been cancelled"""
+        if self.cancelled:
+            raise JobCancelledError("Job cancelled: %s" % self.reason)
+
+    def cancel(self, reason):
+        """Cancels the job and terminates its registered child processes
+
+        Parameters
+        ----------
+        reason : str
+            Why the job is cancelled
+        """
+        with self._lock:
+            if self.cancelled:
+                return
+            self.reason = reason
+            self._event.set()
+            procs = list(self._procs)
+        for proc in procs:
+            self._terminate(proc)
+
+    def register_process(self, proc):
+        """Registers a child process to terminate if the job is cancelled
+
+        The process should have been started in its own process group, so the
+        whole group can be signaled
+
+        Parameters
+        ----------
+        proc : subprocess.Popen
+            The process
+        """
+        with self._lock:
+            self._procs.add(proc)
+            cancelled = self.cancelled
+        if cancelled:
+            self._terminate(proc)
+
+    def unregister_process(self, proc):
+        """Unregisters a child process once it has finished"""
+        with self._lock:
+            self._procs.discard(proc)
+
+    def kill(self, grace_period=0):
+        """Kills the process groups of the registered child processes
+
+        Unlike the termination started by `cancel`, it only returns once the
+        process groups have been sent SIGKILL, so it can be used right before
+        exiting the current process
+
+        Parameters
+        ----------
+        grace_period : float, optional
+            Seconds given to the process groups to exit (e.g. after `cancel`
+            sent them SIGTERM) before killing them. Default: 0
+        """
+        with self._lock:
+            procs = list(self._procs)
+
+        deadline = time.time() + grace_period
+        procs = [p for p in procs if _group_exists(p)]
+        while procs and time.time() < deadline:
+            time.sleep(0.05)
+            procs = [p for p in procs if _group_exists(p)]
+        for proc in procs:
+            try:
+                killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def _terminate(self, proc):
+        """Sends SIGTERM to the process group, and SIGKILL after
+        CANCEL_GRACE_PERIOD seconds if it didn't exit
+
+        The SIGKILL is sent while any process of the group is alive, even if
+        the group leader exited (e.g. a shell whose child ignores SIGTERM)
+        """
+        def kill(sig):
+            if _group_exists(proc):
+                try:
+                    killpg(proc.pid, sig)
+                except OSError:
+                    pass
+
+        kill(signal.SIGTERM)
+        timer = threading.Timer(CANCEL_GRACE_PERIOD, kill,
+                                args=(signal.SIGKILL,))
+        timer.daemon = True
+        timer.start()
+
+
+def _after_fork():
+    """Makes the clients usable in a process forked from this one
+
+    The threads of the parent (e.g. the one sending the heartbeats) don't
+    exist in the forked process, so the locks that they held at the time of
+    the fork would never be released, and the connections kept open by the
+    transports would be shared by both processes
+    """
+    for qclient in list(_CLIENTS):
+        qclient._after_fork()
+    if JOB_CANCEL_TOKEN is not None:
+        JOB_CANCEL_TOKEN._after_fork()
+
+
+def _kill_job_processes():
+    """Terminates the child processes of the job running in this process
+
+    They run in their own process groups, so they are not stopped with this
+    process: they are sent SIGTERM and, after EXIT_GRACE_PERIOD seconds,
+    SIGKILL
+    """
+    token = JOB_CANCEL_TOKEN
+    if token is not None and token._procs:
+        token.cancel("the plugin process exited")
+        token.kill(EXIT_GRACE_PERIOD)
+
+
+def _on_sigterm(signum, frame):
+    """Terminates the child processes of the job and exits"""
+    _kill_job_processes()
+    sys.exit(128 + signum)
+
+
+def _install_exit_handlers():
+    """Terminates the child processes of the job when this process exits
+
+    The SIGTERM handler (e.g. sent by a job scheduler) is only installed if
+    no other one was, and only from the main thread
+    """
+    global _EXIT_HANDLERS_INSTALLED
+    if _EXIT_HANDLERS_INSTALLED:
+        return
+    _EXIT_HANDLERS_INSTALLED = True
+
+    import atexit
+
+    atexit.register(_kill_job_processes)
+    try:
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, _on_sigterm)
+    except ValueError:
+        # Not in the main thread
+        pass
+
+
+def _job_is_active(qclient, job_id):
+    """Whether the server reports the job as queued or running
+
+    If the job status can't be retrieved, the job is assumed to be active
+    """
+    try:
+        status = qclient.get_job_info(job_id)['status']
+    except Exception:
+        return True
+    return status in ACTIVE_JOB_STATUSES
+
+
+def _next_heartbeat_interval(interval, base, latency=None):
+    """Returns the interval until the next heartbeat
+
+    Parameters
+    ----------
+    interval : float
+        The current interval, in seconds
+    base : float
+        The configured interval, or the one requested by the server
+    latency : float, optional
+        The duration of the last heartbeat, or None if it failed
+
+    Returns
+    -------
+    float
+        The current interval doubled (up to MAX_HEARTBEAT_INTERVAL) if the
+        last heartbeat failed or was slow, or halved down to `base` otherwise
+    """
+    if latency is None or latency > HEARTBEAT_SLOW_LATENCY:
+        return min(max(interval * 2, base), max(MAX_HEARTBEAT_INTERVAL, base))
+    return max(interval / 2., base)
+
 
-def _heartbeat(qclient, url):
+def _heartbeat(qclient, url, job_id=None, cancel_token=None,
+               interval=HEARTBEAT_INTERVAL, stop=None):
     """Send the heartbeat calls to the server
 
     Parameters
@@ -56,34 +658,91 @@ def _heartbeat(qclient, url):
         The Qiita server client
     url : str
         The url to issue the heartbeat
+    job_id : str, optional
+        The job id. Required to detect that the job has been cancelled
+    cancel_token : CancellationToken, optional
+        The token to cancel if the job is no longer active in the server
+    interval : float, optional
+        The seconds between heartbeats. Default: HEARTBEAT_INTERVAL
+    stop : threading.Event, optional
+        The heartbeats stop once it is set, e.g. when the job completes
 
     Notes
     -----
     If the Qiita server is not reachable, this function will wait 5 minutes
     before retrying another heartbeat. This is useful for updating the Qiita
     server without stopping long running jobs.
+
+    The interval adapts to the server load: it doubles (up to
+    MAX_HEARTBEAT_INTERVAL) after a heartbeat that fails or takes longer than
+    HEARTBEAT_SLOW_LATENCY, and goes back to `interval` as the heartbeats
+    succeed again. The server can replace `interval` with the
+    'heartbeat_interval' field of its responses. Each wait is randomized by
+    HEARTBEAT_JITTER.
+
+    If the server rejects the heartbeat (with an error status, or with a
+    response whose 'success' is False) and the job is no longer queued or
+    running, the job has been cancelled (or failed) in Qiita. In that case
+    `cancel_token` is cancelled and the heartbeats stop.
     """
+    requests = _requests()
+
+    base = interval
     retries = 2
     while not JOB_COMPLETED and retries > 0:
+        if cancel_token is not None and cancel_token.cancelled:
+            break
+        if stop is not None and stop.is_set():
+            break
+        latency = None
         try:
-            qclient.post(url, data='')
+            start = time.time()
+            response = qclient.post(url, data='')
+            latency = time.time() - start
             retries = 2
+            if not isinstance(response, dict):
+                response = {}
+            if response.get('success') is False and \
+                    cancel_token is not None and job_id is not None and \
+                    not _job_is_active(qclient, job_id):
+                # Qiita answers the heartbeats of the jobs that are no longer
+                # running with an error message, not with an error status
+                cancel_token.cancel("the heartbeat was rejected: %s"
+                                    % response.get('error'))
+                break
+            if response.get('heartbeat_interval'):
+                base = float(response['heartbeat_interval'])
         except requests.ConnectionError:
             # This error occurs when the Qiita server is not reachable. This
             # may occur when we are updating the server, and we don't want
             # the job to fail. In this case, we wait for 5 min and try again
             time.sleep(300)
             retries -= 1
-        except QiitaClientError:
-            # If we raised the error, we propagate it since it is a problem
-            # with the request that we are executing
+            # The wait replaces the interval until the next heartbeat
+            continue
+        except QiitaClientError as e:
+            # The server rejects the heartbeats of the jobs that are no
+            # longer running
+            if cancel_token is not None and job_id is not None and \
+                    not _job_is_active(qclient, job_id):
+                cancel_token.cancel("the heartbeat was rejected: %s" % e)
+                break
+            # Otherwise, we propagate it since it is a problem with the
+            # request that we are executing
             raise
+        except RuntimeError as e:
+            # The server failed to answer, even after retrying (e.g. it is
+            # overloaded). Back off, giving up if it keeps failing
+            retries -= 1
+            if retries == 0:
+                raise RuntimeError("Error executing heartbeat: %s" % str(e))
         except Exception as e:
             # If it is any other exception, raise a RuntimeError
             raise RuntimeError("Error executing heartbeat: %s" % str(e))
 
-        # Perform the heartbeat every 30 seconds
-        time.sleep(30)
+        interval = _next_heartbeat_interval(interval, base, latency)
+        time.sleep(interval * random.uniform(1 - HEARTBEAT_JITTER,
+                                             1 + HEARTBEAT_JITTER))
 
 
 def _format_payload(success, error_msg=None, artifacts_info=None):
@@ -107,12 +766,18 @@ def _format_payload(success, error_msg=None, artifacts_info=None):
          'error': str,
          'artifacts': dict of {str: {'artifact_type': str,
                                      'filepaths': list of (str, str)}}
+        If the checksums of an artifact have been computed, its dictionary
+        also contains the key 'checksums', with the output of
+        `ArtifactInfo.compute_checksums`
     """
     if success and artifacts_info:
-        artifacts = {
-            a_info.output_name: {'artifact_type': a_info.artifact_type,
-                                 'filepaths': a_info.files}
-            for a_info in artifacts_info}
+        artifacts = {}
+        for a_info in artifacts_info:
+            artifact = {'artifact_type': a_info.artifact_type,
+                        'filepaths': a_info.files}
+            if a_info.checksums is not None:
+                artifact['checksums'] = a_info.checksums
+            artifacts[a_info.output_name] = artifact
     else:
         artifacts = None
 
@@ -122,28 +787,299 @@ def _format_payload(success, error_msg=None, artifacts_info=None):
     return payload
 
 
+def _gzip_chunks(chunks):
+    """Gzip-compresses a sequence of byte chunks incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _PayloadStream(object):
+    """Streaming JSON encoding of the job completion payload
+
+    Produces the same JSON document as `dumps(_format_payload(...))` but in
+    chunks, so the complete payload is never held in memory. The object can be
+    iterated several times, which allows the request to be retried.
+
+    Parameters
+    ----------
+    success : bool
+        Whether if the job completed successfully or not
+    error_msg : str, optional
+        If `success` is False, ther error message to include in the optional.
+        If `success` is True, it is ignored
+    artifacts_info : list of ArtifactInfo, optional
+        The list of output artifact information
+    compress : bool, optional
+        Whether to gzip-compress the stream. Default: False
+    """
+    def __init__(self, success, error_msg=None, artifacts_info=None,
+                 compress=False):
+        self.success = success
+        self.error_msg = error_msg
+        self.artifacts_info = artifacts_info
+        self.compress = compress
+
+    def __iter__(self):
+        chunks = (c.encode('utf-8') for c in self._iter_json())
+        if self.compress:
+            chunks = _gzip_chunks(chunks)
+        return chunks
+
+    def _iter_json(self):
+        enc = JSONEncoder()
+        yield '{"success": %s, "error": %s, "artifacts": ' % (
+            enc.encode(self.success),
+            enc.encode(self.error_msg if not self.success else ''))
+        if not (self.success and self.artifacts_info):
+            yield 'null}'
+            return
+
+        # Same semantics as building a dict: later outputs with the same name
+        # replace the earlier ones
+        artifacts = {a_info.output_name: a_info
+                     for a_info in self.artifacts_info}
+        yield '{'
+        for i, (name, a_info) in enumerate(artifacts.items()):
+            yield '%s%s: {"artifact_type": %s, "filepaths": [' % (
+                ', ' if i else '', enc.encode(name),
+                enc.encode(a_info.artifact_type))
+            files = iter(a_info.files)
+            sep = ''
+            chunk = list(islice(files, PAYLOAD_CHUNK_SIZE))
+            while chunk:
+                yield sep + enc.encode(chunk)[1:-1]
+                sep = ', '
+                chunk = list(islice(files, PAYLOAD_CHUNK_SIZE))
+            yield ']'
+            if a_info.checksums is not None:
+                yield ', "checksums": %s' % enc.encode(a_info.checksums)
+            yield '}'
+        yield '}}'
+
+
+def _compress_request_body(kwargs, threshold, compression='gzip'):
+    """Compresses the body of a request if it is larger than `threshold`
+
+    Parameters
+    ----------
+    kwargs : dict
+        The request kwargs
+    threshold : int
+        The minimum body size, in bytes, to compress the body
+    compression : {'gzip', 'zstd'}, optional
+        The compression algorithm. Default: 'gzip'
+
+    Returns
+    -------
+    dict
+        The request kwargs, with the compressed body in 'data' and the
+        Content-Encoding header set. The input kwargs are returned unchanged
+        if the body is smaller than `threshold`, is not a string, bytes or a
+        dictionary of form fields, or is already encoded
+    """
+    data = kwargs.get('data')
+    headers = dict(kwargs.get('headers') or {})
+    if data is None or 'Content-Encoding' in headers:
+        return kwargs
+
+    if isinstance(data, dict):
+        # Form fields - encode them ourselves so the encoded body can be
+        # compressed
+        try:
+            from urllib.parse import urlencode
+        except ImportError:
+            from urllib import urlencode
+        data = urlencode(data, doseq=True)
+        headers.setdefault('Content-Type',
+                           'application/x-www-form-urlencoded')
+    if not isinstance(data, bytes):
+        if not hasattr(data, 'encode'):
+            # Streams and file objects are sent as-is
+            return kwargs
+        data = data.encode('utf-8')
+    if len(data) < threshold:
+        return kwargs
+
+    if compression == 'zstd':
+        import zstandard
+        data = zstandard.ZstdCompressor().compress(data)
+    else:
+        data = b''.join(_gzip_chunks([data]))
+    headers['Content-Encoding'] = compression
+
+    kwargs = dict(kwargs)
+    kwargs['data'] = data
+    kwargs['headers'] = headers
+    return kwargs
+
+
+def _iter_response_items(response, path):
+    """Parses incrementally the items of a streamed JSON response
+
+    Parameters
+    ----------
+    response : requests.Response
+        The streamed response
+    path : sequence of str or int
+        The path to the array or object whose items are yielded
+
+    Yields
+    ------
+    object
+        The items
+    """
+    try:
+        for item in iter_json_items(
+                response.iter_content(RESPONSE_CHUNK_SIZE), path):
+            yield item
+    finally:
+        response.close()
+
+
+def _connection_failed(error):
+    """Whether a request failed before the connection was established
+
+    Parameters
+    ----------
+    error : IOError or OSError
+        The error raised by the request
+
+    Returns
+    -------
+    bool
+        Whether the request did not reach the server, so it can be sent to
+        another replica even if it is not idempotent
+    """
+    requests = _requests()
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.ConnectionError):
+        # The error raised by urllib3 after exhausting its retries
+        reason = getattr(error.args[0] if error.args else None, 'reason',
+                         None)
+        return isinstance(
+            reason, requests.packages.urllib3.exceptions.NewConnectionError)
+    # The errors of the transports that use sockets directly
+    return getattr(error, 'errno', None) in (errno.ECONNREFUSED,
+                                             errno.ENOENT)
+
+
 class QiitaClient(object):
     """Client of the Qiita RESTapi
 
     Parameters
     ----------
-    server_url : str
-        The url of the Qiita server
+    server_url : str or list of str
+        The url of the Qiita server, or the urls of its replicas (as a list
+        or a comma-separated string). The requests are spread over the
+        replicas, failing over to the others when one is not reachable
     client_id : str
         The client id to conenct to the Qiita server
     client_secret : str
         The client secret id to connect to the Qiita server
     server_cert : str, optional
         The server certificate, in case that it is not verified
+    compress_threshold : int, optional
+        If provided, request bodies of at least this number of bytes are
+        compressed before sending them to the server. Default: requests are
+        not compressed
+    compression : {'gzip', 'zstd'}, optional
+        The algorithm used to compress the request bodies. 'zstd' requires
+        the zstandard package. Default: 'gzip'
+    accept_encoding : str, optional
+        The value of the Accept-Encoding header sent to the server, e.g.
+        'identity' to request uncompressed responses. Default: the encodings
+        that requests is able to decode (gzip and deflate, plus br and zstd
+        if the brotli and zstandard packages are installed)
+    transport : object, optional
+        The object that sends the requests, instead of `requests`. It should
+        have a method `request(method, url, **kwargs)` returning the
+        response, like `qiita_client.transport.RecordingTransport` and
+        `qiita_client.transport.ReplayTransport`. Default: if the environment
+        variable QIITA_CLIENT_RECORD is set, the requests are recorded in the
+        file it names; if QIITA_CLIENT_REPLAY is set, the requests are
+        answered with the responses recorded in the file it names; if
+        QIITA_CLIENT_SIDECAR is set, the requests are sent through the
+        `qiita_client.sidecar.QiitaSidecar` listening on the socket it names.
+        Otherwise, the requests are sent with `requests`
+    json_decoder : callable, optional
+        The function used to decode the JSON responses, receiving the bytes
+        of the response body (e.g. `orjson.loads`). It should raise a
+        ValueError if the body is not valid JSON. Default: the `requests`
+        decoder
+    balancing : {'least_outstanding', 'round_robin'}, optional
+        How the GET requests are spread over the server replicas, see
+        `qiita_client.servers.ServerPool`. Default: 'least_outstanding'
+    sticky_jobs : bool, optional
+        Whether the requests to the endpoints of a job always go to the same
+        server replica (while it is healthy). Default: False
+    rate_limiter : qiita_client.ratelimit.RateLimiter, optional
+        Limits the rate of the requests sent to the server, giving priority
+        to the heartbeats and job completions over the GET requests and step
+        updates. Default: if the environment variable QIITA_CLIENT_RATE_LIMIT
+        is set, a limiter of that many requests per second, shared with the
+        other processes through the file named by QIITA_CLIENT_RATE_LIMIT_FILE
+        if it is set. Otherwise, the requests are not limited
+    heartbeat_interval : float, optional
+        The seconds between the heartbeats sent by `start_heartbeat`, which
+        adapt to the server load. Default: the environment variable
+        QIITA_CLIENT_HEARTBEAT_INTERVAL if it is set, HEARTBEAT_INTERVAL
+        otherwise
+
+    Attributes
+    ----------
+    cancel_token : CancellationToken
+        Cancelled when the server reports that the job whose heartbeats are
+        being sent is no longer running. Commands can use it to stop early
 
 
     Methods
     -------
     get
     post
+
+    Notes
+    -----
+    `requests` is imported the first time it is needed rather than at module
+    load, so importing the package stays cheap for short-lived plugin
+    processes.
     """
-    def __init__(self, server_url, client_id, client_secret, server_cert=None):
-        self._server_url = server_url
+    def __init__(self, server_url, client_id, client_secret, server_cert=None,
+                 compress_threshold=None, compression='gzip',
+                 accept_encoding=None, transport=None, json_decoder=None,
+                 balancing='least_outstanding', sticky_jobs=False,
+                 rate_limiter=None, heartbeat_interval=None):
+        urls = parse_server_urls(server_url)
+        self._servers = ServerPool(urls, policy=balancing,
+                                   sticky_jobs=sticky_jobs)
+        self._server_url = urls[0]
+        self._json_decoder = json_decoder
+
+        if transport is None:
+            if environ.get('QIITA_CLIENT_REPLAY'):
+                transport = ReplayTransport(environ['QIITA_CLIENT_REPLAY'])
+            elif environ.get('QIITA_CLIENT_RECORD'):
+                transport = RecordingTransport(environ['QIITA_CLIENT_RECORD'])
+            elif environ.get('QIITA_CLIENT_SIDECAR'):
+                transport = UnixSocketTransport(
+                    environ['QIITA_CLIENT_SIDECAR'])
+        self._transport = transport
+
+        if rate_limiter is None and environ.get('QIITA_CLIENT_RATE_LIMIT'):
+            rate_limiter = RateLimiter(
+                float(environ['QIITA_CLIENT_RATE_LIMIT']),
+                lock_fp=environ.get('QIITA_CLIENT_RATE_LIMIT_FILE') or None)
+        self._rate_limiter = rate_limiter
+
+        if heartbeat_interval is None:
+            heartbeat_interval = float(environ.get(
+                'QIITA_CLIENT_HEARTBEAT_INTERVAL', HEARTBEAT_INTERVAL))
+        self._heartbeat_interval = heartbeat_interval
 
         # The attribute self._verify is used to provide the parameter `verify`
         # to the get/post requests. According to their documentation (link:
@@ -163,14 +1099,63 @@ class QiitaClient(object):
             # of the server
             self._verify = server_cert
 
+        if compression not in ('gzip', 'zstd'):
+            raise ValueError("Unknown compression '%s'" % compression)
+        if compression == 'zstd':
+            try:
+                import zstandard  # noqa
+            except ImportError:
+                raise ValueError("The compression 'zstd' requires the "
+                                 "zstandard package")
+        self._compress_threshold = compress_threshold
+        self._compression = compression
+        self._accept_encoding = accept_encoding
+
+        # Cancelled when the server reports that the job whose heartbeat is
+        # being sent is no longer running
+        self.cancel_token = CancellationToken()
+        # Set when the job whose heartbeat is being sent completes
+        self._heartbeat_stop = None
+
         # Set up oauth2
         self._client_id = client_id
         self._client_secret = client_secret
-        self._authenticate_url = "%s/qiita_db/authenticate/" % self._server_url
+
+        _CLIENTS.add(self)
 
         # Fetch the access token
         self._fetch_token()
 
+    def _after_fork(self):
+        """Re-creates the locks and the connections shared with the parent
+        process after a fork"""
+        self._servers._after_fork()
+        if self._rate_limiter is not None:
+            self._rate_limiter._after_fork()
+        after_fork = getattr(self._transport, '_after_fork', None)
+        if after_fork is not None:
+            after_fork()
+        self.cancel_token._after_fork()
+
+    def _requester(self, method):
+        """Returns the function that issues requests with the given method
+
+        Parameters
+        ----------
+        method : {'get', 'post', 'patch'}
+            The HTTP method
+
+        Returns
+        -------
+        function
+            The function issuing the requests, with the `requests` interface
+        """
+        if self._transport is None:
+            return getattr(_requests(), method)
+        req = partial(self._transport.request, method)
+        req.__name__ = method
+        return req
+
     def _fetch_token(self):
         """Retrieves an access token from the Qiita server
 
@@ -182,12 +1167,64 @@ class QiitaClient(object):
         data = {'client_id': self._client_id,
                 'client_secret': self._client_secret,
                 'grant_type': 'client'}
-        r = requests.post(self._authenticate_url, verify=self._verify,
-                          data=data)
+        r = self._send(self._requester('post'), '/qiita_db/authenticate/',
+                       verify=self._verify, data=data)
         if r.status_code != 200:
             raise ValueError("Can't authenticate with the Qiita server")
         self._token = r.json()['access_token']
 
+    def _send(self, req, path, **kwargs):
+        """Sends a request to a server replica
+
+        If the replica is not reachable, the request is sent to the next one
+        until all of them have been tried. The requests that are not
+        idempotent are only sent to the next replica if the connection
+        couldn't be established, since otherwise the server may have
+        executed them. The request waits for the rate limiter, if any, before
+        being sent
+
+        Parameters
+        ----------
+        req : function
+            The request to execute
+        path : str
+            The path of the url to access in the server
+        kwargs : dict
+            The request kwargs
+
+        Returns
+        -------
+        requests.Response
+            The request response
+        """
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire(request_priority(req.__name__, path))
+        servers = self._servers
+        idempotent = req.__name__ == 'get'
+        tried = []
+        while True:
+            server = servers.choose(path, idempotent, exclude=tried)
+            servers.acquire(server)
+            try:
+                r = req(server + path, **kwargs)
+            except (IOError, OSError) as e:
+                # Includes the requests connection errors and timeouts, which
+                # derive from IOError (not OSError in Python 2) and the
+                # socket errors
+                servers.mark_down(server)
+                tried.append(server)
+                if len(tried) == len(servers.urls) or not (
+                        idempotent or _connection_failed(e)):
+                    raise
+                continue
+            finally:
+                servers.release(server)
+            if r.status_code in UNAVAILABLE_STATUSES:
+                servers.mark_down(server)
+            else:
+                servers.mark_up(server)
+            return r
+
     def _request_oauth2(self, req, *args, **kwargs):
         """Executes a request using OAuth2 authorization
 
@@ -210,7 +1247,8 @@ class QiitaClient(object):
         else:
             kwargs['headers'] = {'Authorization': 'Bearer %s' % self._token}
         r = req(*args, **kwargs)
-        r.close()
+        if not kwargs.get('stream'):
+            r.close()
         if r.status_code == 400:
             try:
                 r_json = r.json()
@@ -225,7 +1263,7 @@ class QiitaClient(object):
                 r = req(*args, **kwargs)
         return r
 
-    def _request_retry(self, req, url, **kwargs):
+    def _request_retry(self, req, url, stream_items=None, **kwargs):
         """Executes a request retrying it 2 times in case of failure
 
         Parameters
@@ -234,13 +1272,18 @@ class QiitaClient(object):
             The request to execute
         url : str
             The url to access in the server
+        stream_items : sequence of str or int, optional
+            If provided, the response is parsed incrementally and an iterator
+            over the items of the array or object found at this path is
+            returned, see `qiita_client.json_stream.iter_json_items`
         kwargs : dict
             The request kwargs
 
         Returns
         -------
-        dict or None
-            The JSON information in the request response, if any
+        dict, None or iterator
+            The JSON information in the request response, if any, or an
+            iterator over its items if `stream_items` is provided
 
         Raises
         ------
@@ -269,11 +1312,26 @@ class QiitaClient(object):
         implement 3, which is simple and allows to overcome simple
         communication problems.
         """
-        url = self._server_url + url
+        send = partial(self._send, req)
+        if self._compress_threshold is not None:
+            # Compress once, so retries reuse the compressed body
+            kwargs = _compress_request_body(kwargs, self._compress_threshold,
+                                            self._compression)
+        if self._accept_encoding is not None:
+            kwargs['headers'] = dict(kwargs.get('headers') or {})
+            kwargs['headers']['Accept-Encoding'] = self._accept_encoding
+        if stream_items is not None:
+            kwargs['stream'] = True
         retries = 2
         while retries > 0:
             retries -= 1
-            r = self._request_oauth2(req, url, verify=self._verify, **kwargs)
+            # A retry goes to another replica if this one is reported down
+            r = self._request_oauth2(send, url, verify=self._verify, **kwargs)
+            if stream_items is not None:
+                if r.status_code == 200:
+                    return _iter_response_items(r, stream_items)
+                # Read the error message before releasing the connection
+                r.content
             r.close()
             # There are some error codes that the specification says that they
             # shouldn't be retried
@@ -285,6 +1343,8 @@ class QiitaClient(object):
                 raise BadRequestError(r.text)
             elif r.status_code == 200:
                 try:
+                    if self._json_decoder is not None:
+                        return self._json_decoder(r.content)
                     return r.json()
                 except ValueError:
                     return None
@@ -293,22 +1353,47 @@ class QiitaClient(object):
             "Request '%s %s' did not succeed. Status code: %d. Message: %s"
             % (req.__name__, url, r.status_code, r.text))
 
-    def get(self, url, **kwargs):
+    def close(self):
+        """Closes the transport of the client, if any
+
+        E.g. it writes the end of the recording of a
+        `qiita_client.transport.RecordingTransport`
+        """
+        close = getattr(self._transport, 'close', None)
+        if close is not None:
+            close()
+
+    def get(self, url, stream_items=None, **kwargs):
         """Execute a get request against the Qiita server
 
         Parameters
         ----------
         url : str
             The url to access in the server
+        stream_items : sequence of str or int, optional
+            The path (keys of objects and indexes of arrays) to an array or
+            object in the response. If provided, the response is parsed
+            incrementally while it is downloaded, and an iterator over the
+            items of the array (or the (key, value) pairs of the object) is
+            returned. Recommended for large responses, since only one item is
+            kept in memory at a time
         kwargs : dict
             The request kwargs
 
         Returns
         -------
-        dict
-            The JSON response from the server
+        dict or iterator
+            The JSON response from the server, or an iterator over its items
+            if `stream_items` is provided
+
+        Examples
+        --------
+        >>> for sample, values in qclient.get(  # doctest: +SKIP
+        ...         '/api/v1/study/1/samples/info', stream_items=['samples']):
+        ...     process(sample, values)
         """
-        return self._request_retry(requests.get, url, **kwargs)
+        return self._request_retry(self._requester('get'), url,
+                                   stream_items=stream_items, **kwargs)
 
     def post(self, url, **kwargs):
         """Execute a post request against the Qiita server
@@ -325,7 +1410,7 @@ class QiitaClient(object):
         dict
             The JSON response from the server
         """
-        return self._request_retry(requests.post, url, **kwargs)
+        return self._request_retry(self._requester('post'), url, **kwargs)
 
     def patch(self, url, op, path, value=None, from_p=None, **kwargs):
         """Executes a patch request against the Qiita server
@@ -378,7 +1463,7 @@ class QiitaClient(object):
         # we made sure that data is correctly formatted here
         kwargs['data'] = data
 
-        return self._request_retry(requests.patch, url, **kwargs)
+        return self._request_retry(self._requester('patch'), url, **kwargs)
 
     # The functions are shortcuts for common functionality that all plugins
     # need to implement.
@@ -386,18 +1471,43 @@ class QiitaClient(object):
     def start_heartbeat(self, job_id):
         """Create and start a thread that would send heartbeats to the server
 
+        If the server reports that the job is no longer running (e.g. it has
+        been cancelled by the user), `cancel_token` is cancelled.
+
         Parameters
         ----------
         job_id : str
             The job id
+
+        Notes
+        -----
+        A process can execute several jobs one after the other. If the
+        client already sent the heartbeats of a previous job, they are
+        stopped and `cancel_token` is replaced by a new token for this job.
+
+        The child processes started with `qiita_client.util.system_call`
+        while the job runs are terminated if this process exits or receives
+        SIGTERM (unless the plugin installed its own SIGTERM handler).
         """
+        global JOB_COMPLETED, JOB_CANCEL_TOKEN
+        if self._heartbeat_stop is not None:
+            self._heartbeat_stop.set()
+            self.cancel_token = CancellationToken()
+        self._heartbeat_stop = threading.Event()
+
         url = "/qiita_db/jobs/%s/heartbeat/" % job_id
         # Execute the first heartbeat, since it is the one that sets the job
         # to a running state - so make sure that other calls to the job work
         # as expected
         self.post(url, data='')
-        heartbeat_thread = threading.Thread(target=_heartbeat,
-                                            args=(self, url))
+        JOB_COMPLETED = False
+        JOB_CANCEL_TOKEN = self.cancel_token
+        _install_exit_handlers()
+        heartbeat_thread = threading.Thread(
+            target=_heartbeat, args=(self, url),
+            kwargs={'job_id': job_id, 'cancel_token': self.cancel_token,
+                    'interval': self._heartbeat_interval,
+                    'stop': self._heartbeat_stop})
         heartbeat_thread.daemon = True
         heartbeat_thread.start()
 
@@ -416,6 +1526,99 @@ class QiitaClient(object):
         """
         return self.get("/qiita_db/jobs/%s" % job_id)
 
+    def wait_for_jobs(self, job_ids, timeout=None, poll_interval=1,
+                      max_poll_interval=30, n_jobs=8):
+        """Waits for several jobs to finish, yielding them as they do
+
+        Parameters
+        ----------
+        job_ids : list of str
+            The ids of the jobs to wait for
+        timeout : float, optional
+            The maximum number of seconds to wait. Default: no limit
+        poll_interval : float, optional
+            The initial number of seconds between status checks. Default: 1
+        max_poll_interval : float, optional
+            The maximum number of seconds between status checks. Default: 30
+        n_jobs : int, optional
+            The maximum number of status requests issued concurrently.
+            Default: 8
+
+        Yields
+        ------
+        str, str
+            The id and the final status of each job, as soon as it is
+            detected that the job finished
+
+        Raises
+        ------
+        RuntimeError
+            If some jobs didn't finish before `timeout`
+        QiitaClientError
+            If the status of a job can't be retrieved for a reason other than
+            a transient error (e.g. the job doesn't exist)
+
+        Notes
+        -----
+        The status of all the unfinished jobs is checked in parallel. The
+        interval between checks doubles (up to `max_poll_interval`) each time
+        no job finishes, and goes back to `poll_interval` when any job
+        finishes, so long waits issue few requests while bursts of jobs
+        finishing together are detected quickly.
+
+        A job whose status can't be retrieved because of a transient error
+        (the server can't be reached, or keeps answering with server errors)
+        is considered still pending and checked again in the next poll.
+        """
+        pending = list(OrderedDict.fromkeys(job_ids))
+        if not pending:
+            return
+
+        from multiprocessing.pool import ThreadPool
+
+        requests = _requests()
+
+        def job_status(job_id):
+            try:
+                return self.get_job_info(job_id)['status']
+            except (requests.ConnectionError, requests.Timeout,
+                    RuntimeError):
+                return None
+
+        deadline = time.time() + timeout if timeout is not None else None
+        interval = poll_interval
+        pool = ThreadPool(min(n_jobs, len(pending)))
+        try:
+            while True:
+                statuses = pool.map(job_status, pending, chunksize=1)
+                still_pending = []
+                for job_id, status in zip(pending, statuses):
+                    if status in FINISHED_JOB_STATUSES:
+                        yield job_id, status
+                    else:
+                        still_pending.append(job_id)
+                if not still_pending:
+                    return
+
+                if len(still_pending) < len(pending):
+                    interval = poll_interval
+                else:
+                    interval = min(interval * 2, max_poll_interval)
+                pending = still_pending
+
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise RuntimeError(
+                            "Jobs not finished after %s seconds: %s"
+                            % (timeout, ', '.join(pending)))
+                    time.sleep(min(interval, remaining))
+                else:
+                    time.sleep(interval)
+        finally:
+            pool.close()
+            pool.join()
+
     def update_job_step(self, job_id, new_step):
         """Updates the current step of the job in the server
 
@@ -430,7 +1633,8 @@ class QiitaClient(object):
         self.post("/qiita_db/jobs/%s/step/" % job_id, data=json_payload)
 
     def complete_job(self, job_id, success, error_msg=None,
-                     artifacts_info=None):
+                     artifacts_info=None, checksum_algorithm=None,
+                     checksum_jobs=None, stream=False, compress=None):
         """Stops the heartbeat thread and send the job results to the server
 
         Parameters
@@ -444,11 +1648,61 @@ class QiitaClient(object):
             If `success` is True, it is ignored
         artifacts_info : list of ArtifactInfo
             The list of output artifact information
+        checksum_algorithm : str, optional
+            If provided, the checksum and size of all the output files are
+            computed using this algorithm and sent to the server, see
+            `ArtifactInfo.compute_checksums`
+        checksum_jobs : int, optional
+            The number of files to checksum in parallel. Default: the number
+            of CPUs
+        stream : bool, optional
+            Whether to encode the payload incrementally and send it using
+            chunked transfer encoding, instead of building the whole request
+            body in memory. Recommended for artifacts with a large number of
+            files. Default: False
+        compress : bool, optional
+            Whether to gzip-compress the request body. Default: compress
+            streamed payloads if the client compresses requests, and follow
+            the client `compress_threshold` otherwise
+
+        Notes
+        -----
+        If the checksums of the output files can't be computed (e.g. a file
+        is missing or can't be read), the job is completed as failed with the
+        reason as error message.
         """
+        if success and artifacts_info and checksum_algorithm:
+            # Computed before stopping the heartbeat since it can take a while
+            # for large artifacts
+            try:
+                _compute_checksums(artifacts_info,
+                                   algorithm=checksum_algorithm,
+                                   n_jobs=checksum_jobs)
+            except Exception as e:
+                success = False
+                error_msg = ("Error computing the checksums of the output "
+                             "files: %s" % e)
+
         # Stop the heartbeat thread
         global JOB_COMPLETED
         JOB_COMPLETED = True
-        json_payload = dumps(_format_payload(success, error_msg=error_msg,
-                                             artifacts_info=artifacts_info))
+        if self._heartbeat_stop is not None:
+            self._heartbeat_stop.set()
+        kwargs = {}
+        if stream and compress is None:
+            # The size of a streamed payload is not known in advance
+            compress = self._compress_threshold is not None
+        if stream or compress:
+            json_payload = _PayloadStream(success, error_msg=error_msg,
+                                          artifacts_info=artifacts_info,
+                                          compress=compress)
+            if not stream:
+                json_payload = b''.join(json_payload)
+            if compress:
+                kwargs['headers'] = {'Content-Encoding': 'gzip'}
+        else:
+            json_payload = dumps(_format_payload(
+                success, error_msg=error_msg, artifacts_info=artifacts_info))
         # Create the URL where we have to post the results
-        self.post("/qiita_db/jobs/%s/complete/" % job_id, data=json_payload)
+        self.post("/qiita_db/jobs/%s/complete/" % job_id, data=json_payload,
+                  **kwargs)
@@ -0,0 +1,165 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import os
+import re
+import threading
+from time import time
+
+# The priority classes of the requests, from highest to lowest
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Fraction of the bucket capacity that the requests of each priority class
+# leave for the higher ones, so a burst of low priority requests can't starve
+# the heartbeats of the running jobs (also across processes)
+_RESERVED = {PRIORITY_HIGH: 0, PRIORITY_NORMAL: 0.25, PRIORITY_LOW: 0.5}
+
+_HIGH_PRIORITY_RE = re.compile(r'/qiita_db/jobs/[^/]+/(heartbeat|complete)/$')
+_STEP_RE = re.compile(r'/qiita_db/jobs/[^/]+/step/$')
+
+
+def request_priority(method, path):
+    """Returns the priority class of a request
+
+    Parameters
+    ----------
+    method : str
+        The HTTP method
+    path : str
+        The path of the request
+
+    Returns
+    -------
+    int
+        PRIORITY_HIGH for the heartbeats and job completions, PRIORITY_LOW
+        for the GET requests and the step updates and PRIORITY_NORMAL for
+        the rest
+    """
+    method = method.upper()
+    if method == 'POST' and _HIGH_PRIORITY_RE.match(path):
+        return PRIORITY_HIGH
+    if method == 'GET' or (method == 'POST' and _STEP_RE.match(path)):
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
+
+class RateLimiter(object):
+    """Token bucket limiting the rate of the requests sent to the server
+
+    Parameters
+    ----------
+    rate : float
+        The sustained number of requests per second
+    burst : int, optional
+        The capacity of the bucket, i.e. the number of requests that can be
+        sent at once after a quiet period. Default: `rate` (at least 1)
+    lock_fp : str, optional
+        If provided, the bucket is stored in this file and shared by all the
+        processes that use it (e.g. all the jobs of a node). Default: the
+        bucket is private to this limiter
+
+    Raises
+    ------
+    ValueError
+        If `rate` is not positive
+
+    Notes
+    -----
+    The requests of each priority class can only take the tokens that are
+    not reserved for the higher classes, and within a process a request
+    waits while requests of higher priority are waiting.
+
+    The shared bucket is locked with `fcntl.flock`, so the file must be in
+    a local filesystem.
+    """
+    def __init__(self, rate, burst=None, lock_fp=None):
+        if rate <= 0:
+            raise ValueError("The rate limit should be positive: %s" % rate)
+        self.rate = float(rate)
+        self.burst = max(burst or self.rate, 1)
+        self.lock_fp = lock_fp
+        self._cond = threading.Condition()
+        self._waiting = {p: 0 for p in _RESERVED}
+        self._tokens = self.burst
+        self._last = time()
+
+    def _after_fork(self):
+        """Re-creates the condition in a forked process, where it may have
+        been held by a thread of the parent, whose waiting requests are not
+        in this process"""
+        self._cond = threading.Condition()
+        self._waiting = {p: 0 for p in _RESERVED}
+
+    def _refill(self, tokens, last, priority):
+        """Refills the bucket and takes a token if available
+
+        Returns
+        -------
+        float, float, float
+            The tokens left, the time of the refill and the seconds to wait
+            for a token, or 0 if one was taken
+        """
+        now = time()
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        needed = 1 + _RESERVED[priority] * (self.burst - 1)
+        if tokens >= needed:
+            return tokens - 1, now, 0
+        return tokens, now, (needed - tokens) / self.rate
+
+    def _take(self, priority):
+        """Takes a token, returning the seconds to wait if there are none"""
+        if self.lock_fp is None:
+            self._tokens, self._last, wait = self._refill(
+                self._tokens, self._last, priority)
+            return wait
+
+        import fcntl
+
+        fd = os.open(self.lock_fp, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            state = os.read(fd, 64).split()
+            if len(state) == 2:
+                tokens, last = float(state[0]), float(state[1])
+            else:
+                tokens, last = self.burst, time()
+            tokens, last, wait = self._refill(tokens, last, priority)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, ('%r %r' % (tokens, last)).encode('ascii'))
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+        return wait
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """Waits until a request of the given priority can be sent
+
+        Parameters
+        ----------
+        priority : int, optional
+            The priority class of the request. Default: PRIORITY_NORMAL
+        """
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    if any(n for p, n in self._waiting.items()
+                           if p < priority):
+                        # Woken up when the higher priority requests are sent
+                        wait = 1 / self.rate
+                    else:
+                        wait = self._take(priority)
+                        if not wait:
+                            return
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
@@ -0,0 +1,101 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import mmap
+from os.path import abspath
+
+# The reference files mapped in this process, keyed by reference name. Each
+# value is a (filepath, mmap) tuple. The maps are removed when they are
+# closed, so all of them are open (mmap objects only report whether they are
+# closed since Python 3.2)
+_REFERENCES = {}
+
+
+def _close(mapped):
+    """Closes a map, unless its data is still being used"""
+    try:
+        mapped.close()
+    except BufferError:
+        # There are views of the data, it is unmapped once they are released
+        pass
+
+
+def load_reference(name, filepath):
+    """Maps a reference file in memory, read-only
+
+    Parameters
+    ----------
+    name : str
+        The reference name
+    filepath : str
+        The reference filepath
+
+    Returns
+    -------
+    mmap.mmap
+        The read-only memory map of the file
+
+    Notes
+    -----
+    The file is mapped only once per process, the following calls return the
+    same map. The pages of the map are backed by the operating system page
+    cache, so all the processes mapping the same file (e.g. concurrent jobs
+    in the same node, or the child processes forked by the plugin) share a
+    single copy of the data in memory, and only the first one pays the cost
+    of reading it from disk.
+
+    The map should not be closed by the caller, use `unload_references`.
+    """
+    filepath = abspath(filepath)
+    if name in _REFERENCES:
+        loaded_fp, mapped = _REFERENCES[name]
+        if loaded_fp == filepath:
+            return mapped
+        del _REFERENCES[name]
+        _close(mapped)
+
+    with open(filepath, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, 'MADV_WILLNEED'):
+        # Start reading the file in the background, it is most likely going
+        # to be read entirely
+        mapped.madvise(mmap.MADV_WILLNEED)
+    _REFERENCES[name] = (filepath, mapped)
+    return mapped
+
+
+def get_reference(name):
+    """Returns a reference loaded in this process
+
+    Parameters
+    ----------
+    name : str
+        The reference name
+
+    Returns
+    -------
+    mmap.mmap
+        The read-only memory map of the reference file. It can be used as a
+        bytes-like object without copying the data (e.g. with `memoryview` or
+        `numpy.frombuffer`)
+
+    Raises
+    ------
+    ValueError
+        If the reference has not been loaded
+    """
+    if name not in _REFERENCES:
+        raise ValueError("Reference '%s' is not loaded" % name)
+    return _REFERENCES[name][1]
+
+
+def unload_references():
+    """Unmaps all the references loaded in this process"""
+    for _, mapped in _REFERENCES.values():
+        _close(mapped)
+    _REFERENCES.clear()
@@ -0,0 +1,170 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import re
+import threading
+import zlib
+from time import time
+
+# Seconds a replica that failed is skipped before trying it again
+DOWN_TIME = 30
+
+# The statuses returned by a proxy when its API worker is not available
+UNAVAILABLE_STATUSES = (502, 503, 504)
+
+BALANCING_POLICIES = ('least_outstanding', 'round_robin')
+
+_JOB_RE = re.compile(r'/qiita_db/jobs/([^/?]+)')
+
+
+def parse_server_urls(server_url):
+    """Returns the list of urls of the Qiita server replicas
+
+    Parameters
+    ----------
+    server_url : str or list of str
+        The url of the server, a comma-separated list of urls or a list of
+        urls
+
+    Returns
+    -------
+    list of str
+        The urls, without the trailing slashes
+
+    Raises
+    ------
+    ValueError
+        If no url is provided
+    """
+    if isinstance(server_url, str):
+        server_url = server_url.split(',')
+    urls = [u.strip().rstrip('/') for u in server_url if u.strip()]
+    if not urls:
+        raise ValueError("No Qiita server url provided")
+    return urls
+
+
+class ServerPool(object):
+    """Chooses the Qiita server replica that receives each request
+
+    Parameters
+    ----------
+    urls : list of str
+        The urls of the replicas, in order of preference
+    policy : {'least_outstanding', 'round_robin'}, optional
+        How the idempotent (GET) requests are spread over the replicas: to
+        the replica with the fewest requests in flight from this client, or
+        to each replica in turn. Default: 'least_outstanding'
+    sticky_jobs : bool, optional
+        Whether all the requests to the endpoints of a job are sent to the
+        same replica. The replica is chosen from the job id, so the different
+        processes of a job agree on it. Default: False
+    down_time : float, optional
+        Seconds a replica that failed is skipped. Default: DOWN_TIME
+
+    Notes
+    -----
+    The health of the replicas is tracked passively: a replica that can't
+    be reached, or whose proxy reports that it is unavailable, is skipped
+    for `down_time` seconds and then tried again. If all the replicas are
+    down, they are all tried.
+
+    The requests that are not idempotent are sent to the first healthy
+    replica in order of preference, so the writes of a client don't race
+    each other across replicas.
+    """
+    def __init__(self, urls, policy='least_outstanding', sticky_jobs=False,
+                 down_time=DOWN_TIME):
+        if policy not in BALANCING_POLICIES:
+            raise ValueError("Unknown balancing policy '%s'" % policy)
+        self.urls = list(urls)
+        self.policy = policy
+        self.sticky_jobs = sticky_jobs
+        self.down_time = down_time
+        self._lock = threading.Lock()
+        self._outstanding = {url: 0 for url in self.urls}
+        self._down_until = {url: 0 for url in self.urls}
+        self._next = 0
+
+    def _after_fork(self):
+        """Re-creates the lock in a forked process, where it may have been
+        held by a thread of the parent"""
+        self._lock = threading.Lock()
+        self._outstanding = {url: 0 for url in self.urls}
+
+    def healthy(self):
+        """Returns the urls of the replicas that are not marked as down"""
+        now = time()
+        return [url for url in self.urls if self._down_until[url] <= now]
+
+    def choose(self, path, idempotent, exclude=()):
+        """Chooses the replica of a request
+
+        Parameters
+        ----------
+        path : str
+            The path of the request
+        idempotent : bool
+            Whether the request can be sent to any replica
+        exclude : container of str, optional
+            The urls of the replicas already tried for this request
+
+        Returns
+        -------
+        str or None
+            The url of the replica, or None if all of them are excluded
+        """
+        with self._lock:
+            candidates = [url for url in self.healthy() if url not in exclude]
+            if not candidates:
+                candidates = [url for url in self.urls if url not in exclude]
+                if not candidates:
+                    return None
+            if len(candidates) == 1:
+                return candidates[0]
+
+            match = _JOB_RE.match(path) if self.sticky_jobs else None
+            if match:
+                # The first candidate after the preferred replica of the job,
+                # so all the processes fail over to the same one
+                n = len(self.urls)
+                start = zlib.crc32(match.group(1).encode('utf-8')) % n
+                for i in range(n):
+                    url = self.urls[(start + i) % n]
+                    if url in candidates:
+                        return url
+            if not idempotent:
+                return candidates[0]
+
+            start = self._next % len(candidates)
+            self._next += 1
+            rotated = candidates[start:] + candidates[:start]
+            if self.policy == 'round_robin':
+                return rotated[0]
+            return min(rotated, key=lambda url: self._outstanding[url])
+
+    def acquire(self, url):
+        """Registers a request in flight to a replica"""
+        with self._lock:
+            self._outstanding[url] += 1
+
+    def release(self, url):
+        """Registers the end of a request to a replica"""
+        with self._lock:
+            self._outstanding[url] -= 1
+
+    def mark_down(self, url):
+        """Skips a replica for `down_time` seconds"""
+        with self._lock:
+            self._down_until[url] = time() + self.down_time
+
+    def mark_up(self, url):
+        """Marks a replica as healthy"""
+        if self._down_until[url]:
+            with self._lock:
+                self._down_until[url] = 0
@@ -0,0 +1,379 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+"""Node-local proxy shared by all the plugin processes of a node
+
+The sidecar listens on a Unix domain socket and forwards the requests of
+the local QiitaClients (created with a
+`qiita_client.transport.UnixSocketTransport`, or with the environment
+variable QIITA_CLIENT_SIDECAR set to the socket path) to the Qiita server,
+using a single authenticated client with a pool of connections. It also
+sends the heartbeats of all the local jobs and caches the GET responses.
+
+It can be started with::
+
+    python -m qiita_client.sidecar --socket /tmp/qiita.sock \\
+        --server-url https://qiita.server --client-id ID --client-secret SECRET
+"""
+
+import re
+import os
+import sys
+import argparse
+import threading
+from json import dumps, loads
+from time import time
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+try:
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from http.server import BaseHTTPRequestHandler
+except ImportError:
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from BaseHTTPServer import BaseHTTPRequestHandler
+
+from .qiita_client import QiitaClient, MAX_HEARTBEAT_INTERVAL
+from .transport import SessionTransport, _read_request_body
+
+# Seconds between the heartbeats sent for the local jobs
+HEARTBEAT_INTERVAL = 30
+
+# Maximum number of heartbeats sent concurrently
+HEARTBEAT_JOBS = 8
+
+# Seconds without local heartbeats after which the process of a job is
+# assumed dead, and the sidecar stops sending its heartbeats
+LOCAL_HEARTBEAT_TIMEOUT = 3 * MAX_HEARTBEAT_INTERVAL
+
+# Seconds a GET response is served from the cache
+CACHE_TTL = 60
+
+_HEARTBEAT_RE = re.compile(r'/qiita_db/jobs/([^/]+)/heartbeat/$')
+_COMPLETE_RE = re.compile(r'/qiita_db/jobs/([^/]+)/complete/$')
+
+# The job endpoints are not cached, since they report the job status
+_UNCACHED_PREFIXES = ('/qiita_db/jobs/',)
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _SidecarRequestHandler(BaseHTTPRequestHandler):
+    """Dispatches the local requests to the QiitaSidecar"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def address_string(self):
+        return 'local'
+
+    def _dispatch(self):
+        body = _read_request_body(self.rfile, self.headers)
+        headers = {k: self.headers[k]
+                   for k in ('Content-Type', 'Content-Encoding')
+                   if self.headers.get(k)}
+        status, content = self.server.sidecar.handle(self.command, self.path,
+                                                     body, headers)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = _dispatch
+
+
+class QiitaSidecar(object):
+    """Proxy of the Qiita server for the plugin processes of a node
+
+    Parameters
+    ----------
+    socket_path : str
+        The path of the Unix domain socket to listen on. Only the owner of
+        the sidecar process can connect to it
+    server_url : str or list of str
+        The url of the Qiita server, or the urls of its replicas
+    client_id : str
+        The client id used to connect to the Qiita server
+    client_secret : str
+        The client secret used to connect to the Qiita server
+    server_cert : str, optional
+        The server certificate, in case that it is not verified
+    heartbeat_interval : float, optional
+        Seconds between the heartbeats of the local jobs. Default:
+        HEARTBEAT_INTERVAL
+    cache_ttl : float, optional
+        Seconds a GET response is served from the cache. 0 disables the
+        cache. Default: CACHE_TTL
+    local_heartbeat_timeout : float, optional
+        Seconds without heartbeats from the local process of a job after
+        which the sidecar stops sending its heartbeats. Default:
+        LOCAL_HEARTBEAT_TIMEOUT
+
+    Notes
+    -----
+    The local clients are authenticated by the socket permissions, so their
+    authentication requests are answered without contacting the server.
+
+    The first heartbeat of a job is forwarded to the server (it sets the job
+    as running), and from then on the sidecar sends the heartbeats of all the
+    registered jobs from a single thread until they complete. The local
+    heartbeats are answered with the result of the last heartbeat sent to
+    the server, so the jobs cancelled in Qiita are still detected. A job is
+    unregistered when the server rejects its heartbeats, or when its local
+    process stops sending them for `local_heartbeat_timeout` seconds (e.g.
+    it crashed), so Qiita notices the jobs that are no longer running.
+
+    The responses to GET requests, except the job endpoints, are cached for
+    `cache_ttl` seconds, and any other request to the same url invalidates
+    its cached response.
+    """
+    def __init__(self, socket_path, server_url, client_id, client_secret,
+                 server_cert=None, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 cache_ttl=CACHE_TTL,
+                 local_heartbeat_timeout=LOCAL_HEARTBEAT_TIMEOUT):
+        self.socket_path = socket_path
+        self.heartbeat_interval = heartbeat_interval
+        self.cache_ttl = cache_ttl
+        self.local_heartbeat_timeout = local_heartbeat_timeout
+        self.qclient = QiitaClient(server_url, client_id, client_secret,
+                                   server_cert=server_cert,
+                                   transport=SessionTransport())
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._cache = {}
+        # The last heartbeat response of each local job, as (status, body)
+        self._heartbeats = {}
+        # The time of the last local heartbeat of each job
+        self._last_seen = {}
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        umask = os.umask(0o177)
+        try:
+            self._server = _UnixHTTPServer(socket_path,
+                                           _SidecarRequestHandler)
+        finally:
+            os.umask(umask)
+        self._server.sidecar = self
+        self._threads = []
+
+    def start(self):
+        """Starts serving requests and sending heartbeats in background
+        threads
+
+        Returns
+        -------
+        QiitaSidecar
+            The sidecar itself
+        """
+        for target in (self._server.serve_forever, self._heartbeat_loop):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stops the sidecar"""
+        self._stop.set()
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _forward(self, method, path, body, headers):
+        """Forwards a request to the server
+
+        Returns
+        -------
+        int, bytes
+            The status and the body of the response
+        """
+        qclient = self.qclient
+        r = qclient._request_oauth2(
+            partial(qclient._send, qclient._requester(method.lower())),
+            path, verify=qclient._verify, data=body, headers=dict(headers))
+        return r.status_code, r.content
+
+    def _register(self, job_id, result, new=False):
+        """Stores the result of a heartbeat sent to the server
+
+        The job is unregistered if the server rejected the heartbeat, so the
+        next local heartbeat is forwarded and gets the rejection
+
+        Parameters
+        ----------
+        job_id : str
+            The job id
+        result : (int, bytes)
+            The status and the body of the heartbeat response
+        new : bool, optional
+            Whether it is the first heartbeat of the job. Otherwise, the
+            result is ignored if the job is no longer registered (e.g. it
+            completed while the heartbeat was sent)
+        """
+        status, body = result
+        accepted = status == 200
+        if accepted:
+            try:
+                response = loads(body.decode('utf-8'))
+            except ValueError:
+                response = None
+            # Qiita rejects the heartbeats of the jobs that are not running
+            # with a 200 response
+            if isinstance(response, dict) and \
+                    response.get('success') is False:
+                accepted = False
+        with self._lock:
+            if not new and job_id not in self._heartbeats:
+                return
+            if accepted:
+                self._heartbeats[job_id] = result
+                if new:
+                    self._last_seen[job_id] = time()
+            else:
+                self._heartbeats.pop(job_id, None)
+                self._last_seen.pop(job_id, None)
+
+    def _heartbeat(self, job_id):
+        """Sends the heartbeat of a job, storing its result"""
+        path = '/qiita_db/jobs/%s/heartbeat/' % job_id
+        try:
+            result = self._forward('POST', path, b'', {})
+        except Exception as e:
+            # The server is not reachable. The local heartbeats keep being
+            # answered with the last result, so the jobs are not stopped
+            sys.stderr.write("Error sending the heartbeat of %s: %s\n"
+                             % (job_id, e))
+            return
+        self._register(job_id, result)
+
+    def _heartbeat_loop(self):
+        """Sends the heartbeats of the local jobs periodically"""
+        while not self._stop.wait(self.heartbeat_interval):
+            limit = time() - self.local_heartbeat_timeout
+            with self._lock:
+                # The processes of these jobs stopped sending heartbeats
+                for job_id in [j for j, t in self._last_seen.items()
+                               if t < limit]:
+                    del self._last_seen[job_id]
+                    self._heartbeats.pop(job_id, None)
+                job_ids = list(self._heartbeats)
+            if not job_ids:
+                continue
+            pool = ThreadPool(min(HEARTBEAT_JOBS, len(job_ids)))
+            try:
+                pool.map(self._heartbeat, job_ids, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+    def handle(self, method, path, body, headers):
+        """Answers a local request
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method
+        path : str
+            The request path
+        body : bytes
+            The request body
+        headers : dict
+            The request headers to forward
+
+        Returns
+        -------
+        int, bytes
+            The status and the body of the response
+        """
+        if method == 'POST' and path == '/qiita_db/authenticate/':
+            return 200, dumps({'access_token': 'sidecar',
+                               'token_type': 'Bearer'}).encode('utf-8')
+
+        match = _HEARTBEAT_RE.match(path)
+        if method == 'POST' and match:
+            job_id = match.group(1)
+            with self._lock:
+                last = self._heartbeats.get(job_id)
+                if last is not None:
+                    self._last_seen[job_id] = time()
+            if last is not None:
+                return last
+            result = self._forward(method, path, body, headers)
+            self._register(job_id, result, new=True)
+            return result
+
+        if method == 'GET' and self.cache_ttl and \
+                not path.startswith(_UNCACHED_PREFIXES):
+            with self._lock:
+                cached = self._cache.get(path)
+            if cached is not None and cached[0] > time():
+                return cached[1]
+            result = self._forward(method, path, body, headers)
+            if result[0] == 200:
+                with self._lock:
+                    self._cache[path] = (time() + self.cache_ttl, result)
+            return result
+
+        with self._lock:
+            self._cache.pop(path, None)
+        match = _COMPLETE_RE.match(path)
+        if method == 'POST' and match:
+            # Stop sending the heartbeats of the job
+            with self._lock:
+                self._heartbeats.pop(match.group(1), None)
+                self._last_seen.pop(match.group(1), None)
+        return self._forward(method, path, body, headers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Node-local proxy of the Qiita server')
+    parser.add_argument('--socket', required=True,
+                        help='Path of the Unix domain socket')
+    parser.add_argument('--server-url', required=True)
+    parser.add_argument('--client-id', required=True)
+    parser.add_argument('--client-secret', required=True)
+    parser.add_argument('--server-cert', default=None)
+    parser.add_argument('--heartbeat-interval', type=float,
+                        default=HEARTBEAT_INTERVAL)
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL)
+    parser.add_argument('--local-heartbeat-timeout', type=float,
+                        default=LOCAL_HEARTBEAT_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    sidecar = QiitaSidecar(args.socket, args.server_url, args.client_id,
+                           args.client_secret, server_cert=args.server_cert,
+                           heartbeat_interval=args.heartbeat_interval,
+                           cache_ttl=args.cache_ttl,
+                           local_heartbeat_timeout=args.local_heartbeat_timeout
+                           ).start()
+    try:
+        sidecar._stop.wait()
+    except KeyboardInterrupt:
+        pass
+    sidecar.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from os import makedirs, rename, stat, walk
+from os.path import (join, relpath, abspath, isdir, exists, dirname, getsize,
+                     normpath)
+from shutil import rmtree
+
+from .qiita_client import ArtifactInfo
+from .util import copy_file
+
+# Maximum number of files transferred concurrently from the scratch directory
+TRANSFER_JOBS = 8
+
+
+def _transfer(task):
+    """Moves a file, copying it if the destination is in another filesystem
+
+    Parameters
+    ----------
+    task : (str, str, bool)
+        The source file, the destination file and whether both are in the
+        same filesystem
+    """
+    src, dst, same_fs = task
+    if same_fs:
+        rename(src, dst)
+    else:
+        copy_file(src, dst)
+
+
+def stage_outputs(scratch_dir, output_dir, artifacts_info, n_jobs=None):
+    """Transfers the outputs of a job from a scratch directory
+
+    Parameters
+    ----------
+    scratch_dir : str
+        The directory where the job was executed
+    output_dir : str
+        The job output directory
+    artifacts_info : list of ArtifactInfo
+        The artifacts generated by the job
+    n_jobs : int, optional
+        The number of files transferred concurrently. Default: TRANSFER_JOBS
+
+    Returns
+    -------
+    list of ArtifactInfo
+        The artifacts information, with the filepaths in `output_dir`
+
+    Notes
+    -----
+    Only the files (and directories) of the artifacts are transferred, any
+    other file left in `scratch_dir` is discarded. Files outside
+    `scratch_dir` are not modified. The files are renamed if both
+    directories are in the same filesystem and copied otherwise, largest
+    first.
+    """
+    scratch_dir = abspath(scratch_dir)
+    same_fs = stat(scratch_dir).st_dev == stat(output_dir).st_dev
+
+    tasks = []
+    staged_fps = set()
+    staged = []
+    for a_info in artifacts_info:
+        files = []
+        for fp, fp_type in a_info.files:
+            rel_fp = relpath(abspath(fp), scratch_dir)
+            if rel_fp.startswith('..'):
+                files.append((fp, fp_type))
+                continue
+            dst = join(output_dir, rel_fp)
+            if fp not in staged_fps:
+                staged_fps.add(fp)
+                if isdir(dst):
+                    rmtree(dst)
+                if isdir(fp) and not same_fs:
+                    # Copy the files of the directory individually, so they
+                    # are transferred in parallel
+                    for dp, _, fns in walk(fp):
+                        dst_dp = normpath(join(dst, relpath(dp, fp)))
+                        makedirs(dst_dp)
+                        tasks.extend((join(dp, fn), join(dst_dp, fn), False)
+                                     for fn in fns)
+                else:
+                    if not exists(dirname(dst)):
+                        makedirs(dirname(dst))
+                    tasks.append((fp, dst, same_fs))
+            files.append((dst, fp_type))
+        staged.append(ArtifactInfo(a_info.output_name, a_info.artifact_type,
+                                   files))
+
+    if not tasks:
+        return staged
+
+    n_jobs = min(n_jobs or TRANSFER_JOBS, len(tasks))
+    if same_fs or n_jobs == 1:
+        for t in tasks:
+            _transfer(t)
+    else:
+        from multiprocessing.pool import ThreadPool
+
+        tasks.sort(key=lambda t: getsize(t[0]), reverse=True)
+        pool = ThreadPool(n_jobs)
+        try:
+            pool.map(_transfer, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    return staged
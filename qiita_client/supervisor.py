@@ -0,0 +1,247 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import traceback
+import signal
+import sys
+import os
+from os import listdir
+from os.path import join
+from time import time
+
+# Seconds between the checks of the supervised process
+POLL_INTERVAL = 1
+
+# Seconds given to a supervised process to exit after SIGTERM, before killing
+# it
+STOP_GRACE_PERIOD = 10
+
+
+def _task_error(name):
+    """Formats the error message of the exception being handled
+
+    Parameters
+    ----------
+    name : str
+        The name of the task that raised the exception
+
+    Returns
+    -------
+    str
+        The error message
+    """
+    exc_str = repr(traceback.format_exception(*sys.exc_info()))
+    return "Error executing %s:\n%s" % (name, exc_str)
+
+
+def _tree_rss(pid):
+    """Returns the resident memory of a process and all its descendants
+
+    Parameters
+    ----------
+    pid : int
+        The process id
+
+    Returns
+    -------
+    int or None
+        The resident memory in bytes, or None if it can't be computed (the
+        information is read from /proc, so it is only available on Linux)
+    """
+    try:
+        children = {}
+        for entry in listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(join('/proc', entry, 'stat')) as f:
+                    stat = f.read()
+            except (IOError, OSError):
+                # The process finished while we were listing them
+                continue
+            # The command name is enclosed in parenthesis and can contain
+            # spaces, the parent pid is the second field after it
+            ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+    except (IOError, OSError):
+        return None
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    rss = 0
+    pending = [pid]
+    while pending:
+        p = pending.pop()
+        pending.extend(children.get(p, []))
+        try:
+            with open(join('/proc', str(p), 'statm')) as f:
+                rss += int(f.read().split()[1]) * page_size
+        except (IOError, OSError):
+            continue
+    return rss
+
+
+def _on_sigterm(signum, frame):
+    """Stops the child processes of the supervised task and exits"""
+    from .qiita_client import JOB_CANCEL_TOKEN
+
+    if JOB_CANCEL_TOKEN is not None:
+        JOB_CANCEL_TOKEN.cancel("the job was stopped by the plugin runner")
+        # The timers that kill the processes that ignore SIGTERM don't
+        # survive the exit, and the processes run in their own sessions, so
+        # they must be killed before exiting. Half of the grace period is
+        # left for this process to exit before the parent kills it
+        JOB_CANCEL_TOKEN.kill(STOP_GRACE_PERIOD / 2.0)
+    os._exit(128 + signum)
+
+
+def _supervised_child(conn, name, func, args, memory_limit):
+    """Executes the task in the supervised process
+
+    Parameters
+    ----------
+    conn : multiprocessing.Connection
+        The connection where the result of the task is sent
+    name : str
+        The name of the task
+    func : callable
+        The task
+    args : tuple
+        The task arguments
+    memory_limit : int or None
+        The memory limit in bytes
+    """
+    from .qiita_client import _after_fork
+
+    _after_fork()
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    if memory_limit:
+        import resource
+        # RLIMIT_DATA limits the heap of the process (and each of its
+        # children), so runaway allocations fail with a MemoryError instead
+        # of putting the whole node under memory pressure. Unlike RLIMIT_AS,
+        # it does not count file mappings or reserved address space
+        resource.setrlimit(resource.RLIMIT_DATA,
+                           (memory_limit, memory_limit))
+    try:
+        result = func(*args)
+    except MemoryError:
+        result = (False, None, "Job exceeded its memory limit of %d bytes"
+                  % memory_limit)
+    except Exception:
+        result = (False, None, _task_error(name))
+    try:
+        conn.send(result)
+    except Exception:
+        conn.send((False, None, _task_error(name)))
+    conn.close()
+
+
+def _stop(proc):
+    """Stops a process, killing it if it doesn't exit after SIGTERM"""
+    try:
+        os.kill(proc.pid, signal.SIGTERM)
+    except OSError:
+        pass
+    proc.join(STOP_GRACE_PERIOD)
+    if proc.is_alive():
+        try:
+            os.kill(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        proc.join()
+
+
+def run_supervised(name, func, args, time_limit=None, memory_limit=None,
+                   cancel_token=None):
+    """Executes a task in a child process enforcing time and memory limits
+
+    Parameters
+    ----------
+    name : str
+        The name of the task, used in the error messages
+    func : callable
+        The task. It should return a (success, artifacts_info, error_msg)
+        tuple
+    args : tuple
+        The task arguments
+    time_limit : float, optional
+        The maximum wall-clock time in seconds. Default: no limit
+    memory_limit : int, optional
+        The maximum resident memory in bytes of the task process and all its
+        child processes. Default: no limit
+    cancel_token : qiita_client.qiita_client.CancellationToken, optional
+        If it is cancelled, the task is stopped
+
+    Returns
+    -------
+    bool, list of ArtifactInfo, str
+        Whether the task succeeded, the output artifacts and the error
+        message. If a limit is exceeded, the task fails with an error message
+        describing the limit
+
+    Notes
+    -----
+    The task is executed in a forked process, so it has access to the same
+    state as the caller (e.g. the QiitaClient). The locks of the clients
+    and their connections are re-created in the forked process, since the
+    threads of the caller that may hold them (e.g. the one sending the
+    heartbeats) are not forked. The process is checked every
+    POLL_INTERVAL seconds, and it is stopped with SIGTERM (which also
+    terminates the commands started with `qiita_client.util.system_call`)
+    and, after STOP_GRACE_PERIOD seconds, SIGKILL.
+    """
+    import multiprocessing
+
+    # Python 2 has no contexts, and it always forks on POSIX
+    if hasattr(multiprocessing, 'get_context'):
+        ctx = multiprocessing.get_context('fork')
+    else:
+        ctx = multiprocessing
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_supervised_child,
+                       args=(child_conn, name, func, args, memory_limit))
+    proc.start()
+    child_conn.close()
+
+    deadline = time() + time_limit if time_limit else None
+    result = None
+    error = None
+    while True:
+        if parent_conn.poll(POLL_INTERVAL):
+            try:
+                result = parent_conn.recv()
+            except EOFError:
+                pass
+            break
+        if deadline is not None and time() > deadline:
+            error = ("Job exceeded its time limit of %s seconds"
+                     % time_limit)
+        elif memory_limit:
+            rss = _tree_rss(proc.pid)
+            if rss is not None and rss > memory_limit:
+                error = ("Job exceeded its memory limit of %d bytes (using "
+                         "%d bytes)" % (memory_limit, rss))
+        if error is None and cancel_token is not None and \
+                cancel_token.cancelled:
+            error = "Job cancelled: %s" % cancel_token.reason
+        if error is not None:
+            _stop(proc)
+            return False, None, error
+
+    proc.join()
+    parent_conn.close()
+    if result is not None:
+        return result
+
+    if proc.exitcode is not None and proc.exitcode < 0:
+        error = "Job process killed by signal %d" % -proc.exitcode
+        if -proc.exitcode == signal.SIGKILL:
+            error += " (possibly by the system, after running out of memory)"
+    else:
+        error = "Job process exited unexpectedly (status %s)" % proc.exitcode
+    return False, None, error
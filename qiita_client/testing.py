@@ -14,23 +14,52 @@ from qiita_client import QiitaClient
 
 
 class PluginTestCase(TestCase):
+    """Base class of the plugin tests
+
+    The tests run against the Qiita server at https://localhost:21174. If
+    `fake_server` is True (or the environment variable
+    QIITA_TEST_FAKE_SERVER is set), they run against an in-process
+    `qiita_client.fake_qiita.FakeQiitaServer` instead, available as
+    `cls.server`, which doesn't need the waits required by a real server.
+    In both cases the url of the server is `cls.server_url`.
+    """
+    # Whether to run the tests against a FakeQiitaServer
+    fake_server = False
+
     @classmethod
     def setUpClass(cls):
         cls.client_id = '19ndkO3oMKsoChjVVWluF7QkxHRfYhTKSFbAVt8IhK7gZgDaO4'
         cls.client_secret = ('J7FfQ7CQdOxuKhQAf1eoGgBAE81Ns8Gu3EKaWFm3IO2JKh'
                              'AmmCWZuabe0O5Mp28s1')
-        cls.server_cert = environ.get('QIITA_SERVER_CERT', None)
-        cls.qclient = QiitaClient("https://localhost:21174", cls.client_id,
+        if cls.fake_server or environ.get('QIITA_TEST_FAKE_SERVER'):
+            # Only imported when used, so the plugins that test against a
+            # real server don't depend on the HTTP server modules
+            from qiita_client.fake_qiita import FakeQiitaServer
+
+            cls.server = FakeQiitaServer().start()
+            cls.server_url = cls.server.url
+            cls.server_cert = None
+            # The fake server updates the jobs synchronously
+            cls.poll_interval = 0
+        else:
+            cls.server = None
+            cls.server_url = "https://localhost:21174"
+            cls.server_cert = environ.get('QIITA_SERVER_CERT', None)
+            cls.poll_interval = 0.5
+        cls.qclient = QiitaClient(cls.server_url, cls.client_id,
                                   cls.client_secret,
                                   server_cert=cls.server_cert)
         cls.qclient.post('/apitest/reload_plugins/')
-        # Give enough time for the plugins to register
-        sleep(5)
+        if cls.server is None:
+            # Give enough time for the plugins to register
+            sleep(5)
 
     @classmethod
     def tearDownClass(cls):
         # Reset the test database
         cls.qclient.post("/apitest/reset/")
+        if cls.server is not None:
+            cls.server.stop()
 
     def _wait_for_running_job(self, job_id):
         """Waits until the given job is not in a running status
@@ -51,7 +80,7 @@ class PluginTestCase(TestCase):
         it returns whatever the last seen status for the given job
         """
         for i in range(20):
-            sleep(0.5)
+            sleep(self.poll_interval)
             status = self.qclient.get_job_info(job_id)['status']
             if status != 'running':
                 break
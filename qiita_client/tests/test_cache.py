@@ -0,0 +1,286 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from os import mkdir, listdir, utime, remove
+from os.path import join, exists
+from shutil import rmtree
+from tempfile import mkdtemp
+from json import dumps, loads
+
+from qiita_client import (QiitaPlugin, QiitaCommand, ArtifactInfo,
+                          QiitaTypePlugin, QiitaArtifactType)
+from qiita_client.cache import ResultCache
+
+
+class FakeQiitaClient(object):
+    def __init__(self, artifacts):
+        self.artifacts = artifacts
+        self.patches = []
+
+    def get(self, url, **kwargs):
+        return self.artifacts[url]
+
+    def patch(self, url, op, path, value=None, from_p=None, **kwargs):
+        self.patches.append((url, op, path, value))
+
+
+class ResultCacheTests(TestCase):
+    def setUp(self):
+        self.base_dir = mkdtemp()
+        self.cache_dir = join(self.base_dir, 'cache')
+        self.input_dir = join(self.base_dir, 'input')
+        mkdir(self.input_dir)
+        self.input_fp = join(self.input_dir, 'seqs.fastq')
+        with open(self.input_fp, 'w') as f:
+            f.write('@seq1\nACGT\n+\nIIII\n')
+        artifact = {'type': 'FASTQ',
+                    'files': {'raw_forward_seqs': [self.input_fp]}}
+        self.qclient = FakeQiitaClient(
+            {'/qiita_db/artifacts/1/': artifact,
+             '/qiita_db/artifacts/2/': artifact})
+
+        self.calls = []
+
+        def func(qclient, job_id, parameters, output_dir):
+            self.calls.append(job_id)
+            fp = join(output_dir, 'out.biom')
+            with open(fp, 'w') as f:
+                f.write('biom contents %s' % parameters['p2'])
+            return True, [ArtifactInfo('out1', 'BIOM', [(fp, 'biom')])], ""
+
+        self.plugin = QiitaPlugin("NewPlugin", "0.0.1", "description",
+                                  result_cache=ResultCache(self.cache_dir,
+                                                           10 ** 6))
+        self.cmd = QiitaCommand("NewCmd", "Desc", func,
+                                {'p1': ('artifact', ['FASTQ'])},
+                                {'p2': ('string', 'dflt')},
+                                {'out1': 'BIOM'})
+        self.plugin.register_command(self.cmd)
+
+    def tearDown(self):
+        rmtree(self.base_dir)
+
+    def _out_dir(self, name):
+        out_dir = join(self.base_dir, name)
+        mkdir(out_dir)
+        return out_dir
+
+    def test_key(self):
+        cache = self.plugin.result_cache
+        obs = cache.key(self.qclient, self.plugin, self.cmd,
+                        {'p1': 1, 'p2': 'a'})
+        # Same input data in a different artifact
+        self.assertEqual(obs, cache.key(self.qclient, self.plugin, self.cmd,
+                                        {'p2': 'a', 'p1': 2}))
+        # Different parameters
+        self.assertNotEqual(obs, cache.key(self.qclient, self.plugin,
+                                           self.cmd, {'p1': 1, 'p2': 'b'}))
+        # Different input contents
+        with open(self.input_fp, 'w') as f:
+            f.write('@seq1\nTTTT\n+\nIIII\n')
+        self.assertNotEqual(obs, cache.key(self.qclient, self.plugin,
+                                           self.cmd, {'p1': 1, 'p2': 'a'}))
+
+    def test_run_task_cached(self):
+        out1 = self._out_dir('job1')
+        obs = self.plugin._run_task(self.qclient, 'job1', self.cmd,
+                                    {'p1': 1, 'p2': 'a'}, out1)
+        exp_fp = join(out1, 'out.biom')
+        self.assertEqual(
+            obs, (True, [ArtifactInfo('out1', 'BIOM', [(exp_fp, 'biom')])],
+                  ""))
+        self.assertEqual(self.calls, ['job1'])
+
+        # Same command and data - the result is reused
+        out2 = self._out_dir('job2')
+        obs = self.plugin._run_task(self.qclient, 'job2', self.cmd,
+                                    {'p1': 2, 'p2': 'a'}, out2)
+        exp_fp = join(out2, 'out.biom')
+        self.assertEqual(
+            obs, (True, [ArtifactInfo('out1', 'BIOM', [(exp_fp, 'biom')])],
+                  ""))
+        self.assertEqual(self.calls, ['job1'])
+        with open(exp_fp) as f:
+            self.assertEqual(f.read(), 'biom contents a')
+
+        # Different parameters - the task is executed
+        out3 = self._out_dir('job3')
+        self.plugin._run_task(self.qclient, 'job3', self.cmd,
+                              {'p1': 1, 'p2': 'b'}, out3)
+        self.assertEqual(self.calls, ['job1', 'job3'])
+
+        # Commands can opt out
+        self.cmd.cacheable = False
+        out4 = self._out_dir('job4')
+        self.plugin._run_task(self.qclient, 'job4', self.cmd,
+                              {'p1': 1, 'p2': 'a'}, out4)
+        self.assertEqual(self.calls, ['job1', 'job3', 'job4'])
+
+    def test_get_materialize(self):
+        cache = self.plugin.result_cache
+        out1 = self._out_dir('job1')
+        fps = [join(out1, 'out.biom'), join(out1, 'out.txt')]
+        for fp in fps:
+            with open(fp, 'w') as f:
+                f.write('cached')
+        ainfo = [ArtifactInfo('out1', 'BIOM',
+                              [(fps[0], 'biom'), (fps[1], 'log')])]
+        self.assertTrue(cache.put('key', out1, ainfo))
+
+        # The stale outputs of a previous execution are replaced
+        out2 = self._out_dir('job2')
+        with open(join(out2, 'out.biom'), 'w') as f:
+            f.write('stale')
+        obs = cache.get('key', out2)
+        self.assertEqual(obs, [ArtifactInfo(
+            'out1', 'BIOM', [(join(out2, 'out.biom'), 'biom'),
+                             (join(out2, 'out.txt'), 'log')])])
+        with open(join(out2, 'out.biom')) as f:
+            self.assertEqual(f.read(), 'cached')
+        self.assertEqual(sorted(listdir(out2)), ['out.biom', 'out.txt'])
+
+        # A failure doesn't leave a partial result
+        remove(join(self.cache_dir, 'key', 'files', 'out.txt'))
+        out3 = self._out_dir('job3')
+        with self.assertRaises(OSError):
+            cache.get('key', out3)
+        self.assertEqual(listdir(out3), [])
+
+    def test_put_outside_output_dir(self):
+        cache = self.plugin.result_cache
+        out_dir = self._out_dir('job1')
+        ainfo = [ArtifactInfo('out1', 'FASTQ', [(self.input_fp, 'fastq')])]
+        self.assertFalse(cache.put('key', out_dir, ainfo))
+        self.assertIsNone(cache.get('key', out_dir))
+        self.assertEqual(cache.get('key', out_dir, return_extra=True),
+                         (None, None))
+
+    def test_put_extra(self):
+        cache = self.plugin.result_cache
+        out1 = self._out_dir('job1')
+        fp = join(out1, 'out.biom')
+        with open(fp, 'w') as f:
+            f.write('cached')
+        self.assertTrue(cache.put(
+            'key', out1, [ArtifactInfo('out1', 'BIOM', [(fp, 'biom')])],
+            extra={'op': 'add'}))
+        out2 = self._out_dir('job2')
+        obs, extra = cache.get('key', out2, return_extra=True)
+        self.assertEqual(obs, [ArtifactInfo(
+            'out1', 'BIOM', [(join(out2, 'out.biom'), 'biom')])])
+        self.assertEqual(extra, {'op': 'add'})
+
+    def test_evict(self):
+        cache = ResultCache(self.cache_dir, 25)
+        for i in range(3):
+            out_dir = self._out_dir('job%d' % i)
+            fp = join(out_dir, 'out.txt')
+            with open(fp, 'w') as f:
+                f.write('x' * 10)
+            cache.put('key%d' % i, out_dir, [ArtifactInfo('out1', 'BIOM',
+                                                          [(fp, 'biom')])])
+            # Make sure the entries have different access times
+            utime(join(self.cache_dir, 'key%d' % i, 'artifacts.json'),
+                  (i, i))
+            cache.evict()
+
+        self.assertEqual(sorted(listdir(self.cache_dir)), ['key1', 'key2'])
+        self.assertTrue(exists(join(self.base_dir, 'job0', 'out.txt')))
+
+
+class HTMLSummaryCacheTests(TestCase):
+    def setUp(self):
+        self.base_dir = mkdtemp()
+        input_fp = join(self.base_dir, '1_table.biom')
+        with open(input_fp, 'w') as f:
+            f.write('biom contents')
+        self.qclient = FakeQiitaClient(
+            {'/qiita_db/artifacts/1/': {'type': 'BIOM',
+                                        'files': {'biom': [input_fp]}},
+             '/qiita_db/artifacts/2/': {'type': 'BIOM',
+                                        'files': {'biom': [input_fp]}}})
+        self.calls = []
+
+    def tearDown(self):
+        rmtree(self.base_dir)
+
+    def _plugin(self, html_generator_func):
+        def validate_func(a, b, c, d):
+            return 42
+
+        return QiitaTypePlugin(
+            "NewPlugin", "1.0.0", "Description", validate_func,
+            html_generator_func,
+            [QiitaArtifactType('BIOM', 'Description', False, True,
+                               [('biom', True)])],
+            html_cache=ResultCache(join(self.base_dir, 'cache'), 10 ** 6))
+
+    def _run(self, plugin, artifact_id):
+        out_dir = join(self.base_dir, 'job%s' % artifact_id)
+        mkdir(out_dir)
+        cmd = plugin.task_dict['Generate HTML summary']
+        obs = cmd(self.qclient, 'job%s' % artifact_id,
+                  {'input_data': artifact_id}, out_dir)
+        self.assertEqual(obs, (True, None, ""))
+        return out_dir
+
+    def test_html_summary_cached(self):
+        def html_generator_func(qclient, job_id, parameters, out_dir):
+            self.calls.append(job_id)
+            html_fp = join(out_dir, 'summary.html')
+            with open(html_fp, 'w') as f:
+                f.write('<b>summary</b>')
+            html_dir = join(out_dir, 'assets')
+            mkdir(html_dir)
+            with open(join(html_dir, 'plot.png'), 'w') as f:
+                f.write('png')
+            qclient.patch('/qiita_db/artifacts/%s/' % parameters['input_data'],
+                          'add', '/html_summary/',
+                          value=dumps({'html': html_fp, 'dir': html_dir}))
+            return True, None, ""
+
+        plugin = self._plugin(html_generator_func)
+        self._run(plugin, 1)
+        out_dir = self._run(plugin, 2)
+
+        self.assertEqual(self.calls, ['job1'])
+        self.assertEqual(len(self.qclient.patches), 2)
+        url, op, path, value = self.qclient.patches[1]
+        self.assertEqual((url, op, path),
+                         ('/qiita_db/artifacts/2/', 'add', '/html_summary/'))
+        self.assertEqual(loads(value),
+                         {'html': join(out_dir, 'summary.html'),
+                          'dir': join(out_dir, 'assets')})
+        with open(join(out_dir, 'summary.html')) as f:
+            self.assertEqual(f.read(), '<b>summary</b>')
+        self.assertTrue(exists(join(out_dir, 'assets', 'plot.png')))
+
+    def test_html_summary_cached_filepath(self):
+        def html_generator_func(qclient, job_id, parameters, out_dir):
+            self.calls.append(job_id)
+            html_fp = join(out_dir, 'summary.html')
+            with open(html_fp, 'w') as f:
+                f.write('<b>summary</b>')
+            qclient.patch('/qiita_db/artifacts/%s/' % parameters['input_data'],
+                          'replace', '/html_summary', value=html_fp)
+            return True, None, ""
+
+        plugin = self._plugin(html_generator_func)
+        self._run(plugin, 1)
+        out_dir = self._run(plugin, 2)
+
+        self.assertEqual(self.calls, ['job1'])
+        # The recorded request is sent again
+        self.assertEqual(self.qclient.patches[1],
+                         ('/qiita_db/artifacts/2/', 'replace', '/html_summary',
+                          join(out_dir, 'summary.html')))
+
+
+if __name__ == '__main__':
+    main()
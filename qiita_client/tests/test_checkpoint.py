@@ -0,0 +1,106 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from os import remove
+from os.path import join, exists
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from qiita_client import ArtifactInfo, QiitaCommand, QiitaPlugin
+from qiita_client.checkpoint import Checkpoint, CHECKPOINT_DIR
+
+
+class CheckpointTests(TestCase):
+    def setUp(self):
+        self.out_dir = mkdtemp()
+        self.fp = join(self.out_dir, 'demux.seqs')
+        with open(self.fp, 'w') as f:
+            f.write('>seq1\nACGT\n')
+        self.ainfo = [ArtifactInfo('demux', 'Demultiplexed',
+                                   [(self.fp, 'preprocessed_fasta')])]
+
+    def tearDown(self):
+        rmtree(self.out_dir)
+
+    def test_mark_done(self):
+        obs = Checkpoint('job1', self.out_dir)
+        self.assertFalse(obs.is_done('demux'))
+        with self.assertRaises(ValueError):
+            obs.artifacts('demux')
+
+        obs.mark_done('demux', artifacts_info=self.ainfo, data={'n': 1})
+        self.assertTrue(obs.is_done('demux'))
+        self.assertEqual(obs.artifacts('demux'), self.ainfo)
+        self.assertEqual(obs.data('demux'), {'n': 1})
+
+        # The checkpoint is loaded when the job is executed again
+        obs = Checkpoint('job1', self.out_dir)
+        self.assertTrue(obs.is_done('demux'))
+        self.assertEqual(obs.artifacts('demux'), self.ainfo)
+        self.assertEqual(obs.data('demux'), {'n': 1})
+
+        # But not for other jobs
+        self.assertFalse(Checkpoint('job2', self.out_dir).is_done('demux'))
+
+        # If the files are gone the stage has to be executed again
+        remove(self.fp)
+        self.assertFalse(Checkpoint('job1', self.out_dir).is_done('demux'))
+
+    def test_mark_done_error(self):
+        # The checkpoint directory can't be created
+        with open(join(self.out_dir, CHECKPOINT_DIR), 'w') as f:
+            f.write('')
+        obs = Checkpoint('job1', self.out_dir)
+        with self.assertLogs('qiita_client.checkpoint', 'WARNING'):
+            self.assertFalse(obs.mark_done('demux',
+                                           artifacts_info=self.ainfo))
+        # The job can continue
+        self.assertTrue(obs.is_done('demux'))
+        self.assertFalse(Checkpoint('job1', self.out_dir).is_done('demux'))
+
+    def test_run(self):
+        calls = []
+
+        def stage(value):
+            calls.append(value)
+            return self.ainfo
+
+        self.assertEqual(Checkpoint('job1', self.out_dir).run(
+            'demux', stage, 1), self.ainfo)
+        self.assertEqual(Checkpoint('job1', self.out_dir).run(
+            'demux', stage, 2), self.ainfo)
+        self.assertEqual(calls, [1])
+
+    def test_clear(self):
+        obs = Checkpoint('job1', self.out_dir)
+        obs.mark_done('demux')
+        obs.clear()
+        self.assertFalse(obs.is_done('demux'))
+        self.assertFalse(exists(obs.checkpoint_fp))
+        self.assertFalse(Checkpoint('job1', self.out_dir).is_done('demux'))
+
+    def test_run_task_resumed(self):
+        calls = []
+
+        def func(qclient, job_id, parameters, out_dir):
+            calls.append(job_id)
+            return True, self.ainfo, ""
+
+        plugin = QiitaPlugin("NewPlugin", "0.0.1", "description")
+        cmd = QiitaCommand("NewCmd", "Desc", func, {}, {}, {})
+        exp = (True, self.ainfo, "")
+        self.assertEqual(
+            plugin._run_task(None, 'job1', cmd, {}, self.out_dir), exp)
+        self.assertEqual(
+            plugin._run_task(None, 'job1', cmd, {}, self.out_dir), exp)
+        self.assertEqual(calls, ['job1'])
+
+
+if __name__ == '__main__':
+    main()
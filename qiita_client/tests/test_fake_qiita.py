@@ -0,0 +1,96 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from json import dumps
+
+import qiita_client.qiita_client as qc
+from qiita_client import QiitaClient, ArtifactInfo, NotFoundError
+from qiita_client.fake_qiita import FakeQiitaServer
+
+
+class FakeQiitaServerTests(TestCase):
+    def setUp(self):
+        self.server = FakeQiitaServer().start()
+        self.qclient = QiitaClient(self.server.url, 'client_id', 'secret')
+
+    def tearDown(self):
+        self.server.stop()
+        qc.JOB_COMPLETED = False
+
+    def test_job_lifecycle(self):
+        job_id = self.server.add_job('NewCmd', {'p1': 1})
+        obs = self.qclient.get_job_info(job_id)
+        self.assertEqual(obs['command'], 'NewCmd')
+        self.assertEqual(obs['parameters'], {'p1': 1})
+        self.assertEqual(obs['status'], 'queued')
+
+        heartbeat_url = '/qiita_db/jobs/%s/heartbeat/' % job_id
+        self.assertEqual(self.qclient.post(heartbeat_url, data=''),
+                         {'success': True, 'error': ''})
+        self.server.heartbeat_interval = 60
+        self.assertEqual(self.qclient.post(heartbeat_url, data=''),
+                         {'success': True, 'error': '',
+                          'heartbeat_interval': 60})
+        self.qclient.update_job_step(job_id, 'Step 1')
+        self.assertEqual(self.qclient.get_job_info(job_id)['step'], 'Step 1')
+
+        ainfo = [ArtifactInfo('out1', 'BIOM', [('/tmp/t.biom', 'biom')])]
+        self.qclient.complete_job(job_id, True, artifacts_info=ainfo,
+                                  stream=True, compress=True)
+        job = self.server.jobs[job_id]
+        self.assertEqual(job['status'], 'success')
+        self.assertEqual(job['result']['artifacts'],
+                         {'out1': {'artifact_type': 'BIOM',
+                                   'filepaths': [['/tmp/t.biom', 'biom']]}})
+
+        # Like Qiita, the requests on finished jobs are rejected with a 200
+        self.assertEqual(self.qclient.post(heartbeat_url, data=''),
+                         {'success': False,
+                          'error': 'Job already finished. Status: success'})
+        self.assertFalse(self.qclient.post(
+            '/qiita_db/jobs/%s/step/' % job_id,
+            data=dumps({'step': 'Step 2'}))['success'])
+
+        with self.assertRaises(NotFoundError):
+            self.qclient.get_job_info('unknown')
+
+    def test_failure_injection(self):
+        job_id = self.server.add_job('NewCmd', {})
+        # The client retries the failed request once
+        self.server.fail_next()
+        self.assertEqual(self.qclient.get_job_info(job_id)['status'],
+                         'queued')
+        self.server.fail_next(2)
+        with self.assertRaises(RuntimeError):
+            self.qclient.get_job_info(job_id)
+
+        # The client fetches a new token when the current one expires
+        self.server.expire_tokens()
+        self.assertEqual(self.qclient.get_job_info(job_id)['status'],
+                         'queued')
+        self.assertEqual(
+            [r for r in self.server.requests
+             if r[1] == '/qiita_db/authenticate/'],
+            [('POST', '/qiita_db/authenticate/')] * 2)
+
+    def test_registration(self):
+        url = '/qiita_db/plugins/NewPlugin/0.0.1/'
+        self.assertEqual(self.qclient.get(url)['commands'], [])
+        self.qclient.post(url + 'commands/', data={'name': 'NewCmd'})
+        obs = self.qclient.get(url)
+        self.assertEqual(obs['commands'], ['NewCmd'])
+        self.assertTrue(obs['active'])
+
+        # Resetting the server removes the registered plugins
+        self.qclient.post('/apitest/reset/', data='')
+        self.assertEqual(self.qclient.get(url)['commands'], [])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from subprocess import Popen, PIPE
+import sys
+
+# Modules that are expensive to import and that should only be loaded when
+# they are actually used
+HEAVY_MODULES = ['pandas', 'requests', 'future', 'configparser']
+
+
+class ImportTests(TestCase):
+    def _loaded_modules(self, module):
+        # Use a fresh interpreter, the test runner may have already imported
+        # some of the heavy modules
+        code = ("import sys; import %s; print('\\n'.join(sys.modules))"
+                % module)
+        proc = Popen([sys.executable, '-c', code], stdout=PIPE, stderr=PIPE,
+                     universal_newlines=True)
+        stdout, stderr = proc.communicate()
+        self.assertEqual(proc.returncode, 0, stderr)
+        return set(stdout.splitlines())
+
+    def test_import_qiita_client_is_lazy(self):
+        obs = self._loaded_modules('qiita_client')
+        for mod in HEAVY_MODULES:
+            self.assertNotIn(mod, obs)
+
+    def test_import_util_is_lazy(self):
+        obs = self._loaded_modules('qiita_client.util')
+        for mod in HEAVY_MODULES:
+            self.assertNotIn(mod, obs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from json import dumps
+
+from qiita_client.json_stream import iter_json_items
+
+
+def _chunks(text, size):
+    data = text.encode('utf-8')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class IterJsonItemsTests(TestCase):
+    def setUp(self):
+        self.doc = {'header': ['a', {'b': [1, 2]}],
+                    'samples': {'1.SKB1': {'ph': 7.25, 'name': u'été'},
+                                '1.SKB2': {'ph': 123456, 'name': None}},
+                    'files': [['/path/a.fastq', 'raw_forward_seqs'],
+                              ['/path/b.fastq', 'raw_reverse_seqs'],
+                              True, 1e-10, -12345]}
+        self.text = dumps(self.doc, indent=2)
+
+    def test_iter_json_items(self):
+        # Any chunk size, including chunks that split numbers, literals and
+        # multi-byte characters
+        for size in (1, 2, 7, 1000):
+            chunks = _chunks(self.text, size)
+            self.assertEqual(list(iter_json_items(chunks, ['files'])),
+                             self.doc['files'])
+            self.assertEqual(dict(iter_json_items(chunks, ['samples'])),
+                             self.doc['samples'])
+            self.assertEqual(list(iter_json_items(chunks, ['header', 1,
+                                                           'b'])),
+                             [1, 2])
+            self.assertEqual(sorted(k for k, _ in iter_json_items(chunks)),
+                             ['files', 'header', 'samples'])
+
+    def test_iter_json_items_empty(self):
+        self.assertEqual(list(iter_json_items([b'{"a": [ ]}'], ['a'])), [])
+        self.assertEqual(list(iter_json_items([b'{}'])), [])
+
+    def test_iter_json_items_errors(self):
+        chunks = _chunks(self.text, 10)
+        with self.assertRaises(ValueError):
+            list(iter_json_items(chunks, ['missing']))
+        with self.assertRaises(ValueError):
+            list(iter_json_items(chunks, ['header', 0]))
+        with self.assertRaises(ValueError):
+            list(iter_json_items([b'{"a": [1, 2'], ['a']))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,10 +8,11 @@
 
 from unittest import TestCase, main
 from os.path import isdir, exists, basename, join
-from os import remove
+from os import remove, environ
 from shutil import rmtree
 from json import dumps
 from tempfile import mkdtemp
+from threading import Lock
 
 from qiita_client.testing import PluginTestCase
 from qiita_client import (QiitaPlugin, QiitaTypePlugin, QiitaCommand,
@@ -73,6 +74,40 @@ class QiitaCommandTest(TestCase):
                            self.exp_opt, self.exp_out, self.exp_dflt)
         self.assertEqual(obs('a', 'b', 'c', 'd'), 42)
 
+    def test_setup_teardown(self):
+        calls = []
+
+        def setup():
+            calls.append('setup')
+            return len(calls)
+
+        def teardown(state):
+            calls.append(('teardown', state))
+
+        def func(a, b, c, d, state):
+            return state
+
+        with self.assertRaises(ValueError):
+            QiitaCommand("Test cmd", "Some description", lambda a, b, c, d: 42,
+                         self.exp_req, self.exp_opt, self.exp_out,
+                         setup=setup)
+
+        obs = QiitaCommand("Test cmd", "Some description", func, self.exp_req,
+                           self.exp_opt, self.exp_out, setup=setup,
+                           teardown=teardown)
+        obs.prepare()
+        self.assertEqual(obs('a', 'b', 'c', 'd'), 1)
+        # The state is reused by the following calls
+        obs.prepare()
+        self.assertEqual(obs('a', 'b', 'c', 'd'), 1)
+        self.assertEqual(calls, ['setup'])
+
+        obs.release()
+        self.assertEqual(calls, ['setup', ('teardown', 1)])
+        # The state is created again if the command is executed afterwards
+        self.assertEqual(obs('a', 'b', 'c', 'd'), 3)
+        self.assertEqual(calls, ['setup', ('teardown', 1), 'setup'])
+
 
 class QiitaArtifactTypeTest(TestCase):
     def test_init(self):
@@ -173,7 +208,7 @@ class QiitaTypePluginTest(PluginTestCase):
         self.qclient.post('/apitest/reload_plugins/')
 
         # Install the current plugin
-        tester("https://localhost:21174", 'register', 'ignored')
+        tester(self.server_url, 'register', 'ignored')
 
         # Check that it has been installed
         obs = self.qclient.get('/qiita_db/plugins/NewPlugin/1.0.0/')
@@ -181,6 +216,215 @@ class QiitaTypePluginTest(PluginTestCase):
         self.assertEqual(obs['version'], '1.0.0')
 
 
+class FakeQiitaClient(object):
+    """Records the requests issued by the plugins"""
+    def __init__(self, responses=None):
+        self.responses = responses if responses is not None else {}
+        self.requests = []
+        self._lock = Lock()
+
+    def _request(self, method, url, data=None):
+        with self._lock:
+            self.requests.append((method, url, data))
+        return self.responses.get((method, url))
+
+    def get(self, url, **kwargs):
+        return self._request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._request('POST', url, **kwargs)
+
+
+class RegistrationTests(TestCase):
+    def setUp(self):
+        self.conf_dir = mkdtemp()
+        self.old_plugins_dir = environ.get('QIITA_PLUGINS_DIR')
+        environ['QIITA_PLUGINS_DIR'] = self.conf_dir
+
+        def func(a, b, c, d):
+            return 42
+
+        self.atypes = [QiitaArtifactType('Name', 'Description', False, True,
+                                         [('plain_text', False)])]
+        self.plugin = QiitaTypePlugin("NewPlugin", "1.0.0", "Description",
+                                      func, func, self.atypes)
+        self.info_url = '/qiita_db/plugins/NewPlugin/1.0.0/'
+
+    def tearDown(self):
+        if self.old_plugins_dir is None:
+            del environ['QIITA_PLUGINS_DIR']
+        else:
+            environ['QIITA_PLUGINS_DIR'] = self.old_plugins_dir
+        rmtree(self.conf_dir)
+
+    def _posts(self, qclient):
+        return sorted(url for method, url, _ in qclient.requests
+                      if method == 'POST')
+
+    def test_manifest(self):
+        obs = self.plugin._manifest()
+        self.assertEqual(set(obs), {'hash', 'commands', 'artifact_types'})
+        self.assertEqual(set(obs['commands']),
+                         {'Validate', 'Generate HTML summary'})
+        self.assertEqual(set(obs['artifact_types']), {'Name'})
+        # The manifest is stable
+        self.assertEqual(obs, self.plugin._manifest())
+
+        self.atypes[0].description = 'Another description'
+        obs2 = self.plugin._manifest()
+        self.assertNotEqual(obs['hash'], obs2['hash'])
+        self.assertEqual(obs['commands'], obs2['commands'])
+        self.assertNotEqual(obs['artifact_types'], obs2['artifact_types'])
+
+    def test_register_new(self):
+        qclient = FakeQiitaClient(
+            {('GET', self.info_url): {'commands': [], 'active': False}})
+        self.plugin._register(qclient)
+        self.assertEqual(self._posts(qclient),
+                         ['/qiita_db/artifacts/types/',
+                          '/qiita_db/plugins/NewPlugin/1.0.0/commands/',
+                          '/qiita_db/plugins/NewPlugin/1.0.0/commands/'])
+        self.assertTrue(exists(self.plugin.manifest_fp))
+
+    def test_register_unchanged(self):
+        self.plugin._write_manifest(self.plugin._manifest())
+        commands = ['Validate', 'Generate HTML summary']
+
+        # The plugin is active - nothing to do
+        qclient = FakeQiitaClient(
+            {('GET', self.info_url): {'commands': commands, 'active': True}})
+        self.plugin._register(qclient)
+        self.assertEqual(self._posts(qclient), [])
+
+        # The plugin is not active - only activate the commands
+        qclient = FakeQiitaClient(
+            {('GET', self.info_url): {'commands': commands, 'active': False}})
+        self.plugin._register(qclient)
+        self.assertEqual(
+            self._posts(qclient),
+            ['/qiita_db/plugins/NewPlugin/1.0.0/commands/'
+             'Generate%20HTML%20summary/activate/',
+             '/qiita_db/plugins/NewPlugin/1.0.0/commands/Validate/activate/'])
+
+    def test_register_changed(self):
+        self.plugin._write_manifest(self.plugin._manifest())
+        self.atypes[0].description = 'Another description'
+        commands = ['Validate', 'Generate HTML summary']
+        qclient = FakeQiitaClient(
+            {('GET', self.info_url): {'commands': commands, 'active': True}})
+        self.plugin._register(qclient)
+        self.assertEqual(
+            self._posts(qclient),
+            ['/qiita_db/artifacts/types/',
+             '/qiita_db/plugins/NewPlugin/1.0.0/commands/'
+             'Generate%20HTML%20summary/activate/',
+             '/qiita_db/plugins/NewPlugin/1.0.0/commands/Validate/activate/'])
+        self.assertEqual(self.plugin._read_manifest(),
+                         self.plugin._manifest())
+
+
+def validate_fastq(fp, fp_type):
+    with open(fp) as f:
+        if not f.read().startswith('@'):
+            return "Not a FASTQ file"
+
+
+def validate_raises(fp, fp_type):
+    raise ValueError("Unexpected contents")
+
+
+class FileValidationTests(TestCase):
+    def setUp(self):
+        self.out_dir = mkdtemp()
+        self.atypes = [QiitaArtifactType('FASTQ', 'Description', False, True,
+                                         [('raw_forward_seqs', True),
+                                          ('raw_reverse_seqs', False),
+                                          ('log', False)])]
+        self.good = []
+        for i in range(4):
+            fp = join(self.out_dir, 'good%d.fastq' % i)
+            with open(fp, 'w') as f:
+                f.write('@seq%d\nACGT\n+\nIIII\n' % i)
+            self.good.append(fp)
+        self.bad = join(self.out_dir, 'bad.fastq')
+        with open(self.bad, 'w') as f:
+            f.write('>seq1\nACGT\n')
+
+        def html_generator_func(a, b, c, d):
+            return 42
+
+        self.html_generator_func = html_generator_func
+
+    def tearDown(self):
+        rmtree(self.out_dir)
+
+    def _validate(self, plugin, files):
+        parameters = {'files': dumps(files), 'artifact_type': 'FASTQ',
+                      'template': 1, 'analysis': None}
+        return plugin.task_dict['Validate'](None, 'job_id', parameters,
+                                            self.out_dir)
+
+    def test_validate_no_validate_func(self):
+        plugin = QiitaTypePlugin("NewPlugin", "1.0.0", "Description", None,
+                                 self.html_generator_func, self.atypes,
+                                 validation_jobs=2)
+        plugin.register_validator('raw_forward_seqs', validate_fastq)
+
+        files = {'raw_forward_seqs': self.good, 'log': [self.bad]}
+        success, ainfo, error = self._validate(plugin, files)
+        self.assertTrue(success)
+        self.assertEqual(error, "")
+        self.assertEqual(
+            ainfo, [ArtifactInfo(None, 'FASTQ',
+                                 [(fp, 'raw_forward_seqs')
+                                  for fp in self.good] +
+                                 [(self.bad, 'log')])])
+
+        files = {'raw_forward_seqs': self.good + [self.bad]}
+        success, ainfo, error = self._validate(plugin, files)
+        self.assertFalse(success)
+        self.assertIsNone(ainfo)
+        self.assertEqual(error, "%s (raw_forward_seqs): Not a FASTQ file"
+                         % self.bad)
+
+    def test_validate_errors_aggregated(self):
+        calls = []
+
+        def validate_func(qclient, job_id, parameters, out_dir):
+            calls.append(job_id)
+            return True, [], ""
+
+        plugin = QiitaTypePlugin("NewPlugin", "1.0.0", "Description",
+                                 validate_func, self.html_generator_func,
+                                 self.atypes)
+        self.assertEqual(plugin.task_dict['Validate'].function, validate_func)
+        plugin.register_validator('raw_reverse_seqs', validate_fastq,
+                                  artifact_type='FASTQ')
+        plugin.register_validator('log', validate_raises)
+        # Validators for other artifact types are ignored
+        plugin.register_validator('raw_reverse_seqs', validate_raises,
+                                  artifact_type='BIOM')
+
+        files = {'raw_reverse_seqs': [self.good[0], self.bad],
+                 'log': [self.good[1]]}
+        success, ainfo, error = self._validate(plugin, files)
+        self.assertFalse(success)
+        errors = error.split('\n')
+        self.assertEqual(errors[0],
+                         'Missing required filepath type: raw_forward_seqs')
+        self.assertEqual(errors[1], "%s (raw_reverse_seqs): Not a FASTQ file"
+                         % self.bad)
+        self.assertTrue(errors[2].startswith(
+            "%s (log): Error validating:" % self.good[1]))
+        self.assertIn('ValueError: Unexpected contents', error)
+        self.assertEqual(calls, [])
+
+        files = {'raw_forward_seqs': self.good,
+                 'raw_reverse_seqs': [self.good[0]]}
+        self.assertEqual(self._validate(plugin, files), (True, [], ""))
+        self.assertEqual(calls, ['job_id'])
+
+
 class QiitaPluginTest(PluginTestCase):
     # Most of the functionility is being tested in the previous
     # class. Here we are going to test that we can actually execute a job
@@ -215,7 +459,7 @@ class QiitaPluginTest(PluginTestCase):
         tester.generate_config('env_script', 'start_script',
                                server_cert=self.server_cert)
         self.qclient.post('/apitest/reload_plugins/')
-        tester("https://localhost:21174", 'register', 'ignored')
+        tester(self.server_url, 'register', 'ignored')
 
         obs = self.qclient.get('/qiita_db/plugins/NewPlugin/0.0.1/')
         self.assertEqual(obs['name'], 'NewPlugin')
@@ -231,7 +475,7 @@ class QiitaPluginTest(PluginTestCase):
                 'status': 'queued'}
         job_id = self.qclient.post('/apitest/processing_job/',
                                    data=data)['job']
-        tester("https://localhost:21174", job_id, self.outdir)
+        tester(self.server_url, job_id, self.outdir)
 
         status = self._wait_for_running_job(job_id)
         self.assertEqual(status, 'success')
@@ -7,15 +7,35 @@
 # -----------------------------------------------------------------------------
 
 from unittest import TestCase, main
-from os import environ, remove, close
-from os.path import basename, exists
-from tempfile import mkstemp
-from json import dumps
-
+from os import environ, remove, close, mkdir
+from os.path import basename, exists, join
+from tempfile import mkstemp, mkdtemp
+from shutil import rmtree
+from json import dumps, loads
+from threading import Timer, Thread
+from time import sleep, time
+from hashlib import md5, sha1
+from subprocess import Popen
+import gzip
+import os
+import pickle
+import signal
+import socket
+
+import requests
+
+import qiita_client.qiita_client as qc
 from qiita_client.qiita_client import (QiitaClient, _format_payload,
-                                       ArtifactInfo)
+                                       ArtifactInfo, CompactArtifactInfo,
+                                       _compute_checksums, _PayloadStream,
+                                       _compress_request_body, _heartbeat,
+                                       _next_heartbeat_interval,
+                                       CancellationToken,
+                                       MAX_HEARTBEAT_INTERVAL)
 from qiita_client.testing import PluginTestCase
-from qiita_client.exceptions import BadRequestError
+from qiita_client.fake_qiita import FakeQiitaServer
+from qiita_client.exceptions import (BadRequestError, ForbiddenError,
+                                     JobCancelledError, NotFoundError)
 
 CLIENT_ID = '19ndkO3oMKsoChjVVWluF7QkxHRfYhTKSFbAVt8IhK7gZgDaO4'
 CLIENT_SECRET = ('J7FfQ7CQdOxuKhQAf1eoGgBAE81Ns8Gu3EKaWFm3IO2JKh'
@@ -45,6 +65,502 @@ class ArtifactInfoTests(TestCase):
         self.assertNotEqual(obs, ArtifactInfo('demux', 'Demultiplexed', files))
         self.assertNotEqual(obs, ArtifactInfo('demultiplexed', 'Demux', files))
 
+    def _create_file(self, contents):
+        fd, fp = mkstemp()
+        close(fd)
+        with open(fp, 'wb') as f:
+            f.write(contents)
+        self.addCleanup(remove, fp)
+        return fp
+
+    def test_compute_checksums(self):
+        fp1 = self._create_file(b'some contents\n')
+        fp2 = self._create_file(b'')
+        obs = ArtifactInfo('demultiplexed', 'Demultiplexed',
+                           [(fp1, 'preprocessed_fasta'),
+                            (fp2, 'preprocessed_fastq'),
+                            (mkdtemp(), 'directory')])
+        self.addCleanup(rmtree, obs.files[2][0])
+        self.assertIsNone(obs.checksums)
+        obs.compute_checksums()
+        exp = {fp1: {'algorithm': 'md5',
+                     'checksum': md5(b'some contents\n').hexdigest(),
+                     'size': 14},
+               fp2: {'algorithm': 'md5', 'checksum': md5(b'').hexdigest(),
+                     'size': 0}}
+        self.assertEqual(obs.checksums, exp)
+
+    def test_compute_checksums_multiple_artifacts(self):
+        contents = [b'x' * (2 ** i) for i in range(10)]
+        fps = [self._create_file(c) for c in contents]
+        ainfo = [ArtifactInfo('out1', 'Demultiplexed',
+                              [(fp, 'preprocessed_fasta') for fp in fps[:5]]),
+                 ArtifactInfo('out2', 'Demultiplexed',
+                              [(fp, 'preprocessed_fasta') for fp in fps])]
+        _compute_checksums(ainfo, algorithm='sha1', n_jobs=3)
+        for a_info, n in zip(ainfo, [5, 10]):
+            exp = {fp: {'algorithm': 'sha1', 'checksum': sha1(c).hexdigest(),
+                        'size': len(c)}
+                   for fp, c in zip(fps[:n], contents[:n])}
+            self.assertEqual(a_info.checksums, exp)
+
+    def test_compute_checksums_error(self):
+        obs = ArtifactInfo('demultiplexed', 'Demultiplexed', [])
+        with self.assertRaises(ValueError):
+            obs.compute_checksums(algorithm='not-an-algorithm')
+
+        obs = ArtifactInfo('demultiplexed', 'Demultiplexed',
+                           [('/does/not/exist.fna', 'preprocessed_fasta')])
+        with self.assertRaises(IOError):
+            obs.compute_checksums()
+        self.assertIsNone(obs.checksums)
+
+
+class CompactArtifactInfoTests(TestCase):
+    def test_init(self):
+        files = [("fp1", "preprocessed_fasta"), ("fp2", "preprocessed_fastq")]
+        obs = CompactArtifactInfo('demultiplexed', 'Demultiplexed', files)
+        self.assertEqual(obs.output_name, 'demultiplexed')
+        self.assertEqual(obs.artifact_type, 'Demultiplexed')
+        self.assertEqual(obs.files, tuple(files))
+        self.assertIsNone(obs.checksums)
+        self.assertFalse(hasattr(obs, '__dict__'))
+
+        with self.assertRaises(AttributeError):
+            obs.output_name = 'other'
+        with self.assertRaises(AttributeError):
+            obs.checksums = {}
+
+    def test_pickle(self):
+        obs = CompactArtifactInfo(
+            'demultiplexed', 'Demultiplexed',
+            (("fp%d" % i, "preprocessed_fasta") for i in range(3)))
+        obs2 = pickle.loads(pickle.dumps(obs))
+        self.assertEqual(obs2, obs)
+        self.assertEqual(obs2.files, obs.files)
+        self.assertEqual(hash(obs2), hash(obs))
+        self.assertIsNone(obs2.checksums)
+
+    def test_init_lazy(self):
+        consumed = []
+
+        def gen():
+            consumed.append(True)
+            yield ("fp1", "preprocessed_fasta")
+
+        obs = CompactArtifactInfo('demultiplexed', 'Demultiplexed', gen())
+        self.assertEqual(consumed, [])
+        self.assertEqual(obs.files, (("fp1", "preprocessed_fasta"),))
+        self.assertEqual(obs.files, (("fp1", "preprocessed_fasta"),))
+        self.assertEqual(consumed, [True])
+
+    def test_from_directory(self):
+        out_dir = mkdtemp()
+        self.addCleanup(rmtree, out_dir)
+        mkdir(join(out_dir, 'subdir'))
+        fps = [join(out_dir, 'a.fastq'), join(out_dir, 'b.fastq'),
+               join(out_dir, 'c.log'), join(out_dir, 'subdir', 'd.fastq')]
+        for fp in fps:
+            with open(fp, 'w') as f:
+                f.write('\n')
+
+        obs = CompactArtifactInfo.from_directory(
+            'demultiplexed', 'Demultiplexed', out_dir, 'preprocessed_fastq',
+            pattern='*.fastq')
+        self.assertEqual(sorted(obs.files),
+                         [(fps[0], 'preprocessed_fastq'),
+                          (fps[1], 'preprocessed_fastq')])
+
+        obs = CompactArtifactInfo.from_directory(
+            'demultiplexed', 'Demultiplexed', out_dir, 'preprocessed_fastq',
+            recursive=True)
+        self.assertEqual(sorted(obs.files),
+                         [(fp, 'preprocessed_fastq') for fp in fps])
+
+    def test_eq_ne_hash(self):
+        files = [("fp1", "preprocessed_fasta"), ("fp2", "preprocessed_fastq")]
+        obs = CompactArtifactInfo('demultiplexed', 'Demultiplexed', files)
+
+        self.assertEqual(obs, obs)
+        obs2 = CompactArtifactInfo('demultiplexed', 'Demultiplexed',
+                                   files[::-1])
+        self.assertEqual(obs, obs2)
+        self.assertEqual(hash(obs), hash(obs2))
+        self.assertEqual(len({obs, obs2}), 1)
+
+        self.assertNotEqual(obs, 1)
+        # Equal to an ArtifactInfo with the same contents
+        self.assertEqual(obs, ArtifactInfo('demultiplexed', 'Demultiplexed',
+                                           files[::-1]))
+        self.assertEqual(ArtifactInfo('demultiplexed', 'Demultiplexed',
+                                      files), obs)
+        self.assertNotEqual(obs, ArtifactInfo('demultiplexed', 'Demultiplexed',
+                                              files[:1]))
+        self.assertNotEqual(
+            obs, CompactArtifactInfo('demux', 'Demultiplexed', files))
+        self.assertNotEqual(
+            obs, CompactArtifactInfo('demultiplexed', 'Demux', files))
+        self.assertNotEqual(
+            obs, CompactArtifactInfo('demultiplexed', 'Demultiplexed',
+                                     files[:1]))
+
+
+class FakeHeartbeatClient(object):
+    def __init__(self, responses, status='running'):
+        self.responses = responses
+        self.status = status
+
+    def post(self, url, **kwargs):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def get_job_info(self, job_id):
+        return {'status': self.status}
+
+
+class CancellationTests(TestCase):
+    def setUp(self):
+        qc.JOB_COMPLETED = False
+
+    def tearDown(self):
+        qc.JOB_COMPLETED = False
+        qc.JOB_CANCEL_TOKEN = None
+
+    def test_token(self):
+        token = CancellationToken()
+        self.assertFalse(token.cancelled)
+        self.assertFalse(token.wait(0.01))
+        token.check()
+
+        token.cancel('some reason')
+        self.assertTrue(token.cancelled)
+        self.assertTrue(token.wait(0.01))
+        self.assertEqual(token.reason, 'some reason')
+        with self.assertRaises(JobCancelledError):
+            token.check()
+
+        # Cancelling again keeps the first reason
+        token.cancel('another reason')
+        self.assertEqual(token.reason, 'some reason')
+
+    def test_kill_job_processes(self):
+        token = CancellationToken()
+        qc.JOB_CANCEL_TOKEN = token
+        # Nothing to terminate
+        qc._kill_job_processes()
+        self.assertFalse(token.cancelled)
+
+        proc = Popen("trap '' TERM; sleep 30", shell=True,
+                     preexec_fn=os.setpgrp)
+        token.register_process(proc)
+        # Let the shell ignore SIGTERM before stopping it
+        sleep(0.2)
+        old_grace_period = qc.EXIT_GRACE_PERIOD
+        qc.EXIT_GRACE_PERIOD = 0.2
+        self.addCleanup(setattr, qc, 'EXIT_GRACE_PERIOD', old_grace_period)
+        start = time()
+        qc._kill_job_processes()
+        self.assertEqual(proc.wait(), -signal.SIGKILL)
+        self.assertLess(time() - start, 5)
+        self.assertTrue(token.cancelled)
+
+    def test_heartbeat_rejected(self):
+        token = CancellationToken()
+        qclient = FakeHeartbeatClient([ForbiddenError('Job completed')],
+                                      status='error')
+        _heartbeat(qclient, '/url/', job_id='job', cancel_token=token)
+        self.assertTrue(token.cancelled)
+        self.assertEqual(token.reason,
+                         "the heartbeat was rejected: Job completed")
+
+    def test_heartbeat_rejected_job_running(self):
+        token = CancellationToken()
+        qclient = FakeHeartbeatClient([ForbiddenError('Job completed')])
+        with self.assertRaises(ForbiddenError):
+            _heartbeat(qclient, '/url/', job_id='job', cancel_token=token)
+        self.assertFalse(token.cancelled)
+
+    def test_heartbeat_rejected_success_false(self):
+        # Qiita rejects the heartbeats with a 200 response
+        token = CancellationToken()
+        qclient = FakeHeartbeatClient(
+            [{'success': False, 'error': 'Job is not running: error'}],
+            status='error')
+        _heartbeat(qclient, '/url/', job_id='job', cancel_token=token)
+        self.assertTrue(token.cancelled)
+        self.assertEqual(
+            token.reason,
+            "the heartbeat was rejected: Job is not running: error")
+
+        # The job is not cancelled if it is still active
+        token = CancellationToken()
+        qclient = FakeHeartbeatClient(
+            [{'success': False, 'error': 'Unknown error'},
+             ForbiddenError('Job completed')])
+        with self.assertRaises(ForbiddenError):
+            _heartbeat(qclient, '/url/', job_id='job', cancel_token=token,
+                       interval=0.01)
+        self.assertFalse(token.cancelled)
+
+    def test_start_heartbeat_several_jobs(self):
+        server = FakeQiitaServer().start()
+        self.addCleanup(server.stop)
+        qclient = QiitaClient(server.url, CLIENT_ID, CLIENT_SECRET,
+                              heartbeat_interval=0.05)
+        tokens = []
+        for i in range(2):
+            job_id = server.add_job('NewCmd', {'p1': i})
+            qclient.start_heartbeat(job_id)
+            tokens.append(qclient.cancel_token)
+            self.assertIs(qc.JOB_CANCEL_TOKEN, qclient.cancel_token)
+            sleep(0.3)
+            # The heartbeats are sent for the second job too
+            self.assertGreater(server.jobs[job_id]['heartbeats'], 1)
+            qclient.complete_job(job_id, True)
+            self.assertEqual(server.jobs[job_id]['status'], 'success')
+        # Each job has its own token
+        self.assertIsNot(tokens[0], tokens[1])
+
+    def test_next_heartbeat_interval(self):
+        # Failed or slow heartbeats back off
+        self.assertEqual(_next_heartbeat_interval(30, 30), 60)
+        self.assertEqual(_next_heartbeat_interval(30, 30, latency=5), 60)
+        self.assertEqual(_next_heartbeat_interval(100, 30),
+                         MAX_HEARTBEAT_INTERVAL)
+        # Fast heartbeats go back to the base interval
+        self.assertEqual(_next_heartbeat_interval(120, 30, latency=0.1), 60)
+        self.assertEqual(_next_heartbeat_interval(40, 30, latency=0.1), 30)
+        # The interval requested by the server is honoured
+        self.assertEqual(_next_heartbeat_interval(30, 600, latency=0.1), 600)
+        self.assertEqual(_next_heartbeat_interval(600, 600), 600)
+
+    def test_heartbeat_server_error(self):
+        token = CancellationToken()
+        qclient = FakeHeartbeatClient([
+            RuntimeError('Status code: 503'), {'heartbeat_interval': 0.02},
+            RuntimeError('Status code: 503'),
+            {'success': False, 'error': 'Job already finished'}],
+            status='error')
+        _heartbeat(qclient, '/url/', job_id='job', cancel_token=token,
+                   interval=0.01)
+        self.assertEqual(qclient.responses, [])
+        self.assertTrue(token.cancelled)
+
+        qclient = FakeHeartbeatClient([RuntimeError('Status code: 503'),
+                                       RuntimeError('Status code: 503')])
+        with self.assertRaises(RuntimeError):
+            _heartbeat(qclient, '/url/', job_id='job',
+                       cancel_token=CancellationToken(), interval=0.01)
+
+
+class WaitForJobsTests(TestCase):
+    def setUp(self):
+        self.server = FakeQiitaServer().start()
+        self.qclient = QiitaClient(self.server.url, CLIENT_ID, CLIENT_SECRET)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _finish(self, job_id, status, delay):
+        timer = Timer(delay, self.server.jobs[job_id].__setitem__,
+                      args=('status', status))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_wait_for_jobs(self):
+        job_ids = [self.server.add_job('NewCmd', {}, status='running')
+                   for _ in range(3)]
+        self.server.jobs[job_ids[2]]['status'] = 'success'
+        self._finish(job_ids[0], 'error', 0.1)
+        self._finish(job_ids[1], 'success', 0.2)
+
+        obs = list(self.qclient.wait_for_jobs(job_ids, timeout=10,
+                                              poll_interval=0.01))
+        self.assertEqual(obs, [(job_ids[2], 'success'),
+                               (job_ids[0], 'error'),
+                               (job_ids[1], 'success')])
+
+    def test_wait_for_jobs_backoff(self):
+        job_id = self.server.add_job('NewCmd', {}, status='running')
+        self._finish(job_id, 'success', 0.5)
+        obs = list(self.qclient.wait_for_jobs([job_id], timeout=10,
+                                              poll_interval=0.01))
+        self.assertEqual(obs, [(job_id, 'success')])
+        # With a fixed interval it would have polled 50 times
+        polls = self.server.requests.count(
+            ('GET', '/qiita_db/jobs/%s' % job_id))
+        self.assertLess(polls, 10)
+
+    def test_wait_for_jobs_duplicated(self):
+        job_ids = [self.server.add_job('NewCmd', {}, status='success')
+                   for _ in range(2)]
+        obs = list(self.qclient.wait_for_jobs(job_ids * 2 + job_ids[:1],
+                                              poll_interval=0.01))
+        self.assertEqual(obs, [(job_ids[0], 'success'),
+                               (job_ids[1], 'success')])
+
+    def test_wait_for_jobs_error(self):
+        job_id = self.server.add_job('NewCmd', {}, status='running')
+        self._finish(job_id, 'success', 0.1)
+        get_job_info = self.qclient.get_job_info
+        calls = []
+
+        def failing_get_job_info(job_id):
+            calls.append(job_id)
+            if len(calls) == 1:
+                raise requests.ConnectionError("Connection refused")
+            if len(calls) == 2:
+                # The retries failed with server errors
+                raise RuntimeError("Status code: 502")
+            return get_job_info(job_id)
+
+        self.qclient.get_job_info = failing_get_job_info
+        obs = list(self.qclient.wait_for_jobs([job_id], timeout=10,
+                                              poll_interval=0.01))
+        self.assertEqual(obs, [(job_id, 'success')])
+        self.assertGreater(len(calls), 2)
+
+        # The permanent errors are not retried
+        with self.assertRaises(NotFoundError):
+            list(self.qclient.wait_for_jobs(['unknown'], poll_interval=0.01))
+        self.qclient.get_job_info = lambda job_id: {}
+        with self.assertRaises(KeyError):
+            list(self.qclient.wait_for_jobs([job_id], poll_interval=0.01))
+
+    def test_wait_for_jobs_timeout(self):
+        job_id = self.server.add_job('NewCmd', {}, status='queued')
+        with self.assertRaisesRegex(RuntimeError, job_id):
+            list(self.qclient.wait_for_jobs([job_id], timeout=0.1,
+                                            poll_interval=0.01))
+
+
+def _unreachable_url():
+    """Returns the url of a local port where nothing is listening"""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'http://127.0.0.1:%d' % port
+
+
+class FailoverTests(TestCase):
+    def setUp(self):
+        self.server = FakeQiitaServer().start()
+        self.down_url = _unreachable_url()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_failover(self):
+        qclient = QiitaClient([self.down_url, self.server.url], CLIENT_ID,
+                              CLIENT_SECRET)
+        self.assertEqual(qclient._servers.healthy(), [self.server.url])
+        job_id = self.server.add_job('NewCmd', {'p1': 1})
+        self.assertEqual(qclient.get_job_info(job_id)['status'], 'queued')
+        qclient.post('/qiita_db/jobs/%s/heartbeat/' % job_id, data='')
+        self.assertEqual(self.server.jobs[job_id]['status'], 'running')
+
+    def test_failover_unavailable(self):
+        # Two urls of the same server
+        other_url = self.server.url.replace('127.0.0.1', 'localhost')
+        qclient = QiitaClient('%s,%s' % (self.server.url, other_url),
+                              CLIENT_ID, CLIENT_SECRET)
+        job_id = self.server.add_job('NewCmd', {'p1': 1})
+        self.server.fail_next(status=503)
+        qclient.get_job_info(job_id)
+        self.assertEqual(len(qclient._servers.healthy()), 1)
+
+    def _drop_requests(self, url):
+        """Listens at `url`, closing the connections without answering"""
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('127.0.0.1', int(url.rsplit(':', 1)[1])))
+        sock.listen(5)
+        sock.settimeout(0.1)
+        self.addCleanup(sock.close)
+
+        def serve():
+            while sock.fileno() != -1:
+                try:
+                    conn, _ = sock.accept()
+                except (socket.timeout, OSError):
+                    continue
+                conn.recv(65536)
+                conn.close()
+
+        thread = Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+
+    def test_failover_request_sent(self):
+        qclient = QiitaClient([self.down_url, self.server.url], CLIENT_ID,
+                              CLIENT_SECRET)
+        # The replica accepts the connections, but fails after receiving the
+        # requests
+        self._drop_requests(self.down_url)
+        qclient._servers.mark_up(self.down_url)
+        job_id = self.server.add_job('NewCmd', {'p1': 1})
+        heartbeat_url = '/qiita_db/jobs/%s/heartbeat/' % job_id
+        with self.assertRaises(requests.ConnectionError):
+            qclient.post(heartbeat_url, data='')
+        self.assertNotIn(('POST', heartbeat_url), self.server.requests)
+
+        # The idempotent requests are sent to the next replica
+        qclient._servers.mark_up(self.down_url)
+        self.assertEqual(qclient.get_job_info(job_id)['status'], 'queued')
+
+    def test_all_down(self):
+        with self.assertRaises(requests.ConnectionError):
+            QiitaClient([self.down_url, _unreachable_url()], CLIENT_ID,
+                        CLIENT_SECRET)
+
+
+class StreamingTests(TestCase):
+    def setUp(self):
+        self.server = FakeQiitaServer().start()
+        self.fps = ['/path/sample_%d.fastq' % i for i in range(1000)]
+        self.server.add_artifact('FASTQ', {'raw_forward_seqs': self.fps},
+                                 artifact_id=1)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_get_stream_items(self):
+        qclient = QiitaClient(self.server.url, CLIENT_ID, CLIENT_SECRET)
+        obs = qclient.get('/qiita_db/artifacts/1/',
+                          stream_items=['files', 'raw_forward_seqs'])
+        self.assertEqual(list(obs), self.fps)
+
+        with self.assertRaises(NotFoundError):
+            qclient.get('/qiita_db/artifacts/2/', stream_items=['files'])
+
+    def test_complete_job_checksum_error(self):
+        qclient = QiitaClient(self.server.url, CLIENT_ID, CLIENT_SECRET)
+        job_id = self.server.add_job('NewCmd', {'p1': 1})
+        qclient.post('/qiita_db/jobs/%s/heartbeat/' % job_id, data='')
+        qclient.complete_job(job_id, True, artifacts_info=[
+            ArtifactInfo('out1', 'Demultiplexed',
+                         [('/does/not/exist.fna', 'preprocessed_fasta')])],
+            checksum_algorithm='md5')
+        self.assertEqual(self.server.jobs[job_id]['status'], 'error')
+        self.assertIn('/does/not/exist.fna',
+                      self.server.jobs[job_id]['result']['error'])
+
+    def test_json_decoder(self):
+        calls = []
+
+        def decoder(content):
+            calls.append(content)
+            return loads(content)
+
+        qclient = QiitaClient(self.server.url, CLIENT_ID, CLIENT_SECRET,
+                              json_decoder=decoder)
+        obs = qclient.get('/qiita_db/artifacts/1/')
+        self.assertEqual(obs['files']['raw_forward_seqs'], self.fps)
+        self.assertEqual(len(calls), 1)
+
 
 class UtilTests(TestCase):
     def test_format_payload(self):
@@ -60,6 +576,83 @@ class UtilTests(TestCase):
                                       ("fp2", "preprocessed_fastq")]}}}
         self.assertEqual(obs, exp)
 
+    def test_format_payload_checksums(self):
+        ainfo = [ArtifactInfo("demultiplexed", "Demultiplexed",
+                              [("fp1", "preprocessed_fasta")])]
+        ainfo[0].checksums = {'fp1': {'algorithm': 'md5', 'checksum': 'abc',
+                                      'size': 3}}
+        obs = _format_payload(True, artifacts_info=ainfo)
+        exp = {'success': True, 'error': '',
+               'artifacts':
+                   {'demultiplexed':
+                       {'artifact_type': "Demultiplexed",
+                        'filepaths': [("fp1", "preprocessed_fasta")],
+                        'checksums': {'fp1': {'algorithm': 'md5',
+                                              'checksum': 'abc',
+                                              'size': 3}}}}}
+        self.assertEqual(obs, exp)
+
+    def test_payload_stream(self):
+        ainfo = [ArtifactInfo("demultiplexed", "Demultiplexed",
+                              [("fp1", "preprocessed_fasta"),
+                               ("fp2", "preprocessed_fastq")]),
+                 CompactArtifactInfo("other", "BIOM",
+                                     [("fp%d" % i, "biom")
+                                      for i in range(2500)])]
+        ainfo[0].checksums = {'fp1': {'algorithm': 'md5', 'checksum': 'abc',
+                                      'size': 3}}
+        obs = _PayloadStream(True, error_msg="Ignored", artifacts_info=ainfo)
+        exp = dumps(_format_payload(True, error_msg="Ignored",
+                                    artifacts_info=ainfo))
+        self.assertEqual(b''.join(obs).decode('utf-8'), exp)
+        # It can be iterated multiple times
+        self.assertEqual(b''.join(obs).decode('utf-8'), exp)
+
+        obs = _PayloadStream(True, artifacts_info=ainfo, compress=True)
+        self.assertEqual(
+            loads(gzip.decompress(b''.join(obs)).decode('utf-8')), loads(exp))
+
+    def test_payload_stream_error(self):
+        obs = _PayloadStream(False, error_msg="Some error",
+                             artifacts_info=['ignored'])
+        exp = dumps(_format_payload(False, error_msg="Some error",
+                                    artifacts_info=['ignored']))
+        self.assertEqual(b''.join(obs).decode('utf-8'), exp)
+
+    def test_compress_request_body(self):
+        payload = dumps({'step': 'x' * 100})
+        obs = _compress_request_body({'data': payload}, 10)
+        self.assertEqual(obs['headers'], {'Content-Encoding': 'gzip'})
+        self.assertEqual(gzip.decompress(obs['data']).decode('utf-8'),
+                         payload)
+
+        # Existing headers are kept and not modified in place
+        headers = {'Authorization': 'Bearer token'}
+        obs = _compress_request_body({'data': {'name': 'x' * 100},
+                                      'headers': headers}, 10)
+        self.assertEqual(headers, {'Authorization': 'Bearer token'})
+        self.assertEqual(
+            obs['headers'],
+            {'Authorization': 'Bearer token', 'Content-Encoding': 'gzip',
+             'Content-Type': 'application/x-www-form-urlencoded'})
+        self.assertEqual(gzip.decompress(obs['data']).decode('utf-8'),
+                         'name=' + 'x' * 100)
+
+    def test_compress_request_body_unchanged(self):
+        # Too small
+        kwargs = {'data': 'small'}
+        self.assertIs(_compress_request_body(kwargs, 10), kwargs)
+        # No body
+        kwargs = {}
+        self.assertIs(_compress_request_body(kwargs, 10), kwargs)
+        # Already encoded
+        kwargs = {'data': b'x' * 100,
+                  'headers': {'Content-Encoding': 'gzip'}}
+        self.assertIs(_compress_request_body(kwargs, 10), kwargs)
+        # Streams
+        kwargs = {'data': _PayloadStream(False, error_msg='x' * 100)}
+        self.assertIs(_compress_request_body(kwargs, 10), kwargs)
+
     def test_format_payload_error(self):
         obs = _format_payload(False, error_msg="Some error",
                               artifacts_info=['ignored'])
@@ -0,0 +1,107 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time, sleep
+import threading
+
+from qiita_client import QiitaClient
+from qiita_client.fake_qiita import FakeQiitaServer
+from qiita_client.ratelimit import (RateLimiter, request_priority,
+                                    PRIORITY_HIGH, PRIORITY_NORMAL,
+                                    PRIORITY_LOW)
+
+
+class RateLimiterTests(TestCase):
+    def test_request_priority(self):
+        self.assertEqual(
+            request_priority('post', '/qiita_db/jobs/1/heartbeat/'),
+            PRIORITY_HIGH)
+        self.assertEqual(
+            request_priority('POST', '/qiita_db/jobs/1/complete/'),
+            PRIORITY_HIGH)
+        self.assertEqual(request_priority('post', '/qiita_db/jobs/1/step/'),
+                         PRIORITY_LOW)
+        self.assertEqual(request_priority('get', '/qiita_db/jobs/1'),
+                         PRIORITY_LOW)
+        self.assertEqual(request_priority('post', '/qiita_db/authenticate/'),
+                         PRIORITY_NORMAL)
+        self.assertEqual(request_priority('patch', '/qiita_db/artifacts/1/'),
+                         PRIORITY_NORMAL)
+
+    def test_init_error(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(0)
+
+    def test_rate(self):
+        limiter = RateLimiter(50, burst=1)
+        start = time()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(time() - start, 0.19)
+
+    def test_reserved_tokens(self):
+        limiter = RateLimiter(0.01, burst=5)
+        # The low priority requests leave half of the bucket
+        self.assertEqual([limiter._take(PRIORITY_LOW) for _ in range(3)],
+                         [0, 0, 0])
+        self.assertGreater(limiter._take(PRIORITY_LOW), 0)
+        # The normal priority requests leave a quarter
+        self.assertEqual(limiter._take(PRIORITY_NORMAL), 0)
+        self.assertGreater(limiter._take(PRIORITY_NORMAL), 0)
+        self.assertEqual(limiter._take(PRIORITY_HIGH), 0)
+        self.assertGreater(limiter._take(PRIORITY_HIGH), 0)
+
+    def test_priority_order(self):
+        limiter = RateLimiter(10, burst=1)
+        limiter.acquire()
+        order = []
+
+        def request(priority):
+            limiter.acquire(priority)
+            order.append(priority)
+
+        threads = [threading.Thread(target=request, args=(PRIORITY_LOW,))
+                   for _ in range(2)]
+        for t in threads:
+            t.start()
+        sleep(0.02)
+        threads.append(threading.Thread(target=request,
+                                        args=(PRIORITY_HIGH,)))
+        threads[-1].start()
+        for t in threads:
+            t.join()
+        self.assertEqual(order, [PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_LOW])
+
+    def test_shared(self):
+        base_dir = mkdtemp()
+        self.addCleanup(rmtree, base_dir)
+        fp = join(base_dir, 'qiita.ratelimit')
+        limiter1 = RateLimiter(0.01, burst=2, lock_fp=fp)
+        limiter2 = RateLimiter(0.01, burst=2, lock_fp=fp)
+        self.assertEqual(limiter1._take(PRIORITY_HIGH), 0)
+        self.assertEqual(limiter2._take(PRIORITY_HIGH), 0)
+        self.assertGreater(limiter1._take(PRIORITY_HIGH), 0)
+        self.assertGreater(limiter2._take(PRIORITY_HIGH), 0)
+
+    def test_client(self):
+        with FakeQiitaServer() as server:
+            job_id = server.add_job('NewCmd', {'p1': 1})
+            qclient = QiitaClient(server.url, 'client_id', 'client_secret',
+                                  rate_limiter=RateLimiter(50, burst=1))
+            start = time()
+            for _ in range(10):
+                qclient.get_job_info(job_id)
+            self.assertGreaterEqual(time() - start, 0.19)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from qiita_client import QiitaPlugin, QiitaCommand
+from qiita_client.reference import (load_reference, get_reference,
+                                    unload_references)
+
+
+class ReferenceTests(TestCase):
+    def setUp(self):
+        self.base_dir = mkdtemp()
+        self.ref_fp = join(self.base_dir, 'gg_97_otus.fna')
+        with open(self.ref_fp, 'w') as f:
+            f.write('>1\nACGT\n>2\nTTTT\n')
+
+    def tearDown(self):
+        unload_references()
+        rmtree(self.base_dir)
+
+    def test_load_reference(self):
+        obs = load_reference('gg', self.ref_fp)
+        self.assertEqual(obs[:8], b'>1\nACGT\n')
+        # The file is only mapped once
+        self.assertIs(load_reference('gg', self.ref_fp), obs)
+        self.assertIs(get_reference('gg'), obs)
+        with self.assertRaises(TypeError):
+            obs[0:1] = b'X'
+
+    def test_load_reference_reload(self):
+        obs = load_reference('gg', self.ref_fp)
+        other_fp = join(self.base_dir, 'silva.fna')
+        with open(other_fp, 'w') as f:
+            f.write('>3\nGGGG\n')
+        # A different file replaces the loaded one
+        self.assertEqual(load_reference('gg', other_fp)[:8], b'>3\nGGGG\n')
+        with self.assertRaises(ValueError):
+            obs[:1]
+
+        # The references unloaded are mapped again
+        unload_references()
+        self.assertEqual(load_reference('gg', self.ref_fp)[:8],
+                         b'>1\nACGT\n')
+
+    def test_get_reference_error(self):
+        with self.assertRaises(ValueError):
+            get_reference('gg')
+
+    def test_run_task_with_references(self):
+        def func(qclient, job_id, parameters, output_dir):
+            ref = get_reference('gg')
+            return True, None, bytes(ref[:2]).decode('ascii')
+
+        plugin = QiitaPlugin("NewPlugin", "0.0.1", "description")
+        plugin.register_reference('gg', self.ref_fp)
+        cmd = QiitaCommand("NewCmd", "Desc", func, {}, {}, {'out1': 'BIOM'},
+                           cacheable=False, references=['gg'])
+        plugin.register_command(cmd)
+
+        obs = plugin._execute(None, 'job1', cmd, {}, self.base_dir)
+        self.assertEqual(obs, (True, None, '>1'))
+
+        plugin.register_reference('gg', join(self.base_dir, 'missing.fna'))
+        unload_references()
+        success, _, error_msg = plugin._execute(None, 'job1', cmd, {},
+                                                self.base_dir)
+        self.assertFalse(success)
+        self.assertIn("loading reference 'gg'", error_msg)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+
+from qiita_client.servers import ServerPool, parse_server_urls
+
+URLS = ['https://qiita1', 'https://qiita2', 'https://qiita3']
+
+
+class ServerPoolTests(TestCase):
+    def test_parse_server_urls(self):
+        self.assertEqual(parse_server_urls('https://qiita1/'),
+                         ['https://qiita1'])
+        self.assertEqual(parse_server_urls('https://qiita1, https://qiita2'),
+                         URLS[:2])
+        self.assertEqual(parse_server_urls(URLS), URLS)
+        with self.assertRaises(ValueError):
+            parse_server_urls('')
+
+    def test_init_error(self):
+        with self.assertRaises(ValueError):
+            ServerPool(URLS, policy='random')
+
+    def test_round_robin(self):
+        pool = ServerPool(URLS, policy='round_robin')
+        obs = [pool.choose('/qiita_db/artifacts/1/', True) for _ in range(6)]
+        self.assertEqual(obs, URLS + URLS)
+
+    def test_least_outstanding(self):
+        pool = ServerPool(URLS)
+        pool.acquire(URLS[0])
+        pool.acquire(URLS[1])
+        pool.acquire(URLS[1])
+        self.assertEqual(pool.choose('/qiita_db/artifacts/1/', True),
+                         URLS[2])
+        pool.acquire(URLS[2])
+        pool.acquire(URLS[2])
+        self.assertEqual(pool.choose('/qiita_db/artifacts/1/', True),
+                         URLS[0])
+        pool.release(URLS[1])
+        pool.release(URLS[1])
+        self.assertEqual(pool.choose('/qiita_db/artifacts/1/', True),
+                         URLS[1])
+
+    def test_not_idempotent(self):
+        pool = ServerPool(URLS)
+        obs = {pool.choose('/qiita_db/jobs/1/step/', False)
+               for _ in range(5)}
+        self.assertEqual(obs, {URLS[0]})
+
+    def test_sticky_jobs(self):
+        pool = ServerPool(URLS, sticky_jobs=True)
+        exp = pool.choose('/qiita_db/jobs/abc/heartbeat/', False)
+        for path in ('/qiita_db/jobs/abc', '/qiita_db/jobs/abc/step/',
+                     '/qiita_db/jobs/abc/complete/'):
+            self.assertEqual(pool.choose(path, path == '/qiita_db/jobs/abc'),
+                             exp)
+        # Another process chooses the same replica
+        self.assertEqual(
+            ServerPool(URLS, sticky_jobs=True).choose(
+                '/qiita_db/jobs/abc', True), exp)
+        # While it is down, the job goes to the next one
+        pool.mark_down(exp)
+        obs = pool.choose('/qiita_db/jobs/abc', True)
+        self.assertEqual(obs, URLS[(URLS.index(exp) + 1) % 3])
+
+    def test_mark_down(self):
+        pool = ServerPool(URLS, down_time=60)
+        pool.mark_down(URLS[0])
+        self.assertEqual(pool.healthy(), URLS[1:])
+        self.assertEqual(pool.choose('/qiita_db/jobs/1/step/', False),
+                         URLS[1])
+        self.assertEqual(pool.choose('/qiita_db/jobs/1/step/', False,
+                                     exclude=URLS[1:]), URLS[0])
+        self.assertIsNone(pool.choose('/qiita_db/jobs/1/step/', False,
+                                      exclude=URLS))
+        pool.mark_up(URLS[0])
+        self.assertEqual(pool.healthy(), URLS)
+
+        # A replica is tried again after the down time
+        pool = ServerPool(URLS, down_time=0)
+        pool.mark_down(URLS[0])
+        self.assertEqual(pool.healthy(), URLS)
+
+        # If all are down, all are tried
+        pool = ServerPool(URLS, down_time=60)
+        for url in URLS:
+            pool.mark_down(url)
+        self.assertEqual(pool.choose('/qiita_db/jobs/1/step/', False),
+                         URLS[0])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from os.path import join, exists
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import sleep
+import os
+import stat
+
+import qiita_client.qiita_client as qc
+from qiita_client import QiitaClient, ArtifactInfo
+from qiita_client.fake_qiita import FakeQiitaServer
+from qiita_client.sidecar import QiitaSidecar
+from qiita_client.transport import UnixSocketTransport
+
+
+class QiitaSidecarTests(TestCase):
+    def setUp(self):
+        self.base_dir = mkdtemp()
+        self.socket_path = join(self.base_dir, 'qiita.sock')
+        self.server = FakeQiitaServer().start()
+        self.sidecar = QiitaSidecar(self.socket_path, self.server.url,
+                                    'client_id', 'client_secret',
+                                    heartbeat_interval=0.05).start()
+
+    def tearDown(self):
+        self.sidecar.stop()
+        self.server.stop()
+        rmtree(self.base_dir)
+        qc.JOB_COMPLETED = False
+
+    def _client(self):
+        return QiitaClient(self.server.url, 'client_id', 'client_secret',
+                           transport=UnixSocketTransport(self.socket_path))
+
+    def test_socket_permissions(self):
+        mode = stat.S_IMODE(os.stat(self.socket_path).st_mode)
+        self.assertEqual(mode & 0o077, 0)
+
+    def test_job_lifecycle(self):
+        job_id = self.server.add_job('NewCmd', {'p1': 1})
+        qclient = self._client()
+        self.assertEqual(qclient.get_job_info(job_id)['status'], 'queued')
+
+        heartbeat_url = '/qiita_db/jobs/%s/heartbeat/' % job_id
+        for _ in range(5):
+            qclient.post(heartbeat_url, data='')
+        # The first heartbeat sets the job as running, and the sidecar keeps
+        # sending them in the background
+        self.assertEqual(self.server.jobs[job_id]['status'], 'running')
+        before = self.server.jobs[job_id]['heartbeats']
+        sleep(0.3)
+        self.assertGreater(self.server.jobs[job_id]['heartbeats'], before)
+
+        qclient.update_job_step(job_id, 'Step 1')
+        self.assertEqual(self.server.jobs[job_id]['step'], 'Step 1')
+
+        qclient.complete_job(job_id, True, artifacts_info=[
+            ArtifactInfo('out1', 'BIOM', [('/tmp/t.biom', 'biom')])],
+            compress=True, stream=True)
+        self.assertEqual(self.server.jobs[job_id]['status'], 'success')
+        self.assertEqual(
+            self.server.jobs[job_id]['result']['artifacts']['out1'][
+                'artifact_type'], 'BIOM')
+        # No more heartbeats are sent once the job completes
+        heartbeats = self.server.jobs[job_id]['heartbeats']
+        sleep(0.2)
+        self.assertEqual(self.server.jobs[job_id]['heartbeats'], heartbeats)
+
+        # The local clients are not authenticated by the server
+        self.assertEqual(self.server.requests.count(
+            ('POST', '/qiita_db/authenticate/')), 1)
+
+    def test_cancelled_job(self):
+        job_id = self.server.add_job('NewCmd', {'p1': 1})
+        qclient = self._client()
+        heartbeat_url = '/qiita_db/jobs/%s/heartbeat/' % job_id
+        qclient.post(heartbeat_url, data='')
+        self.server.jobs[job_id]['status'] = 'error'
+        sleep(0.3)
+        self.assertNotIn(job_id, self.sidecar._heartbeats)
+        self.assertFalse(qclient.post(heartbeat_url, data='')['success'])
+
+    def test_dead_process(self):
+        self.sidecar.local_heartbeat_timeout = 0.2
+        job_id = self.server.add_job('NewCmd', {'p1': 1})
+        qclient = self._client()
+        heartbeat_url = '/qiita_db/jobs/%s/heartbeat/' % job_id
+        qclient.post(heartbeat_url, data='')
+        for _ in range(3):
+            sleep(0.1)
+            qclient.post(heartbeat_url, data='')
+        self.assertIn(job_id, self.sidecar._heartbeats)
+        # The process stops sending heartbeats, e.g. it was killed
+        sleep(0.4)
+        self.assertNotIn(job_id, self.sidecar._heartbeats)
+        heartbeats = self.server.jobs[job_id]['heartbeats']
+        sleep(0.2)
+        self.assertEqual(self.server.jobs[job_id]['heartbeats'], heartbeats)
+
+    def test_get_cache(self):
+        artifact_id = self.server.add_artifact(
+            'BIOM', {'biom': ['/tmp/t.biom']})
+        url = '/qiita_db/artifacts/%s/' % artifact_id
+        qclient = self._client()
+        obs = qclient.get(url)
+        self.assertEqual(qclient.get(url), obs)
+        self.assertEqual(self.server.requests.count(('GET', url)), 1)
+
+        # Any other request invalidates the cached response
+        qclient.patch(url, 'add', '/html_summary/', value='/tmp/index.html')
+        qclient.get(url)
+        self.assertEqual(self.server.requests.count(('GET', url)), 2)
+
+    def test_stop(self):
+        self.sidecar.stop()
+        self.assertFalse(exists(self.socket_path))
+        # tearDown stops it again
+        self.sidecar = QiitaSidecar(self.socket_path, self.server.url,
+                                    'client_id', 'client_secret').start()
+
+
+if __name__ == '__main__':
+    main()
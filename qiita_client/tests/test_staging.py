@@ -0,0 +1,120 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from os import mkdir, listdir
+from os.path import join, exists
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from qiita_client import QiitaPlugin, QiitaCommand, ArtifactInfo
+from qiita_client.checkpoint import Checkpoint
+from qiita_client.staging import stage_outputs
+
+
+class StagingTests(TestCase):
+    def setUp(self):
+        self.base_dir = mkdtemp()
+        self.scratch_dir = join(self.base_dir, 'scratch')
+        self.output_dir = join(self.base_dir, 'output')
+        mkdir(self.scratch_dir)
+        mkdir(self.output_dir)
+
+    def tearDown(self):
+        rmtree(self.base_dir)
+
+    def _write(self, fp, contents):
+        with open(fp, 'w') as f:
+            f.write(contents)
+
+    def test_stage_outputs(self):
+        biom_fp = join(self.scratch_dir, 'table.biom')
+        self._write(biom_fp, 'biom')
+        html_dir = join(self.scratch_dir, 'html')
+        mkdir(html_dir)
+        self._write(join(html_dir, 'index.html'), 'html')
+        self._write(join(self.scratch_dir, 'tmp.txt'), 'intermediate')
+        input_fp = join(self.base_dir, 'input.fastq')
+        self._write(input_fp, 'fastq')
+
+        obs = stage_outputs(
+            self.scratch_dir, self.output_dir,
+            [ArtifactInfo('out1', 'BIOM', [(biom_fp, 'biom'),
+                                           (html_dir, 'directory')]),
+             ArtifactInfo('out2', 'FASTQ', [(input_fp, 'raw_forward_seqs')])])
+
+        exp = [ArtifactInfo('out1', 'BIOM',
+                            [(join(self.output_dir, 'table.biom'), 'biom'),
+                             (join(self.output_dir, 'html'), 'directory')]),
+               ArtifactInfo('out2', 'FASTQ',
+                            [(input_fp, 'raw_forward_seqs')])]
+        self.assertEqual(obs, exp)
+        self.assertEqual(sorted(listdir(self.output_dir)),
+                         ['html', 'table.biom'])
+        with open(join(self.output_dir, 'html', 'index.html')) as f:
+            self.assertEqual(f.read(), 'html')
+        self.assertTrue(exists(input_fp))
+
+    def test_run_task_in_scratch(self):
+        dirs = []
+
+        def func(qclient, job_id, parameters, output_dir):
+            dirs.append(output_dir)
+            fp = join(output_dir, 'out.biom')
+            self._write(fp, 'biom contents')
+            return True, [ArtifactInfo('out1', 'BIOM', [(fp, 'biom')])], ""
+
+        plugin = QiitaPlugin("NewPlugin", "0.0.1", "description",
+                             scratch_dir=self.scratch_dir)
+        cmd = QiitaCommand("NewCmd", "Desc", func, {}, {}, {'out1': 'BIOM'})
+        plugin.register_command(cmd)
+
+        obs = plugin._run_task(None, 'job1', cmd, {}, self.output_dir)
+        exp_fp = join(self.output_dir, 'out.biom')
+        self.assertEqual(
+            obs, (True, [ArtifactInfo('out1', 'BIOM', [(exp_fp, 'biom')])],
+                  ""))
+        self.assertTrue(dirs[0].startswith(self.scratch_dir))
+        with open(exp_fp) as f:
+            self.assertEqual(f.read(), 'biom contents')
+        # The job directory is removed from the scratch directory
+        self.assertEqual(listdir(self.scratch_dir), [])
+
+    def test_run_task_in_scratch_resume(self):
+        calls = []
+
+        def func(qclient, job_id, parameters, output_dir):
+            ckpt = Checkpoint(job_id, output_dir)
+            fp = join(output_dir, 'stage1.txt')
+            if not ckpt.is_done('stage1'):
+                calls.append('stage1')
+                self._write(fp, 'stage1')
+                ckpt.mark_done('stage1', data={'fp': fp})
+            if len(calls) == 1:
+                calls.append('fail')
+                return False, None, "Failure after stage1"
+            return True, [ArtifactInfo('out1', 'BIOM', [(fp, 'biom')])], ""
+
+        plugin = QiitaPlugin("NewPlugin", "0.0.1", "description",
+                             scratch_dir=self.scratch_dir)
+        cmd = QiitaCommand("NewCmd", "Desc", func, {}, {}, {'out1': 'BIOM'})
+        plugin.register_command(cmd)
+
+        obs = plugin._run_task(None, 'job1', cmd, {}, self.output_dir)
+        self.assertEqual(obs, (False, None, "Failure after stage1"))
+        # The job directory is kept, so the job can be resumed
+        self.assertEqual(listdir(self.scratch_dir), ['job1'])
+
+        obs = plugin._run_task(None, 'job1', cmd, {}, self.output_dir)
+        self.assertTrue(obs[0])
+        self.assertEqual(calls, ['stage1', 'fail'])
+        self.assertEqual(listdir(self.scratch_dir), [])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from os import getpid, kill, close, remove
+from tempfile import mkstemp
+from time import sleep, time
+import signal
+
+from qiita_client import ArtifactInfo, QiitaCommand, QiitaPlugin, QiitaClient
+from qiita_client.qiita_client import CancellationToken
+from qiita_client import qiita_client as qc
+from qiita_client import supervisor
+from qiita_client.supervisor import run_supervised, _tree_rss
+from qiita_client.util import system_call
+from qiita_client.fake_qiita import FakeQiitaServer
+from qiita_client.ratelimit import RateLimiter
+from qiita_client.transport import SessionTransport
+
+
+class FakeQiitaClient(object):
+    def __init__(self):
+        self.cancel_token = CancellationToken()
+
+
+class SupervisorTests(TestCase):
+    def setUp(self):
+        self.old_interval = supervisor.POLL_INTERVAL
+        self.old_grace_period = supervisor.STOP_GRACE_PERIOD
+        supervisor.POLL_INTERVAL = 0.05
+
+    def tearDown(self):
+        supervisor.POLL_INTERVAL = self.old_interval
+        supervisor.STOP_GRACE_PERIOD = self.old_grace_period
+
+    def test_run_supervised(self):
+        def func(a, b):
+            return True, [ArtifactInfo('out', 'BIOM', [(a, b)])], ""
+
+        obs = run_supervised('task', func, ('fp', 'biom'), time_limit=10,
+                             memory_limit=10 ** 9)
+        self.assertEqual(
+            obs, (True, [ArtifactInfo('out', 'BIOM', [('fp', 'biom')])], ""))
+
+    def test_run_supervised_client(self):
+        def func(qclient, job_id):
+            qclient.update_job_step(job_id, 'Step 1')
+            return True, None, ""
+
+        with FakeQiitaServer() as server:
+            job_id = server.add_job('NewCmd', {}, status='running')
+            qclient = QiitaClient(server.url, 'client_id', 'client_secret',
+                                  transport=SessionTransport(),
+                                  rate_limiter=RateLimiter(1000))
+            # The locks are held by the parent at the time of the fork, e.g.
+            # while it sends a heartbeat
+            locks = [qclient._servers._lock, qclient.cancel_token._lock,
+                     qclient._rate_limiter._cond]
+            for lock in locks:
+                lock.acquire()
+            try:
+                obs = run_supervised('task', func, (qclient, job_id),
+                                     time_limit=10)
+            finally:
+                for lock in locks:
+                    lock.release()
+            self.assertEqual(obs, (True, None, ""))
+            self.assertEqual(server.jobs[job_id]['step'], 'Step 1')
+            # The parent can still use the client
+            qclient.update_job_step(job_id, 'Step 2')
+            self.assertEqual(server.jobs[job_id]['step'], 'Step 2')
+
+    def test_run_supervised_error(self):
+        def func():
+            raise ValueError('some error')
+
+        success, ainfo, error = run_supervised('task', func, ())
+        self.assertFalse(success)
+        self.assertIsNone(ainfo)
+        self.assertTrue(error.startswith('Error executing task:'))
+        self.assertIn('some error', error)
+
+    def test_run_supervised_time_limit(self):
+        def func():
+            sleep(30)
+
+        start = time()
+        obs = run_supervised('task', func, (), time_limit=0.2)
+        self.assertLess(time() - start, 10)
+        self.assertEqual(
+            obs, (False, None, "Job exceeded its time limit of 0.2 seconds"))
+
+    def test_run_supervised_memory_limit(self):
+        def func():
+            data = bytearray(512 * 1024 * 1024)
+            return True, None, str(len(data))
+
+        success, ainfo, error = run_supervised('task', func, (),
+                                               memory_limit=256 * 1024 * 1024)
+        self.assertFalse(success)
+        self.assertTrue(error.startswith(
+            "Job exceeded its memory limit of 268435456 bytes"))
+
+    def test_run_supervised_cancelled(self):
+        def func():
+            sleep(30)
+
+        token = CancellationToken()
+        token.cancel('test')
+        obs = run_supervised('task', func, (), cancel_token=token)
+        self.assertEqual(obs, (False, None, "Job cancelled: test"))
+
+    def test_run_supervised_stops_commands(self):
+        supervisor.STOP_GRACE_PERIOD = 0.4
+        fd, pid_fp = mkstemp()
+        close(fd)
+        self.addCleanup(remove, pid_fp)
+
+        def func():
+            qc.JOB_CANCEL_TOKEN = CancellationToken()
+            # The command and its children ignore SIGTERM
+            system_call("trap '' TERM; sleep 30 & echo $! > %s; wait"
+                        % pid_fp)
+
+        obs = run_supervised('task', func, (), time_limit=0.5)
+        self.assertEqual(
+            obs, (False, None, "Job exceeded its time limit of 0.5 seconds"))
+        with open(pid_fp) as f:
+            pid = int(f.read())
+        try:
+            with open('/proc/%d/stat' % pid) as f:
+                state = f.read().rsplit(')', 1)[1].split()[0]
+        except IOError:
+            state = None
+        # The process doesn't exist anymore, or is waiting to be reaped
+        self.assertIn(state, (None, 'Z'))
+
+    def test_run_supervised_killed(self):
+        def func():
+            kill(getpid(), signal.SIGKILL)
+
+        success, ainfo, error = run_supervised('task', func, ())
+        self.assertFalse(success)
+        self.assertTrue(error.startswith("Job process killed by signal 9"))
+
+    def test_tree_rss(self):
+        obs = _tree_rss(getpid())
+        if obs is not None:
+            self.assertGreater(obs, 0)
+
+    def test_execute_with_limits(self):
+        def func(qclient, job_id, parameters, out_dir):
+            sleep(30)
+
+        plugin = QiitaPlugin("NewPlugin", "0.0.1", "description")
+        cmd = QiitaCommand("NewCmd", "Desc", func, {}, {}, {},
+                           time_limit=0.2)
+        obs = plugin._execute(FakeQiitaClient(), 'job', cmd, {}, '/tmp')
+        self.assertEqual(
+            obs, (False, None, "Job exceeded its time limit of 0.2 seconds"))
+
+
+if __name__ == '__main__':
+    main()
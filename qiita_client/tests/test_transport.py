@@ -0,0 +1,87 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+from unittest import TestCase, main
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from json import loads
+import gzip
+
+import qiita_client.qiita_client as qc
+from qiita_client import QiitaClient, ArtifactInfo
+from qiita_client.fake_qiita import FakeQiitaServer
+from qiita_client.transport import RecordingTransport, ReplayTransport
+
+
+class TransportTests(TestCase):
+    def setUp(self):
+        self.base_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.base_dir)
+        qc.JOB_COMPLETED = False
+
+    def _record(self, fp):
+        with FakeQiitaServer() as server:
+            job_id = server.add_job('NewCmd', {'p1': 1}, job_id='job1')
+            transport = RecordingTransport(fp)
+            qclient = QiitaClient(server.url, 'my_id', 'my_secret',
+                                  transport=transport)
+            qclient.get_job_info(job_id)
+            qclient.post('/qiita_db/jobs/job1/heartbeat/', data='')
+            qclient.complete_job(job_id, True, artifacts_info=[
+                ArtifactInfo('out1', 'BIOM', [('/tmp/t.biom', 'biom')])],
+                compress=True, stream=True)
+            qclient.close()
+            # The requests sent after closing the recording are not recorded
+            qclient.get_job_info(job_id)
+            return server.url
+
+    def test_record(self):
+        fp = join(self.base_dir, 'job1.jsonl.gz')
+        self._record(fp)
+        with gzip.open(fp, 'rt') as f:
+            contents = f.read()
+        self.assertNotIn('my_secret', contents)
+        records = [loads(line) for line in contents.splitlines()]
+        self.assertEqual(
+            [(r['method'], r['url'], r['status']) for r in records],
+            [('POST', '/qiita_db/authenticate/', 200),
+             ('GET', '/qiita_db/jobs/job1', 200),
+             ('POST', '/qiita_db/jobs/job1/heartbeat/', 200),
+             ('POST', '/qiita_db/jobs/job1/complete/', 200)])
+        self.assertEqual(records[0]['data']['client_secret'], '<redacted>')
+        self.assertEqual(loads(records[0]['response'])['access_token'],
+                         '<redacted>')
+        # The streamed and compressed body is sent and recorded decompressed
+        self.assertTrue(records[3]['data']['success'])
+        self.assertEqual(
+            list(records[3]['data']['artifacts']['out1']['filepaths']),
+            [['/tmp/t.biom', 'biom']])
+
+    def test_replay(self):
+        fp = join(self.base_dir, 'job1.jsonl')
+        url = self._record(fp)
+
+        # The server is no longer running
+        qclient = QiitaClient(url, 'my_id', 'my_secret',
+                              transport=ReplayTransport(fp))
+        obs = qclient.get_job_info('job1')
+        self.assertEqual(obs['parameters'], {'p1': 1})
+        # The last response is repeated
+        qclient.post('/qiita_db/jobs/job1/heartbeat/', data='')
+        qclient.post('/qiita_db/jobs/job1/heartbeat/', data='')
+        qclient.complete_job('job1', True)
+
+        with self.assertRaises(ValueError):
+            qclient.get_job_info('job2')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,13 +7,22 @@
 # -----------------------------------------------------------------------------
 
 from unittest import TestCase, main
-from os import getcwd, close, remove
-from os.path import exists, isdir
+from os import getcwd, close, remove, mkdir
+from os.path import exists, isdir, join
 from shutil import rmtree
 
-from tempfile import mkstemp
+from tempfile import mkstemp, mkdtemp
+from threading import Timer
+from time import time
+import io
+import sys
 
-from qiita_client.util import system_call, get_sample_names_by_run_prefix
+import qiita_client.qiita_client as qc
+from qiita_client.util import (system_call, get_sample_names_by_run_prefix,
+                               get_files_by_run_prefix, link_or_copy,
+                               copy_file, _read_run_prefixes, _reflink)
+from qiita_client.qiita_client import CancellationToken
+from qiita_client.exceptions import JobCancelledError
 
 
 class UtilTests(TestCase):
@@ -40,6 +49,42 @@ class UtilTests(TestCase):
         self.assertTrue("not found" in obs_err)
         self.assertEqual(obs_val, 127)
 
+    def test_system_call_cancel(self):
+        token = CancellationToken()
+        obs_out, obs_err, obs_val = system_call("echo 'a'",
+                                                cancel_token=token)
+        self.assertEqual(obs_out, "a\n")
+        self.assertEqual(obs_val, 0)
+
+        timer = Timer(0.2, token.cancel, args=('test',))
+        timer.start()
+        start = time()
+        # The child of the shell is also terminated
+        obs_out, obs_err, obs_val = system_call("sleep 30; sleep 30",
+                                                cancel_token=token)
+        self.assertLess(time() - start, 10)
+        self.assertNotEqual(obs_val, 0)
+
+        with self.assertRaises(JobCancelledError):
+            system_call("echo 'a'", cancel_token=token)
+
+    def test_system_call_cancel_sigterm_ignored(self):
+        old_grace_period = qc.CANCEL_GRACE_PERIOD
+        qc.CANCEL_GRACE_PERIOD = 0.5
+        self.addCleanup(setattr, qc, 'CANCEL_GRACE_PERIOD', old_grace_period)
+        token = CancellationToken()
+        timer = Timer(0.2, token.cancel, args=('test',))
+        timer.start()
+        start = time()
+        # The shell exits on SIGTERM, but its child ignores it and keeps the
+        # output pipe open until it is killed
+        obs_out, obs_err, obs_val = system_call(
+            "%s -c 'import signal, time; "
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(15)'"
+            "; echo after" % sys.executable, cancel_token=token)
+        self.assertLess(time() - start, 5)
+        self.assertNotEqual(obs_val, 0)
+
     def test_get_sample_names_by_run_prefix(self):
         fd, fp = mkstemp()
         close(fd)
@@ -61,6 +106,127 @@ class UtilTests(TestCase):
         with self.assertRaises(ValueError):
             get_sample_names_by_run_prefix(fp)
 
+    def _write_mapping_file(self, contents):
+        fd, fp = mkstemp()
+        close(fd)
+        with io.open(fp, 'w', encoding='utf-8') as f:
+            f.write(contents)
+        self._clean_up_files.append(fp)
+        return fp
+
+    def test_read_run_prefixes(self):
+        fp = self._write_mapping_file(MAPPING_FILE_2 + u'\n')
+        obs = _read_run_prefixes(fp)
+        exp = {'s3': ['SKB7.640196'], 's1': ['SKB8.640193', 'SKD8.640184']}
+        self.assertEqual(obs, exp)
+
+        fp = self._write_mapping_file(
+            u"#SampleID\trun_prefix\nS\u00e9.1\ts1\n")
+        self.assertEqual(_read_run_prefixes(fp), {'s1': [u'S\u00e9.1']})
+
+    def test_read_run_prefixes_error(self):
+        fp = self._write_mapping_file(u"#SampleID\tDescription\nS1\td\n")
+        with self.assertRaisesRegex(ValueError, "'run_prefix' column"):
+            _read_run_prefixes(fp)
+
+        fp = self._write_mapping_file(
+            u"#SampleID\trun_prefix\tDescription\nS1\ts1\td\nS2\ts2\n")
+        with self.assertRaisesRegex(ValueError, "Line 3 .* has 2 fields"):
+            _read_run_prefixes(fp)
+
+    def _create_files(self, fps):
+        out_dir = mkdtemp()
+        self._clean_up_files.append(out_dir)
+        for fp in fps:
+            with open(join(out_dir, fp), 'w') as f:
+                f.write('\n')
+        return out_dir
+
+    def test_get_files_by_run_prefix(self):
+        out_dir = self._create_files([
+            's1_S1_L001_R1_001.fastq.gz', 's1_S1_L001_R2_001.fastq.gz',
+            's1_S1_L002_R1_001.fastq.gz', 's1_S1_L002_R2_001.fastq.gz',
+            's2_1.fastq', 's2_2.fastq', 's3.fastq', 's4_R2.fastq',
+            'Undetermined_R1.fastq', '.hidden'])
+        mkdir(join(out_dir, 'subdir'))
+
+        obs_matches, obs_unmatched, obs_ambiguous = get_files_by_run_prefix(
+            {'s1': 'S1', 's2': 'S2', 's3': 'S3', 's4': 'S4', 's5': 'S5'},
+            out_dir)
+        exp_matches = {
+            's1': [(join(out_dir, 's1_S1_L001_R1_001.fastq.gz'),
+                    join(out_dir, 's1_S1_L001_R2_001.fastq.gz')),
+                   (join(out_dir, 's1_S1_L002_R1_001.fastq.gz'),
+                    join(out_dir, 's1_S1_L002_R2_001.fastq.gz'))],
+            's2': [(join(out_dir, 's2_1.fastq'), join(out_dir, 's2_2.fastq'))],
+            's3': [(join(out_dir, 's3.fastq'), None)],
+            's4': [(None, join(out_dir, 's4_R2.fastq'))]}
+        self.assertEqual(obs_matches, exp_matches)
+        self.assertEqual(obs_unmatched,
+                         [join(out_dir, 'Undetermined_R1.fastq')])
+        self.assertEqual(obs_ambiguous, {})
+
+    def test_get_files_by_run_prefix_ambiguous(self):
+        out_dir = self._create_files(['s1_R1.fastq', 's10_R1.fastq'])
+        mkdir(join(out_dir, 'subdir'))
+        with open(join(out_dir, 'subdir', 's1_R2.fastq'), 'w') as f:
+            f.write('\n')
+
+        obs_matches, obs_unmatched, obs_ambiguous = get_files_by_run_prefix(
+            ['s1', 's10'], out_dir, recursive=True)
+        self.assertEqual(obs_matches,
+                         {'s1': [(join(out_dir, 's1_R1.fastq'), None),
+                                 (None, join(out_dir, 'subdir',
+                                             's1_R2.fastq'))]})
+        self.assertEqual(obs_unmatched, [])
+        self.assertEqual(obs_ambiguous,
+                         {join(out_dir, 's10_R1.fastq'): ['s1', 's10']})
+
+    def test_link_or_copy(self):
+        src_dir = self._create_files(['a.txt', 'b.txt'])
+        dst_dir = mkdtemp()
+        self._clean_up_files.append(dst_dir)
+
+        link_or_copy(join(src_dir, 'a.txt'), join(dst_dir, 'a.txt'))
+        with open(join(dst_dir, 'a.txt')) as f:
+            self.assertEqual(f.read(), '\n')
+
+        mkdir(join(src_dir, 'sub'))
+        with open(join(src_dir, 'sub', 'c.txt'), 'w') as f:
+            f.write('c')
+        link_or_copy(src_dir, join(dst_dir, 'copy'))
+        self.assertTrue(exists(join(dst_dir, 'copy', 'a.txt')))
+        self.assertTrue(exists(join(dst_dir, 'copy', 'b.txt')))
+        with open(join(dst_dir, 'copy', 'sub', 'c.txt')) as f:
+            self.assertEqual(f.read(), 'c')
+
+        # Like copytree, the destination should not exist
+        with self.assertRaises(OSError):
+            link_or_copy(src_dir, join(dst_dir, 'copy'))
+
+    def test_reflink_existing(self):
+        src_dir = self._create_files(['a.txt', 'b.txt'])
+        with open(join(src_dir, 'b.txt'), 'w') as f:
+            f.write('keep')
+        # A failure doesn't remove a file that was not created by the call
+        with self.assertRaises(OSError):
+            _reflink(join(src_dir, 'a.txt'), join(src_dir, 'b.txt'))
+        with open(join(src_dir, 'b.txt')) as f:
+            self.assertEqual(f.read(), 'keep')
+
+    def test_copy_file(self):
+        src_dir = mkdtemp()
+        self._clean_up_files.append(src_dir)
+        src = join(src_dir, 'seqs.fastq')
+        contents = b'@seq1\nACGT\n+\nIIII\n' * 10000
+        with open(src, 'wb') as f:
+            f.write(contents)
+
+        dst = join(src_dir, 'copy.fastq')
+        copy_file(src, dst)
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), contents)
+
 
 MAPPING_FILE = (
     "#SampleID\tplatform\tbarcode\texperiment_design_description\t"
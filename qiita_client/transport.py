@@ -0,0 +1,489 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import gzip
+import threading
+import zlib
+from json import dumps, loads
+from time import time, sleep
+
+# Keys whose values are replaced in the recorded requests and responses
+SECRET_KEYS = ('client_id', 'client_secret', 'access_token', 'refresh_token')
+
+REDACTED = '<redacted>'
+
+
+def _open(fp, mode):
+    """Opens a recording in binary mode, gzip-compressed if its name ends
+    in .gz"""
+    if fp.endswith('.gz'):
+        return gzip.open(fp, mode + 'b')
+    return open(fp, mode + 'b')
+
+
+def _urlsplit(url):
+    """Splits `url`, importing the split function on first use"""
+    try:
+        from urllib.parse import urlsplit
+    except ImportError:
+        from urlparse import urlsplit
+    return urlsplit(url)
+
+
+def _urlencode(data):
+    """Form-encodes `data`, importing the encode function on first use"""
+    try:
+        from urllib.parse import urlencode
+    except ImportError:
+        from urllib import urlencode
+    return urlencode(data)
+
+
+def _path(url):
+    """Returns the path and query of a url, which identify the endpoint"""
+    parts = _urlsplit(url)
+    return parts.path + ('?' + parts.query if parts.query else '')
+
+
+def _redact(value):
+    """Replaces the values of the SECRET_KEYS in a request or response"""
+    if isinstance(value, dict):
+        return {k: REDACTED if k in SECRET_KEYS else _redact(v)
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+def _tee(chunks, copy):
+    """Yields the chunks of a streamed body, appending them to `copy`"""
+    for chunk in chunks:
+        copy.append(chunk)
+        yield chunk
+
+
+def _request_body(data, headers):
+    """Returns a JSON-serializable version of the body of a request"""
+    if data is None or isinstance(data, dict):
+        return _redact(data)
+    if isinstance(data, bytes):
+        encoding = headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        elif encoding == 'zstd':
+            import zstandard
+            data = zstandard.ZstdDecompressor().decompressobj().decompress(
+                data)
+        data = data.decode('utf-8', 'replace')
+    try:
+        return _redact(loads(data))
+    except ValueError:
+        return data
+
+
+def _read_request_body(rfile, headers):
+    """Reads the body of an HTTP request, which may use chunked encoding
+
+    Parameters
+    ----------
+    rfile : file-like
+        The request stream, positioned at the start of the body
+    headers : email.message.Message
+        The request headers
+
+    Returns
+    -------
+    bytes
+        The body, without decoding its Content-Encoding
+    """
+    if headers.get('Transfer-Encoding', '').lower() != 'chunked':
+        return rfile.read(int(headers.get('Content-Length', 0)))
+
+    chunks = []
+    while True:
+        size = int(rfile.readline().split(b';')[0], 16)
+        if size == 0:
+            # Skip the trailer
+            while rfile.readline().strip():
+                pass
+            return b''.join(chunks)
+        chunks.append(rfile.read(size))
+        rfile.readline()
+
+
+def _response_body(text):
+    """Returns the body of a response, with its secrets redacted"""
+    try:
+        return dumps(_redact(loads(text)))
+    except ValueError:
+        return text
+
+
+class RecordingTransport(object):
+    """Sends the requests to the server, recording them with their responses
+
+    Each request is written as a JSON line to the recording (compressed with
+    gzip if its name ends in .gz) with its method, endpoint, body, response
+    status, response body, start time (relative to the first request) and
+    duration. The Authorization header is not recorded, and the values of
+    the SECRET_KEYS are redacted.
+
+    Parameters
+    ----------
+    fp : str
+        The filepath of the recording
+
+    Notes
+    -----
+    The recording is closed when the interpreter exits, if `close` wasn't
+    called before. The requests sent after closing it are not recorded.
+    """
+    def __init__(self, fp):
+        import atexit
+
+        self.fp = fp
+        self._lock = threading.Lock()
+        self._start = None
+        self._file = _open(fp, 'w')
+        # Otherwise the end of a compressed recording may never be written
+        atexit.register(self.close)
+
+    def request(self, method, url, **kwargs):
+        """Sends a request
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method
+        url : str
+            The url
+        kwargs : dict
+            The request kwargs
+
+        Returns
+        -------
+        requests.Response
+            The response
+        """
+        import requests
+
+        data = kwargs.get('data')
+        streamed = data is not None and not isinstance(
+            data, (type(u''), bytes, dict))
+        if streamed:
+            # A streamed body can only be read once, so its chunks are
+            # recorded as they are sent
+            chunks = []
+            kwargs['data'] = _tee(data, chunks)
+        start = time()
+        r = requests.request(method, url, **kwargs)
+        elapsed = time() - start
+        if streamed:
+            data = b''.join(chunks)
+        record = {'method': method.upper(), 'url': _path(url),
+                  'data': _request_body(data, kwargs.get('headers') or {}),
+                  'status': r.status_code,
+                  'response': _response_body(r.text),
+                  'elapsed': elapsed}
+        with self._lock:
+            if self._file.closed:
+                return r
+            if self._start is None:
+                self._start = start
+            record['start'] = start - self._start
+            self._file.write((dumps(record) + '\n').encode('utf-8'))
+            self._file.flush()
+        return r
+
+    def close(self):
+        """Closes the recording"""
+        with self._lock:
+            self._file.close()
+
+    def _after_fork(self):
+        """Re-creates the lock in a forked process, where it may have been
+        held by a thread of the parent"""
+        self._lock = threading.Lock()
+
+
+class _ReplayedResponse(object):
+    """A recorded response, with the interface used by QiitaClient"""
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    @property
+    def content(self):
+        return self.text.encode('utf-8')
+
+    def json(self):
+        return loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        content = self.content
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+class ReplayTransport(object):
+    """Answers the requests with the responses of a recording
+
+    The requests are matched to the recorded ones by method and endpoint,
+    in order. If a request is issued more times than recorded (e.g. the
+    heartbeats of a job that runs longer), the last recorded response is
+    repeated.
+
+    Parameters
+    ----------
+    fp : str
+        The filepath of the recording
+    realtime : bool, optional
+        Whether to wait the recorded duration of each request before
+        answering it, to reproduce the server latency. Default: False
+
+    Raises
+    ------
+    ValueError
+        If a request was not recorded
+    """
+    def __init__(self, fp, realtime=False):
+        self.fp = fp
+        self.realtime = realtime
+        self._lock = threading.Lock()
+        self._responses = {}
+        with _open(fp, 'r') as f:
+            for line in f:
+                record = loads(line.decode('utf-8'))
+                self._responses.setdefault(
+                    (record['method'], record['url']), []).append(record)
+
+    def request(self, method, url, **kwargs):
+        """Answers a request with its recorded response
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method
+        url : str
+            The url
+        kwargs : dict
+            The request kwargs, ignored
+
+        Returns
+        -------
+        object
+            The recorded response, with the `status_code`, `text` and
+            `content` attributes and the `json`, `iter_content` and `close`
+            methods of a requests.Response
+        """
+        key = (method.upper(), _path(url))
+        with self._lock:
+            records = self._responses.get(key)
+            if not records:
+                raise ValueError("No recorded response for %s %s" % key)
+            record = records.pop(0) if len(records) > 1 else records[0]
+        if self.realtime:
+            sleep(record['elapsed'])
+        return _ReplayedResponse(record['status'], record['response'])
+
+    def close(self):
+        pass
+
+
+class SessionTransport(object):
+    """Sends the requests through a `requests.Session`
+
+    The session keeps the connections to the server open and reuses them
+    between requests, instead of opening a new connection for each one.
+    """
+    def __init__(self):
+        import requests
+
+        self.session = requests.Session()
+
+    def request(self, method, url, **kwargs):
+        """Sends a request, see `requests.Session.request`"""
+        return self.session.request(method, url, **kwargs)
+
+    def close(self):
+        """Closes the connections of the session"""
+        self.session.close()
+
+    def _after_fork(self):
+        """Uses a new session in a forked process, so it doesn't share the
+        connections (and the locks of their pool) with the parent"""
+        import requests
+
+        self.session = requests.Session()
+
+
+# Created on first use by _unix_http_connection, so importing the package
+# doesn't load http.client
+_UnixHTTPConnection = None
+
+
+def _unix_http_connection(socket_path, timeout=None):
+    """Returns an HTTP connection over a Unix domain socket"""
+    global _UnixHTTPConnection
+    if _UnixHTTPConnection is None:
+        import socket
+        try:
+            from http.client import HTTPConnection
+        except ImportError:
+            from httplib import HTTPConnection
+
+        class UnixHTTPConnection(HTTPConnection):
+            def __init__(self, socket_path, timeout=None):
+                HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+                self.socket_path = socket_path
+
+            def connect(self):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                if self.timeout is not None:
+                    sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                self.sock = sock
+
+        _UnixHTTPConnection = UnixHTTPConnection
+    return _UnixHTTPConnection(socket_path, timeout=timeout)
+
+
+def _send_chunked(conn, method, path, chunks, headers):
+    """Sends a request whose body is an iterable of bytes with chunked
+    transfer encoding
+
+    `HTTPConnection.request` only encodes the chunks itself since Python 3.6,
+    so they are framed here
+    """
+    names = set(name.lower() for name in headers)
+    conn.putrequest(method, path,
+                    skip_accept_encoding='accept-encoding' in names)
+    for name, value in headers.items():
+        conn.putheader(name, value)
+    conn.putheader('Transfer-Encoding', 'chunked')
+    conn.endheaders()
+    for chunk in chunks:
+        if chunk:
+            conn.send(('%x\r\n' % len(chunk)).encode('ascii') + chunk +
+                      b'\r\n')
+    conn.send(b'0\r\n\r\n')
+
+
+class _SocketResponse(object):
+    """A response read from a Unix socket, with the interface used by
+    QiitaClient"""
+    def __init__(self, conn, response):
+        self._conn = conn
+        self._response = response
+        self._content = None
+        self.status_code = response.status
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self._response.read()
+            self.close()
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return loads(self.text)
+
+    def iter_content(self, chunk_size=1):
+        if self._content is not None:
+            for i in range(0, len(self._content), chunk_size):
+                yield self._content[i:i + chunk_size]
+            return
+        while True:
+            chunk = self._response.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+
+class UnixSocketTransport(object):
+    """Sends the requests to a server listening on a Unix domain socket
+
+    It is used to route the requests through a
+    `qiita_client.sidecar.QiitaSidecar`. Only the path of the urls is sent,
+    the sidecar forwards the requests to its server.
+
+    Parameters
+    ----------
+    socket_path : str
+        The path of the socket
+    timeout : float, optional
+        The timeout of the socket operations, in seconds. Default: no timeout
+    """
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, method, url, data=None, headers=None, stream=False,
+                **kwargs):
+        """Sends a request
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method
+        url : str
+            The url
+        data : dict, str, bytes or iterable of bytes, optional
+            The request body. Dictionaries are form-encoded, and iterables
+            are sent with chunked transfer encoding
+        headers : dict, optional
+            The request headers
+        stream : bool, optional
+            Whether the response body is read when it is accessed, instead of
+            before returning. Default: False
+        kwargs : dict
+            Other request kwargs (e.g. `verify`), ignored
+
+        Returns
+        -------
+        object
+            The response, with the `status_code`, `text` and `content`
+            attributes and the `json`, `iter_content` and `close` methods of
+            a requests.Response
+        """
+        headers = dict(headers or {})
+        if isinstance(data, dict):
+            data = _urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if isinstance(data, type(u'')):
+            data = data.encode('utf-8')
+        conn = _unix_http_connection(self.socket_path, timeout=self.timeout)
+        try:
+            if data is None or isinstance(data, bytes):
+                conn.request(method.upper(), _path(url), body=data,
+                             headers=headers)
+            else:
+                _send_chunked(conn, method.upper(), _path(url), data,
+                              headers)
+            response = conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+        r = _SocketResponse(conn, response)
+        if not stream:
+            r.content
+        return r
+
+    def close(self):
+        pass
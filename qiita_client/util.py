@@ -6,12 +6,31 @@
 # The full license is in the file LICENSE, distributed with this software.
 # -----------------------------------------------------------------------------
 
-import pandas as pd
+import re
+import csv
+import sys
+import signal
 
+import os
+from io import open
+from os import listdir, link, remove, fstat
+from os.path import join, isdir, relpath
+from shutil import copy2, copyfileobj, copymode
 from subprocess import Popen, PIPE
 
+# Matches the read direction token in a sequence file name, e.g. the '_R1_'
+# in 's1_S1_L001_R1_001.fastq.gz' or the '_2.' in 's1_2.fastq'
+READ_DIRECTION_RE = re.compile(r'(?<=[._-])R?([12])(?=[._-]|$)')
 
-def system_call(cmd):
+# The Linux FICLONE ioctl, which clones a file in copy-on-write filesystems
+# (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# Maximum number of bytes transferred in each copy_file_range/sendfile call
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def system_call(cmd, cancel_token=None):
     """Call command and return (stdout, stderr, return_value)
 
     Parameters
@@ -19,6 +38,10 @@ def system_call(cmd):
     cmd : str or iterator of str
         The string containing the command to be run, or a sequence of strings
         that are the tokens of the command.
+    cancel_token : qiita_client.qiita_client.CancellationToken, optional
+        If the token is cancelled while the command is running, the command
+        and all its child processes are terminated. Default: the cancellation
+        token of the job running in this process, if any
 
     Returns
     -------
@@ -34,15 +57,97 @@ def system_call(cmd):
     the authors of this function to port it to Qiita and keep it under BSD
     license.
     """
-    proc = Popen(cmd, universal_newlines=True, shell=True, stdout=PIPE,
-                 stderr=PIPE)
-    # Communicate pulls all stdout/stderr from the PIPEs
-    # This call blocks until the command is done
-    stdout, stderr = proc.communicate()
+    if cancel_token is None:
+        from .qiita_client import JOB_CANCEL_TOKEN as cancel_token
+
+    if cancel_token is None:
+        proc = Popen(cmd, universal_newlines=True, shell=True, stdout=PIPE,
+                     stderr=PIPE)
+        # Communicate pulls all stdout/stderr from the PIPEs
+        # This call blocks until the command is done
+        stdout, stderr = proc.communicate()
+    else:
+        cancel_token.check()
+        # Start the command in its own process group, so the shell and all
+        # the processes it starts can be terminated together. It stays in
+        # the session of the plugin, so a scheduler that kills the session of
+        # the job also kills it
+        if sys.version_info >= (3, 11):
+            group_kwargs = {'process_group': 0}
+        else:
+            group_kwargs = {'preexec_fn': os.setpgrp}
+        proc = Popen(cmd, universal_newlines=True, shell=True, stdout=PIPE,
+                     stderr=PIPE, **group_kwargs)
+        cancel_token.register_process(proc)
+        try:
+            stdout, stderr = proc.communicate()
+        except BaseException:
+            # E.g. a KeyboardInterrupt: the command is not in the foreground
+            # process group, so it didn't receive the signal
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            raise
+        finally:
+            cancel_token.unregister_process(proc)
     return_value = proc.returncode
     return stdout, stderr, return_value
 
 
+def _read_run_prefixes(mapping_file):
+    """Groups the sample ids of a mapping file by run_prefix
+
+    Parameters
+    ----------
+    mapping_file : str
+        The mapping file
+
+    Returns
+    -------
+    dict of {str: list of str}
+        The sample ids of each run_prefix
+
+    Raises
+    ------
+    ValueError
+        If the mapping file doesn't have the '#SampleID' or 'run_prefix'
+        columns
+        If a row doesn't have as many fields as the header
+    """
+    # The csv module of Python 2 only reads bytes
+    py2 = sys.version_info[0] == 2
+    if py2:
+        f = open(mapping_file, 'rb')
+    else:
+        f = open(mapping_file, encoding='utf-8', newline='')
+    with f:
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader, [])
+        if py2:
+            header = [v.decode('utf-8') for v in header]
+        for column in ('#SampleID', 'run_prefix'):
+            if column not in header:
+                raise ValueError("The mapping file %s doesn't have the '%s' "
+                                 "column" % (mapping_file, column))
+        sid_idx = header.index('#SampleID')
+        rp_idx = header.index('run_prefix')
+
+        by_prefix = {}
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(header):
+                raise ValueError(
+                    "Line %d of the mapping file %s has %d fields, but its "
+                    "header has %d" % (reader.line_num, mapping_file,
+                                       len(row), len(header)))
+            if py2:
+                row = [v.decode('utf-8') for v in row]
+            by_prefix.setdefault(row[rp_idx], []).append(row[sid_idx])
+    return by_prefix
+
+
 def get_sample_names_by_run_prefix(mapping_file):
     """Generates a dictionary of run_prefix and sample names
 
@@ -60,25 +165,274 @@ def get_sample_names_by_run_prefix(mapping_file):
     ------
     ValueError
         If there is more than 1 sample per run_prefix
-    """
 
-    qiime_map = pd.read_csv(mapping_file, delimiter='\t', dtype=str,
-                            encoding='utf-8', keep_default_na=False,
-                            na_values=[])
-    qiime_map.set_index('#SampleID', inplace=True)
+    Notes
+    -----
+    pandas is imported on first use. If it is not installed, the mapping
+    file is parsed with the csv module instead.
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        by_prefix = _read_run_prefixes(mapping_file)
+    else:
+        qiime_map = pd.read_csv(mapping_file, delimiter='\t', dtype=str,
+                                encoding='utf-8', keep_default_na=False,
+                                na_values=[])
+        # Grouping the columns directly avoids building a DataFrame per
+        # run_prefix, which dominates the time of large mapping files
+        by_prefix = {}
+        for sample_id, prefix in zip(qiime_map['#SampleID'],
+                                     qiime_map['run_prefix']):
+            by_prefix.setdefault(prefix, []).append(sample_id)
 
     samples = {}
     errors = []
-    for prefix, df in qiime_map.groupby('run_prefix'):
-        len_df = len(df)
-        if len_df != 1:
-            errors.append('%s has %d samples (%s)' % (prefix, len_df,
-                                                      ', '.join(df.index)))
+    for prefix in sorted(by_prefix):
+        sample_ids = by_prefix[prefix]
+        len_ids = len(sample_ids)
+        if len_ids != 1:
+            errors.append('%s has %d samples (%s)' % (prefix, len_ids,
+                                                      ', '.join(sample_ids)))
         else:
-            samples[prefix] = df.index.values[0]
+            samples[prefix] = sample_ids[0]
 
     if errors:
         raise ValueError("You have run_prefix values with multiple "
                          "samples: %s" % ' -- '.join(errors))
 
     return samples
+
+
+def _build_prefix_trie(run_prefixes):
+    """Builds a character trie over the given run prefixes
+
+    Parameters
+    ----------
+    run_prefixes : iterable of str
+        The run prefixes
+
+    Returns
+    -------
+    dict
+        The root node of the trie. Each node is a dict keyed by character, and
+        the nodes in which a run prefix ends hold the run prefix under the
+        `None` key
+    """
+    root = {}
+    for prefix in run_prefixes:
+        node = root
+        for c in prefix:
+            node = node.setdefault(c, {})
+        node[None] = prefix
+    return root
+
+
+def _find_prefixes(trie, name):
+    """Returns all the run prefixes in `trie` that are a prefix of `name`"""
+    found = []
+    node = trie
+    for c in name:
+        node = node.get(c)
+        if node is None:
+            break
+        if None in node:
+            found.append(node[None])
+    return found
+
+
+def _scan_files(directory, recursive):
+    """Yields (filename, filepath) for all the files under `directory`"""
+    dirs = [directory]
+    while dirs:
+        current = dirs.pop()
+        for name in listdir(current):
+            if name.startswith('.'):
+                continue
+            fp = join(current, name)
+            if isdir(fp):
+                if recursive:
+                    dirs.append(fp)
+            else:
+                yield name, fp
+
+
+def get_files_by_run_prefix(run_prefixes, directory, recursive=False):
+    """Matches the files in a directory to their run prefix
+
+    Parameters
+    ----------
+    run_prefixes : iterable of str
+        The run prefixes to match against. The dictionary returned by
+        `get_sample_names_by_run_prefix` can be used directly
+    directory : str
+        The directory containing the files
+    recursive : bool, optional
+        Whether to also scan the subdirectories of `directory`.
+        Default: False
+
+    Returns
+    -------
+    dict of {str: list of (str, str)}
+        The matched files keyed by run prefix. The values are a list of
+        (forward filepath, reverse filepath) pairs, sorted by filepath. The
+        reverse filepath is None if the file doesn't have a mate and the
+        forward filepath is None if only the reverse read was found
+    list of str
+        The filepaths that didn't match any run prefix
+    dict of {str: list of str}
+        The filepaths that matched more than one run prefix, keyed by
+        filepath, with the list of matching run prefixes as values
+
+    Notes
+    -----
+    The run prefixes are indexed in a trie, so each file is matched in a time
+    proportional to the length of its name, independently of the number of
+    run prefixes. The read direction is taken from the last '_R1'/'_R2' (or
+    '_1'/'_2') token in the file name; files without it are considered
+    forward reads.
+    """
+    trie = _build_prefix_trie(run_prefixes)
+
+    reads = {}
+    unmatched = []
+    ambiguous = {}
+    for name, fp in _scan_files(directory, recursive):
+        prefixes = _find_prefixes(trie, name)
+        if not prefixes:
+            unmatched.append(fp)
+            continue
+        if len(prefixes) > 1:
+            ambiguous[fp] = prefixes
+            continue
+
+        prefix = prefixes[0]
+        # The read direction is searched after the run prefix, so run prefixes
+        # that look like a read direction token do not confuse the pairing
+        directions = list(READ_DIRECTION_RE.finditer(name, len(prefix)))
+        if directions:
+            d = directions[-1]
+            key = name[:d.start(1)] + name[d.end(1):]
+            idx = 0 if d.group(1) == '1' else 1
+        else:
+            key = name
+            idx = 0
+        pair = reads.setdefault(prefix, {}).setdefault(
+            join(fp[:-len(name)], key), [None, None])
+        pair[idx] = fp
+
+    matches = {prefix: sorted((tuple(p) for p in pairs.values()),
+                              key=lambda p: p[0] or p[1])
+               for prefix, pairs in reads.items()}
+
+    return matches, sorted(unmatched), ambiguous
+
+
+def _reflink(src, dst):
+    """Clones `src` into `dst` using a copy-on-write reflink
+
+    Raises
+    ------
+    OSError
+        If the filesystem doesn't support reflinks
+    """
+    import fcntl
+
+    with open(src, 'rb') as f_src:
+        # O_EXCL makes sure the file removed on failure is the one created
+        # here
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            try:
+                fcntl.ioctl(fd, FICLONE, f_src.fileno())
+            finally:
+                os.close(fd)
+        except (IOError, OSError):
+            remove(dst)
+            raise
+
+
+def link_or_copy(src, dst):
+    """Makes the contents of `src` available in `dst` copying as little data
+    as possible
+
+    Parameters
+    ----------
+    src : str
+        The source file or directory
+    dst : str
+        The destination path. It should not exist
+
+    Notes
+    -----
+    For each file a copy-on-write clone (reflink) is tried first, then a hard
+    link and, if both fail (e.g. `src` and `dst` are in different
+    filesystems), a regular copy. Note that hard linked files share their
+    contents, so they should not be modified in place.
+    """
+    if isdir(src):
+        # Like shutil.copytree, which only accepts a copy function in Python 3
+        for dirpath, _, filenames in os.walk(src, followlinks=True):
+            target = dst if dirpath == src else join(dst,
+                                                     relpath(dirpath, src))
+            os.makedirs(target)
+            copymode(dirpath, target)
+            for name in filenames:
+                link_or_copy(join(dirpath, name), join(target, name))
+        return
+    try:
+        _reflink(src, dst)
+        return
+    except (IOError, OSError, ImportError):
+        pass
+    try:
+        link(src, dst)
+        return
+    except OSError:
+        pass
+    copy2(src, dst)
+
+
+def copy_file(src, dst):
+    """Copies a file, keeping the data in the kernel when possible
+
+    Parameters
+    ----------
+    src : str
+        The source file
+    dst : str
+        The destination file
+
+    Notes
+    -----
+    The data is copied with `os.copy_file_range` (which lets the filesystem
+    clone or copy the data server-side, e.g. in NFS 4.2) or `os.sendfile`,
+    falling back to a regular buffered copy if neither is available. The
+    permission bits are also copied.
+    """
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        size = fstat(f_src.fileno()).st_size
+        in_fd, out_fd = f_src.fileno(), f_dst.fileno()
+        copied = 0
+        for func in ('copy_file_range', 'sendfile'):
+            if not hasattr(os, func):
+                continue
+            try:
+                while copied < size:
+                    if func == 'copy_file_range':
+                        n = os.copy_file_range(in_fd, out_fd, COPY_CHUNK_SIZE)
+                    else:
+                        n = os.sendfile(out_fd, in_fd, copied,
+                                        COPY_CHUNK_SIZE)
+                    if n == 0:
+                        break
+                    copied += n
+                break
+            except OSError:
+                if copied:
+                    raise
+        if copied < size:
+            f_src.seek(copied)
+            f_dst.seek(copied)
+            copyfileobj(f_src, f_dst, COPY_CHUNK_SIZE)
+    copymode(src, dst)
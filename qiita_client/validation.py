@@ -0,0 +1,111 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2014--, The Qiita Development Team.
+#
+# Distributed under the terms of the BSD 3-clause License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# -----------------------------------------------------------------------------
+
+import traceback
+import sys
+from os.path import getsize, isfile
+
+
+def _run_validator(task):
+    """Runs a file validator, capturing any error it raises
+
+    Parameters
+    ----------
+    task : (callable, str, str)
+        The validator, the filepath and the filepath type
+
+    Returns
+    -------
+    str or None
+        The error message, if the file is not valid
+    """
+    func, fp, fp_type = task
+    try:
+        return func(fp, fp_type)
+    except Exception:
+        return "Error validating:\n%s" % ''.join(
+            traceback.format_exception(*sys.exc_info()))
+
+
+def validate_files(validators, files, artifact_type=None, n_jobs=None):
+    """Validates a set of files in parallel
+
+    Parameters
+    ----------
+    validators : dict of {(str or None, str): callable}
+        The file validators, keyed by (artifact type, filepath type). The
+        validators with artifact type None apply to all artifact types. Each
+        validator should be a module-level function (so it can be sent to
+        the worker processes) conforming to the signature
+        `str or None = validator(filepath, filepath_type)`, returning an
+        error message if the file is not valid
+    files : dict of {str: list of str}
+        The filepaths to validate, keyed by filepath type
+    artifact_type : str, optional
+        The type of the artifact the files belong to
+    n_jobs : int, optional
+        The number of worker processes. Default: the number of CPUs
+
+    Returns
+    -------
+    list of str
+        The validation errors, in the order of `files`
+    """
+    tasks = []
+    for fp_type, fps in files.items():
+        func = validators.get((artifact_type, fp_type),
+                              validators.get((None, fp_type)))
+        if func is not None:
+            tasks.extend((func, fp, fp_type) for fp in fps)
+
+    if not tasks:
+        return []
+
+    from multiprocessing import Pool, cpu_count
+
+    n_jobs = min(n_jobs or cpu_count(), len(tasks))
+    if n_jobs == 1:
+        results = [_run_validator(t) for t in tasks]
+    else:
+        # Start the largest files first, so a big file at the end of the list
+        # doesn't leave the other workers idle
+        order = sorted(range(len(tasks)), reverse=True,
+                       key=lambda i: getsize(tasks[i][1])
+                       if isfile(tasks[i][1]) else 0)
+        pool = Pool(n_jobs)
+        try:
+            sorted_results = pool.map(_run_validator,
+                                      [tasks[i] for i in order], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        results = [None] * len(tasks)
+        for i, res in zip(order, sorted_results):
+            results[i] = res
+
+    return ["%s (%s): %s" % (fp, fp_type, error)
+            for (_, fp, fp_type), error in zip(tasks, results) if error]
+
+
+def missing_filepath_types(artifact_type, files):
+    """Returns the required filepath types missing from an artifact
+
+    Parameters
+    ----------
+    artifact_type : QiitaArtifactType
+        The artifact type
+    files : dict of {str: list of str}
+        The filepaths of the artifact, keyed by filepath type
+
+    Returns
+    -------
+    list of str
+        The required filepath types without any file
+    """
+    return [fp_type for fp_type, required in artifact_type.fp_types
+            if required and not files.get(fp_type)]